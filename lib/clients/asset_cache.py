@@ -0,0 +1,193 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import collections
+import email.utils
+import gzip
+import hashlib
+import importlib.resources
+import mimetypes
+import pathlib
+import threading
+import time
+
+MAX_CACHE_SIZE = 33554432       # total bytes of file data kept in memory
+MAX_CACHED_FILE_SIZE = 2097152  # larger files are sent from the file on each request
+FILE_BLOCK_SIZE = 65536         # bytes read at a time when sending a large file
+MIN_GZIP_SIZE = 512
+COMPRESSIBLE_TYPES = ['text/', 'application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml']
+
+
+class AssetCache:
+    """
+    In memory cache of the files sent by do_file_response.  Package files
+    only change on an upgrade, so they are read once.  Other files are
+    checked for a new modified time or size on each request.  Each entry
+    has a strong ETag and, for text types, a precompressed gzip copy.
+    Files over MAX_CACHED_FILE_SIZE are not read here.  Their ETag comes
+    from the file stat and they are sent in blocks without compression.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assets = collections.OrderedDict()
+        self.cache_size = 0
+        self.start_time = time.time()
+
+    def get_asset(self, _package, _reply_file):
+        """
+        Returns the asset dict for the file.  Raises the same exceptions
+        as reading the file directly.
+        """
+        if _package:
+            key = (_package, _reply_file)
+            asset = self.lookup(key)
+            if asset is None:
+                data = importlib.resources.read_binary(_package, _reply_file)
+                asset = self.build_asset(data, _reply_file, self.start_time, None)
+                self.store(key, asset)
+            return asset
+
+        file_path = pathlib.Path(str(_reply_file))
+        stat = file_path.stat()
+        if stat.st_size > MAX_CACHED_FILE_SIZE:
+            return self.build_file_asset(file_path, stat)
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        key = str(file_path)
+        asset = self.lookup(key)
+        if asset is None or asset['stat'] != file_stat:
+            with open(file_path, 'br') as reader:
+                data = reader.read()
+            asset = self.build_asset(data, _reply_file, stat.st_mtime, file_stat)
+            self.store(key, asset)
+        return asset
+
+    def lookup(self, _key):
+        with self.lock:
+            asset = self.assets.get(_key)
+            if asset is not None:
+                self.assets.move_to_end(_key)
+            return asset
+
+    def store(self, _key, _asset):
+        if _asset['size'] > MAX_CACHED_FILE_SIZE:
+            return
+        with self.lock:
+            old_asset = self.assets.pop(_key, None)
+            if old_asset is not None:
+                self.cache_size -= old_asset['size']
+            self.assets[_key] = _asset
+            self.cache_size += _asset['size']
+            while self.cache_size > MAX_CACHE_SIZE:
+                _, old_asset = self.assets.popitem(last=False)
+                self.cache_size -= old_asset['size']
+
+    def build_file_asset(self, _file_path, _stat):
+        """
+        Returns the asset dict for a large file without reading it.
+        The data is None and the file is sent from 'path'.
+        """
+        return {
+            'data': None,
+            'path': _file_path,
+            'gzip': None,
+            'mime': get_mime_type(_file_path),
+            'etag': '"{:x}-{:x}-{:x}"'.format(_stat.st_ino, _stat.st_mtime_ns, _stat.st_size),
+            'last_modified': email.utils.formatdate(_stat.st_mtime, usegmt=True),
+            'stat': (_stat.st_mtime_ns, _stat.st_size),
+            'size': _stat.st_size}
+
+    def build_asset(self, _data, _reply_file, _mtime, _stat):
+        mime_type = get_mime_type(_reply_file)
+        if len(_data) > MAX_CACHED_FILE_SIZE:
+            # package files larger than the cache limit are not hashed or compressed
+            return {
+                'data': _data,
+                'gzip': None,
+                'mime': mime_type,
+                'etag': '"{:x}-{:x}"'.format(int(self.start_time), len(_data)),
+                'last_modified': email.utils.formatdate(_mtime, usegmt=True),
+                'stat': _stat,
+                'size': len(_data)}
+        gzip_data = None
+        if len(_data) >= MIN_GZIP_SIZE \
+                and any(mime_type.startswith(t) for t in COMPRESSIBLE_TYPES):
+            gzip_data = gzip.compress(_data, mtime=0)
+            if len(gzip_data) >= len(_data):
+                gzip_data = None
+        size = len(_data)
+        if gzip_data is not None:
+            size += len(gzip_data)
+        return {
+            'data': _data,
+            'gzip': gzip_data,
+            'mime': mime_type,
+            'etag': '"{}"'.format(hashlib.sha1(_data).hexdigest()),
+            'last_modified': email.utils.formatdate(_mtime, usegmt=True),
+            'stat': _stat,
+            'size': size}
+
+
+def get_mime_type(_reply_file):
+    mime_type = mimetypes.guess_type(str(_reply_file))[0]
+    if mime_type is None:
+        mime_type = 'application/octet-stream'
+    return mime_type
+
+
+def accepts_gzip(_accept_encoding):
+    """
+    Checks the Accept-Encoding request header for gzip, either named
+    or through *, with a q-value above 0
+    """
+    if not _accept_encoding:
+        return False
+    gzip_q = None
+    any_q = None
+    for coding in _accept_encoding.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name in ['gzip', 'x-gzip']:
+            gzip_q = q
+        elif name == '*':
+            any_q = q
+    if gzip_q is None:
+        gzip_q = any_q
+    return gzip_q is not None and gzip_q > 0
+
+
+def etag_matches(_if_none_match, _etag):
+    """
+    Checks the If-None-Match request header against the ETag
+    """
+    if not _if_none_match:
+        return False
+    for tag in _if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag == _etag or tag == 'W/' + _etag:
+            return True
+    return False
@@ -18,8 +18,8 @@ substantial portions of the Software.
 
 import io
 import logging
+import threading
 import urllib.request
-from io import StringIO
 from xml.sax.saxutils import escape
 
 import lib.common.utils as utils
@@ -29,6 +29,8 @@ from lib.db.db_channels import DBChannels
 import lib.image_size.get_image_size as get_image_size
 from lib.common.decorators import handle_url_except
 
+THUMBNAIL_TIMEOUT = 8   # seconds for each thumbnail download
+
 
 @getrequest.route('/playlist')
 def playlist(_webserver):
@@ -39,7 +41,7 @@ def playlist(_webserver):
 
 @getrequest.route('/channels.m3u')
 def channels_m3u(_webserver):
-    _webserver.do_mime_response(200, 'audio/x-mpegurl', get_channels_m3u(
+    _webserver.do_stream_response(200, 'audio/x-mpegurl', get_channels_m3u(
         _webserver.config, _webserver.stream_url,
         _webserver.query_data['name'],
         _webserver.query_data['instance'],
@@ -49,7 +51,7 @@ def channels_m3u(_webserver):
 
 @getrequest.route('/lineup.xml')
 def lineup_xml(_webserver):
-    _webserver.do_mime_response(200, 'application/xml', get_channels_xml(
+    _webserver.do_stream_response(200, 'application/xml', get_channels_xml(
         _webserver.config, _webserver.stream_url,
         _webserver.query_data['name'],
         _webserver.query_data['instance'],
@@ -59,7 +61,7 @@ def lineup_xml(_webserver):
 
 @getrequest.route('/lineup.json')
 def lineup_json(_webserver):
-    _webserver.do_mime_response(200, 'application/json', get_channels_json(
+    _webserver.do_stream_response(200, 'application/json', get_channels_json(
         _webserver.config, _webserver.stream_url,
         _webserver.query_data['name'],
         _webserver.query_data['instance'],
@@ -68,18 +70,18 @@ def lineup_json(_webserver):
 
 
 def get_channels_m3u(_config, _base_url, _namespace, _instance, _plugins):
+    """
+    Generator returning the playlist one channel at a time
+    """
     format_descriptor = '#EXTM3U'
     record_marker = '#EXTINF'
     ch_obj = ChannelsURL(_config, _base_url)
 
     db = DBChannels(_config)
     ch_data = db.get_channels(_namespace, _instance)
-    fakefile = StringIO()
-    fakefile.write(
-        '%s\n' % format_descriptor
-    )
+    yield '%s\n' % format_descriptor
 
-    sids_processed = []
+    sids_processed = set()
     for sid, sid_data_list in ch_data.items():
         for sid_data in sid_data_list:
             if sid in sids_processed:
@@ -94,7 +96,7 @@ def get_channels_m3u(_config, _base_url, _namespace, _instance, _plugins):
             config_section = utils.instance_config_section(sid_data['namespace'], sid_data['instance'])
             if not _config[config_section]['enabled']:
                 continue
-            sids_processed.append(sid)
+            sids_processed.add(sid)
             stream = _config[config_section]['player-stream_type']
             if stream == 'm3u8redirect' and sid_data['json'].get('stream_url'):
                 uri = sid_data['json']['stream_url']
@@ -121,40 +123,33 @@ def get_channels_m3u(_config, _base_url, _namespace, _instance, _plugins):
                 str(sid_data['display_number']), sid_data['namespace'],
                 sid_data['instance'], _config)
             service_name = ch_obj.set_service_name(sid_data)
-            fakefile.write(
-                '%s\n' % (
-                        record_marker + ':-1' + ' ' +
-                        'channelID=\'' + sid + '\' ' +
-                        'tvg-num=\'' + updated_chnum + '\' ' +
-                        'tvg-chno=\'' + updated_chnum + '\' ' +
-                        'tvg-name=\'' + sid_data['display_name'] + '\' ' +
-                        'tvg-id=\'' + sid + '\' ' +
-                        (('tvg-logo=\'' + sid_data['thumbnail'] + '\' ')
-                         if sid_data['thumbnail'] else '') +
-                        'group-title=\'' + groups + '\',' + service_name
-                )
-            )
-            fakefile.write(
-                '%s\n' % (
-                    (
-                        uri
-                    )
-                )
-            )
-    return fakefile.getvalue()
+            yield '%s\n%s\n' % (
+                record_marker + ':-1' + ' ' +
+                'channelID=\'' + sid + '\' ' +
+                'tvg-num=\'' + updated_chnum + '\' ' +
+                'tvg-chno=\'' + updated_chnum + '\' ' +
+                'tvg-name=\'' + sid_data['display_name'] + '\' ' +
+                'tvg-id=\'' + sid + '\' ' +
+                (('tvg-logo=\'' + sid_data['thumbnail'] + '\' ')
+                 if sid_data['thumbnail'] else '') +
+                'group-title=\'' + groups + '\',' + service_name,
+                uri)
 
 
 def get_channels_json(_config, _base_url, _namespace, _instance, _plugins):
+    """
+    Generator returning the lineup one channel at a time
+    """
     db = DBChannels(_config)
     ch_obj = ChannelsURL(_config, _base_url)
     ch_data = db.get_channels(_namespace, _instance)
-    return_json = ''
-    sids_processed = []
+    separator = '['
+    sids_processed = set()
     for sid, sid_data_list in ch_data.items():
         for sid_data in sid_data_list:
             if sid in sids_processed:
                 continue
-            sids_processed.append(sid)
+            sids_processed.add(sid)
             if not sid_data['enabled']:
                 continue
             if not _plugins.get(sid_data['namespace']):
@@ -167,7 +162,6 @@ def get_channels_json(_config, _base_url, _namespace, _instance, _plugins):
             config_section = utils.instance_config_section(sid_data['namespace'], sid_data['instance'])
             if not _config[config_section]['enabled']:
                 continue
-            sids_processed.append(sid)
             stream = _config[config_section]['player-stream_type']
             if stream == 'm3u8redirect':
                 uri = sid_data['json']['stream_url']
@@ -176,22 +170,28 @@ def get_channels_json(_config, _base_url, _namespace, _instance, _plugins):
             updated_chnum = utils.wrap_chnum(
                 str(sid_data['display_number']), sid_data['namespace'],
                 sid_data['instance'], _config)
-            return_json = return_json + ch_templates['jsonLineup'].format(
+            yield separator + ch_templates['jsonLineup'].format(
                 sid_data['json']['callsign'],
                 updated_chnum,
                 sid_data['display_name'],
                 uri,
                 sid_data['json']['HD'])
-            return_json = return_json + ','
-    return "[" + return_json[:-1] + "]"
+            separator = ','
+    if separator == '[':
+        yield '[]'
+    else:
+        yield ']'
 
 
 def get_channels_xml(_config, _base_url, _namespace, _instance, _plugins):
+    """
+    Generator returning the lineup one channel at a time
+    """
     db = DBChannels(_config)
     ch_obj = ChannelsURL(_config, _base_url)
     ch_data = db.get_channels(_namespace, _instance)
-    return_xml = ''
-    sids_processed = []
+    yield '<Lineup>'
+    sids_processed = set()
     for sid, sid_data_list in ch_data.items():
         for sid_data in sid_data_list:
             if sid in sids_processed:
@@ -209,7 +209,7 @@ def get_channels_xml(_config, _base_url, _namespace, _instance, _plugins):
             config_section = utils.instance_config_section(sid_data['namespace'], sid_data['instance'])
             if not _config[config_section]['enabled']:
                 continue
-            sids_processed.append(sid)
+            sids_processed.add(sid)
             stream = _config[config_section]['player-stream_type']
             if stream == 'm3u8redirect':
                 uri = sid_data['json']['stream_url']
@@ -219,12 +219,12 @@ def get_channels_xml(_config, _base_url, _namespace, _instance, _plugins):
             updated_chnum = utils.wrap_chnum(
                 str(sid_data['display_number']), sid_data['namespace'],
                 sid_data['instance'], _config)
-            return_xml = return_xml + ch_templates['xmlLineup'].format(
+            yield ch_templates['xmlLineup'].format(
                 updated_chnum,
                 escape(sid_data['display_name']),
                 uri,
                 sid_data['json']['HD'])
-    return "<Lineup>" + return_xml + "</Lineup>"
+    yield '</Lineup>'
 
 
 class ChannelsURL:
@@ -235,25 +235,37 @@ class ChannelsURL:
         self.base_url = _base_url
 
     def update_channels(self, _namespace, _query_data):
+        """
+        Applies the channel editor changes in one transaction.  Only the
+        channels in the form are read and new thumbnails are sized in
+        the background.
+        """
         db = DBChannels(self.config)
-        ch_data = db.get_channels(_namespace, None)
-        results = 'Status Results<ul>'
+        updates = []
         for key, values in _query_data.items():
             key_pair = key.split('-', 2)
             uid = key_pair[0].replace('%2d', '-')
-            instance = key_pair[1]
-            name = key_pair[2]
-            value = values[0]
+            updates.append((uid, key_pair[1], key_pair[2], values[0]))
+        ch_data = db.get_channels_by_uid(_namespace, {update[0] for update in updates})
+        if ch_data is None:
+            return 'Status Results<ul><li>ERROR: Unable to read the channels</li></ul><hr>'
+
+        results = 'Status Results<ul>'
+        changed_channels = {}
+        thumbnail_channels = {}
+        for uid, instance, name, value in updates:
             if name == 'enabled':
                 value = int(value)
 
-            db_value = None
             ch_db = None
-            for ch_db in ch_data[uid]:
-                if ch_db['instance'] == instance:
-                    db_value = ch_db[name]
+            for ch_row in ch_data.get(uid, []):
+                if ch_row['instance'] == instance:
+                    ch_db = ch_row
                     break
-            if value != db_value:
+            if ch_db is None:
+                results += ''.join(['<li>ERROR: Channel not found [', uid, '][', instance, '][', name, '] not changed', '</li>'])
+                continue
+            if value != ch_db[name]:
                 if value is None:
                     lookup_name = self.translate_main2json(name)
                     if lookup_name is not None:
@@ -267,12 +279,42 @@ class ChannelsURL:
                 results += ''.join(['<li>Updated [', uid, '][', instance, '][', name, '] to ', str(value), '</li>'])
                 ch_db[name] = value
                 if name == 'thumbnail':
-                    thumbnail_size = self.get_thumbnail_size(value)
-                    ch_db['thumbnail_size'] = thumbnail_size
-                db.update_channel(ch_db)
+                    ch_db['thumbnail_size'] = None
+                    thumbnail_channels[(uid, instance)] = ch_db
+                changed_channels[(uid, instance)] = ch_db
+
+        if changed_channels and not db.update_channels_editable(list(changed_channels.values())):
+            return 'Status Results<ul><li>ERROR: Unable to save the channel changes, nothing was updated</li></ul><hr>'
+        if thumbnail_channels:
+            self.update_thumbnail_sizes([
+                {'namespace': ch['namespace'], 'instance': ch['instance'],
+                 'uid': ch['uid'], 'thumbnail': ch['thumbnail']}
+                for ch in thumbnail_channels.values()])
         results += '</ul><hr>'
         return results
 
+    def update_thumbnail_sizes(self, _ch_list):
+        """
+        Downloads each new thumbnail in a background thread to
+        find its size, so the channel editor does not wait on it
+        """
+        def _update_thumbnail_sizes():
+            try:
+                db = DBChannels(self.config)
+                for ch in _ch_list:
+                    try:
+                        ch['thumbnail_size'] = self.get_thumbnail_size(ch['thumbnail'])
+                        db.update_thumbnail_size(ch)
+                    except Exception as ex:
+                        self.logger.warning('Unable to update thumbnail size for channel {} {}'
+                                            .format(ch.get('uid'), ex))
+            finally:
+                DBChannels.close_thread()
+
+        t_thumbnail = threading.Thread(target=_update_thumbnail_sizes, args=())
+        t_thumbnail.daemon = True
+        t_thumbnail.start()
+
     def translate_main2json(self, _name):
         if _name == 'display_number':
             return 'number'
@@ -294,7 +336,7 @@ class ChannelsURL:
              'Connection': 'Keep-Alive'
              }
         req = urllib.request.Request(_thumbnail, headers=h)
-        with urllib.request.urlopen(req) as resp:
+        with urllib.request.urlopen(req, timeout=THUMBNAIL_TIMEOUT) as resp:
             img_blob = resp.read()
             fp = io.BytesIO(img_blob)
             sz = len(img_blob)
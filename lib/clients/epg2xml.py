@@ -57,6 +57,7 @@ class EPG:
         self.tv_tag = False
         self.today = datetime.datetime.utcnow().date()
         self.prog_processed = []
+        self.writer = None
 
     def get_next_epg_day(self):
         is_enabled = False
@@ -92,10 +93,7 @@ class EPG:
             return
 
         try:
-            _webserver.do_dict_response({
-                'code': 200,
-                'headers': {'Content-type': 'application/xml; Transfer-Encoding: chunked'},
-                'text': None})
+            self.writer = _webserver.start_stream_response(200, 'application/xml')
             xml_out = self.gen_header_xml()
             channel_list = self.channels_db.get_channels(self.namespace, self.instance)
             self.gen_channel_xml(xml_out, channel_list)
@@ -118,8 +116,8 @@ class EPG:
                                   .format(ns, inst, day))
             day_data = None
             self.epg_db.close_query()
-            self.webserver.wfile.write(b'</tv>\r\n')
-            self.webserver.wfile.flush()
+            self.writer.write(b'</tv>\r\n')
+            self.writer.close()
         except MemoryError as e:
             self.logger.error('MemoryError parsing large xml')
             raise e
@@ -129,7 +127,8 @@ class EPG:
                 # Normal process.  Client request end of stream
                 self.logger.info('Connection dropped by client {}'
                                  .format(ex))
-                xml_out.clear()
+                if xml_out is not None:
+                    xml_out.clear()
                 return
             else:
                 self.logger.error('{}{}'.format(
@@ -153,7 +152,7 @@ class EPG:
                     epg_dom = re.sub('</tv>\n$', '', epg_dom)
                 else:
                     epg_dom = re.sub('"/>\n$', '">', epg_dom)
-            self.webserver.wfile.write(epg_dom.encode())
+            self.writer.write(epg_dom.encode())
         else:
             if not keep_xml_prolog:
                 epg_dom = ElementTree.tostring(_xml)
@@ -168,7 +167,7 @@ class EPG:
                     epg_dom = re.sub(b'</tv>$', b'', epg_dom)
                 else:
                     epg_dom = re.sub(b'" />$', b'">', epg_dom)
-            self.webserver.wfile.write(epg_dom + b'\r\n')
+            self.writer.write(epg_dom + b'\r\n')
         epg_dom = None      # clear to help garbage collection
         return True
 
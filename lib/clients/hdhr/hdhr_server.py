@@ -23,13 +23,16 @@ import socket
 import string
 import struct
 import sys
+import urllib.parse
 import zlib
 from ipaddress import IPv4Network
 from ipaddress import IPv4Address
 from multiprocessing import Process
+from threading import Lock
 from threading import Thread
 
 import lib.common.utils as utils
+from lib.clients.tuner_status import TunerStatusBoard
 
 HDHR_PORT = 65001
 HDHR_ADDR = '224.0.0.255'  # multicast to local addresses only
@@ -163,6 +166,10 @@ class HDHRServer:
         self.sock_listener = None
         self._t = None
         self.tuners = {}
+        self.status_board = TunerStatusBoard(_config)
+        # UDP/RTP output requests by tuner index
+        self.targets = {}
+        self.targets_lock = Lock()
         for area, area_data in self.config.items():
             if 'player-tuner_count' in area_data.keys():
                 self.tuners[area] = dict.fromkeys(range(self.config[area]['player-tuner_count']))
@@ -224,6 +231,26 @@ class HDHRServer:
                 'status': queue_item['status']
             }
 
+    def get_tuner(self, _index):
+        """
+        Returns the channel and status of the tuner index.  Scans started
+        from the web admin arrive on the queue, while streaming status
+        is read from the status board published by the tuner process.
+        """
+        for area_data in self.tuners.values():
+            if _index in area_data and area_data[_index]['status'] == 'Scan':
+                return area_data[_index]
+        board = self.status_board.read()
+        if board is None:
+            for area_data in self.tuners.values():
+                if _index in area_data and area_data[_index]['status'] == 'Stream':
+                    return area_data[_index]
+        else:
+            for scan_list in board.values():
+                if _index < len(scan_list) and isinstance(scan_list[_index], dict):
+                    return {'channel': scan_list[_index]['ch'], 'status': 'Stream'}
+        return {'channel': None, 'status': 'Idle'}
+
     @staticmethod
     def get_frame_type(_msg):
         """
@@ -278,13 +305,9 @@ class HDHRServer:
                 return response
             elif name_str.endswith('/status'):
                 response = None
-                tuner_status = None
-                for area, area_data in self.tuners.items():
-                    if area_data[tuner_index]['status'] == 'Scan':
-                        response = HDHRServer.gen_err_response(frame_type, 'scanErrMsg', [host])
-                        break
-                    else:
-                        tuner_status = area_data[tuner_index]['status']
+                tuner_status = self.get_tuner(tuner_index)['status']
+                if tuner_status == 'Scan':
+                    response = HDHRServer.gen_err_response(frame_type, 'scanErrMsg', [host])
                 if response is None:
                     value_resp = utils.set_u8(HDHOMERUN_GETSET_VALUE) \
                                  + utils.set_str(tuner_status_msg[tuner_status], True)
@@ -296,11 +319,27 @@ class HDHRServer:
                 response += crc
                 return response
 
+            elif name_str.endswith('/target'):
+                value = _req_dict.get(HDHOMERUN_GETSET_VALUE)
+                if value is not None:
+                    self.set_target(tuner_index, 'target', value.decode('utf-8'))
+                with self.targets_lock:
+                    target = self.targets.get(tuner_index, {}).get('target')
+                if not target:
+                    target = 'none'
+                return HDHRServer.gen_value_response(frame_type, name, target.encode())
+
+            elif name_str.endswith('/vchannel') \
+                    and _req_dict.get(HDHOMERUN_GETSET_VALUE) is not None:
+                value = _req_dict[HDHOMERUN_GETSET_VALUE]
+                self.set_target(tuner_index, 'vchannel', value.decode('utf-8'))
+                return HDHRServer.gen_value_response(frame_type, name, value)
+
             elif name_str.endswith('/vchannel'):
-                tuner_status = self.tuners[tuner_index]['status']
-                if tuner_status == 'Stream':
+                tuner = self.get_tuner(tuner_index)
+                if tuner['status'] == 'Stream':
                     value_resp = utils.set_u8(HDHOMERUN_GETSET_VALUE) \
-                                 + utils.set_str(self.tuners[tuner_index]['channel'].encode(), True)
+                                 + utils.set_str(str(tuner['channel']).encode(), True)
                 else:
                     value_resp = utils.set_u8(HDHOMERUN_GETSET_VALUE) \
                                  + utils.set_str('none', True)
@@ -319,6 +358,93 @@ class HDHRServer:
             self.logger.error('TCP: 3 UNKNOWN GETSET MSG REQUEST: {} '.format(_req_dict))
             return None
 
+    @staticmethod
+    def gen_value_response(_frame_type, _name, _value):
+        name_resp = utils.set_u8(HDHOMERUN_GETSET_NAME) + utils.set_str(_name, True)
+        value_resp = utils.set_u8(HDHOMERUN_GETSET_VALUE) + utils.set_str(_value, True)
+        msg_len = utils.set_u16(len(name_resp) + len(value_resp))
+        response = _frame_type + msg_len + name_resp + value_resp
+        x = zlib.crc32(response)
+        crc = struct.pack('<I', x)
+        response += crc
+        return response
+
+    def set_target(self, _tuner_index, _key, _value):
+        """
+        Stores the target or vchannel for a tuner.  Once both are set, the
+        tuner web server is asked to send the channel to the UDP/RTP target.
+        Setting either one to none stops the output.  Requests arrive on
+        separate client threads, so the dict is only changed under
+        targets_lock and the network I/O is done outside of it.  Each
+        change bumps the generation, so a stream started for an older
+        request is closed instead of stored.
+        """
+        if _value.lower() == 'none' or not _value:
+            _value = None
+        with self.targets_lock:
+            tuner_target = self.targets.setdefault(
+                _tuner_index, {'target': None, 'vchannel': None, 'sock': None, 'generation': 0})
+            if tuner_target[_key] == _value and tuner_target['sock'] is not None:
+                return
+            tuner_target[_key] = _value
+            tuner_target['generation'] += 1
+            generation = tuner_target['generation']
+            old_sock = tuner_target['sock']
+            tuner_target['sock'] = None
+            target = tuner_target['target']
+            vchannel = tuner_target['vchannel']
+        self.stop_target_stream(_tuner_index, old_sock)
+        if not target or not vchannel:
+            return
+        sock = self.start_target_stream(_tuner_index, target, vchannel)
+        if sock is None:
+            return
+        with self.targets_lock:
+            if tuner_target['generation'] == generation:
+                tuner_target['sock'] = sock
+                return
+        self.stop_target_stream(_tuner_index, sock)
+
+    def start_target_stream(self, _tuner_index, _target, _vchannel):
+        """
+        Requests the channel from the tuner web server with the target included.
+        The connection is held open for the life of the stream and closing it
+        stops the stream.  Returns the connected socket or None.
+        """
+        host = self.config['web']['bind_ip']
+        if host in ['', '0.0.0.0']:
+            host = '127.0.0.1'
+        port = self.config['web']['plex_accessible_port']
+        request = 'GET /auto/v{}?target={} HTTP/1.1\r\nHost: {}:{}\r\n\r\n'.format(
+            urllib.parse.quote(_vchannel),
+            urllib.parse.quote(_target, safe=''),
+            host, port)
+        try:
+            sock = socket.create_connection((host, port), timeout=10)
+            sock.sendall(request.encode())
+            status_line = sock.recv(1024).split(b'\r\n', 1)[0]
+        except OSError as ex:
+            self.logger.warning('TCP: Unable to start stream for tuner{} to {} {}'
+                                .format(_tuner_index, _target, ex))
+            return None
+        if b' 200 ' not in status_line:
+            self.logger.warning('TCP: Tuner refused stream for tuner{} ch:{} {}'
+                                .format(_tuner_index, _vchannel, status_line))
+            sock.close()
+            return None
+        self.logger.info('TCP: Streaming tuner{} ch:{} to {}'
+                         .format(_tuner_index, _vchannel, _target))
+        return sock
+
+    def stop_target_stream(self, _tuner_index, _sock):
+        if _sock is None:
+            return
+        self.logger.info('TCP: Stopping stream for tuner{}'.format(_tuner_index))
+        try:
+            _sock.close()
+        except OSError:
+            pass
+
     def parse_getset_request(self, _msg):
         (crc_rcvd,) = struct.unpack('I', _msg[-4:])
         crc_calc = zlib.crc32(_msg[0:-4])
@@ -0,0 +1,87 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import zlib
+
+CHUNK_SIZE = 65536      # data is collected into chunks of about this size before sending
+GZIP_LEVEL = 6
+GZIP_WBITS = 31         # zlib format with a gzip header and trailer
+
+
+class ResponseWriter:
+    """
+    Writes a response body of unknown length as it is generated.
+    When the client uses HTTP/1.1 the body is sent with chunked
+    transfer encoding, otherwise the end of the body is the connection
+    close.  The body is gzip compressed on the fly when requested.
+    """
+
+    def __init__(self, _wfile, _chunked, _compress):
+        self.wfile = _wfile
+        self.chunked = _chunked
+        self.compressor = None
+        if _compress:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        self.buffer = []
+        self.buffer_size = 0
+        self.is_closed = False
+
+    def write(self, _data):
+        """
+        Accepts str or bytes.  Small writes are combined into larger chunks.
+        """
+        if isinstance(_data, str):
+            _data = _data.encode('utf-8')
+        if self.compressor is not None:
+            _data = self.compressor.compress(_data)
+        if not _data:
+            return
+        self.buffer.append(_data)
+        self.buffer_size += len(_data)
+        if self.buffer_size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer_size:
+            return
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+        else:
+            self.wfile.write(data)
+
+    def close(self):
+        """
+        Sends the remaining data and ends the body
+        """
+        if self.is_closed:
+            return
+        self.is_closed = True
+        if self.compressor is not None:
+            data = self.compressor.flush()
+            if data:
+                self.buffer.append(data)
+                self.buffer_size += len(data)
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
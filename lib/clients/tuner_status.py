@@ -0,0 +1,164 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import json
+import logging
+import mmap
+import pathlib
+import struct
+import threading
+import time
+
+BOARD_FILENAME = 'tuner_status.mmap'
+MAX_WORKERS = 16            # one slot for each tuner process
+SLOT_SIZE = 16384
+SLOT_HEADER = struct.Struct('<QI')  # sequence number, data length
+PUBLISH_INTERVAL = 1        # seconds between updates from the tuner process
+READ_RETRIES = 5
+
+
+class TunerStatusBoard:
+    """
+    Tuner status shared through a small memory mapped file.  Each tuner
+    process writes its rmg_station_scans as JSON into its own slot and
+    the other processes read the slots directly instead of asking the
+    tuner process over HTTP.  The sequence number in each slot is odd
+    while the slot is being written, so readers retry on a partial update.
+    """
+
+    def __init__(self, _config):
+        self.logger = logging.getLogger(__name__)
+        self.board_path = pathlib.Path(_config['paths']['data_dir'], BOARD_FILENAME)
+        self.board = None
+        self.sequence = 0
+        self.published_data = None
+        self.publish_event = threading.Event()
+
+    @classmethod
+    def create(cls, _config):
+        """
+        Called by the main process at startup to clear any old status
+        """
+        board = cls(_config)
+        with open(board.board_path, 'wb') as board_file:
+            board_file.write(b'\x00' * (MAX_WORKERS * SLOT_SIZE))
+        return board
+
+    def open_board(self, _access):
+        if self.board is None:
+            with open(self.board_path, 'r+b') as board_file:
+                self.board = mmap.mmap(board_file.fileno(), MAX_WORKERS * SLOT_SIZE, access=_access)
+        return self.board
+
+    def publish(self, _worker_id, _rmg_station_scans):
+        board = self.open_board(mmap.ACCESS_WRITE)
+        status = {}
+        for namespace, scan_list in _rmg_station_scans.items():
+            status[namespace] = [
+                scan_status if not isinstance(scan_status, dict) else {
+                    'instance': scan_status['instance'],
+                    'ch': scan_status['ch'],
+                    'mux': None if scan_status['mux'] is None else str(scan_status['mux']),
+                    'status': scan_status['status']}
+                for scan_status in scan_list]
+        data = json.dumps(status).encode()
+        if data == self.published_data:
+            # readers use the sequence numbers to detect a change
+            return
+        if len(data) > SLOT_SIZE - SLOT_HEADER.size:
+            self.logger.warning('Tuner status too large to publish: {} bytes'.format(len(data)))
+            return
+        offset = _worker_id * SLOT_SIZE
+        self.sequence += 1
+        SLOT_HEADER.pack_into(board, offset, self.sequence, 0)
+        board[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+        self.sequence += 1
+        SLOT_HEADER.pack_into(board, offset, self.sequence, len(data))
+        self.published_data = data
+
+    def start_publisher(self, _worker_id, _rmg_station_scans):
+        """
+        Publishes the tuner status every PUBLISH_INTERVAL seconds
+        or sooner when request_publish() is called
+        """
+        def _publisher():
+            while True:
+                try:
+                    self.publish(_worker_id, _rmg_station_scans)
+                except Exception as ex:
+                    # keep publishing, a dead thread would freeze this slot
+                    self.logger.warning('Unable to publish tuner status {}'.format(ex))
+                self.publish_event.wait(PUBLISH_INTERVAL)
+                self.publish_event.clear()
+
+        t_publish = threading.Thread(target=_publisher, args=())
+        t_publish.daemon = True
+        t_publish.start()
+
+    def request_publish(self):
+        self.publish_event.set()
+
+    def read_slot(self, _board, _worker_id):
+        offset = _worker_id * SLOT_SIZE
+        for i in range(READ_RETRIES):
+            sequence, length = SLOT_HEADER.unpack_from(_board, offset)
+            if sequence == 0:
+                return None
+            if sequence % 2 == 0:
+                data = _board[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+                if SLOT_HEADER.unpack_from(_board, offset)[0] == sequence:
+                    return json.loads(data)
+            time.sleep(0.001)
+        return None
+
+    def read_version(self):
+        """
+        Returns the sequence numbers of all slots, which only change when
+        a tuner process publishes a different status, or None
+        """
+        try:
+            board = self.open_board(mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        return tuple(SLOT_HEADER.unpack_from(board, worker_id * SLOT_SIZE)[0]
+                     for worker_id in range(MAX_WORKERS))
+
+    def read(self):
+        """
+        Returns the tuner status of all tuner processes in the same
+        format as /tunerstatus, or None if no tuner process has published
+        """
+        try:
+            board = self.open_board(mmap.ACCESS_READ)
+        except (OSError, ValueError) as ex:
+            self.logger.debug('Tuner status not available {}'.format(ex))
+            return None
+        tuner_status = None
+        for worker_id in range(MAX_WORKERS):
+            slot_status = self.read_slot(board, worker_id)
+            if slot_status is None:
+                continue
+            if tuner_status is None:
+                tuner_status = slot_status
+                continue
+            for namespace, scan_list in slot_status.items():
+                merged_list = tuner_status.setdefault(namespace, scan_list)
+                for index, scan_status in enumerate(scan_list):
+                    if scan_status != 'Idle' and index < len(merged_list):
+                        merged_list[index] = scan_status
+        return tuner_status
@@ -0,0 +1,177 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import logging
+import platform
+import socket
+import time
+from multiprocessing import Manager
+from threading import Thread
+
+SYNC_INTERVAL = 2   # seconds between publishing the local tuner state
+
+
+def is_multi_worker_supported(_config):
+    """
+    Multiple tuner processes share the listening port with SO_REUSEPORT,
+    which is not available on all platforms
+    """
+    return _config['web']['tuner_workers'] > 1 \
+        and hasattr(socket, 'SO_REUSEPORT') \
+        and platform.system() not in ['Windows']
+
+
+class TunerTable:
+    """
+    Tuner allocations shared between tuner worker processes.
+    Each worker keeps its own rmg_station_scans for the streams it runs
+    and publishes them here, so the tuner_count limits apply across all
+    workers and a channel already streaming on another worker is relayed
+    from that worker instead of using a second tuner.
+    Table keys are 'namespace:tuner_index' with a value of
+    (worker_id, instance, channel, status) and 'worker:worker_id' with
+    the loopback port of the worker.
+    """
+    manager = None
+
+    def __init__(self, _table, _lock):
+        self.logger = logging.getLogger(__name__)
+        self.table = _table
+        self.lock = _lock
+        self.worker_id = None
+
+    @classmethod
+    def create(cls):
+        """
+        Called by the main process each time the tuner processes start.
+        One manager process is kept for the life of the main process
+        instead of starting a new one on each restart.  The table and
+        lock are new, so a lock held by a terminated worker is not reused.
+        """
+        if cls.manager is None:
+            cls.manager = Manager()
+        return cls(cls.manager.dict(), cls.manager.Lock())
+
+    def __getstate__(self):
+        return {'table': self.table, 'lock': self.lock, 'worker_id': self.worker_id}
+
+    def __setstate__(self, _state):
+        self.__init__(_state['table'], _state['lock'])
+        self.worker_id = _state['worker_id']
+
+    def register_worker(self, _worker_id, _port, _rmg_station_scans):
+        """
+        Removes any allocations left by a previous worker with the same id
+        and starts publishing the local tuner state
+        """
+        self.worker_id = _worker_id
+        with self.lock:
+            for key, value in self.table.items():
+                if not key.startswith('worker:') and value[0] == _worker_id:
+                    del self.table[key]
+            self.table['worker:{}'.format(_worker_id)] = _port
+
+        def _sync_thread():
+            while True:
+                time.sleep(SYNC_INTERVAL)
+                try:
+                    with self.lock:
+                        self.sync(_rmg_station_scans)
+                except (EOFError, OSError, BrokenPipeError):
+                    # manager process has ended, we are shutting down
+                    break
+
+        t_sync = Thread(target=_sync_thread, args=())
+        t_sync.daemon = True
+        t_sync.start()
+
+    def sync(self, _rmg_station_scans, _snapshot=None):
+        """
+        Publishes the tuners used by this worker.  Caller must hold the lock.
+        Each call to the shared table is a round trip to the manager
+        process, so changes are found from one copy of the table, or the
+        snapshot from an earlier sync, and sent together.
+        Returns the copy of the table with the changes applied.
+        """
+        if _snapshot is None:
+            _snapshot = self.table.copy()
+        updates = {}
+        deletes = []
+        for namespace, scan_list in _rmg_station_scans.items():
+            for index, scan_status in enumerate(scan_list):
+                key = '{}:{}'.format(namespace, index)
+                if isinstance(scan_status, dict):
+                    value = (self.worker_id, scan_status['instance'],
+                             scan_status['ch'], scan_status['status'])
+                    if _snapshot.get(key) != value:
+                        updates[key] = value
+                else:
+                    owner = _snapshot.get(key)
+                    if owner is not None and owner[0] == self.worker_id:
+                        deletes.append(key)
+        if updates:
+            self.table.update(updates)
+            _snapshot.update(updates)
+        for key in deletes:
+            self.table.pop(key, None)
+            del _snapshot[key]
+        return _snapshot
+
+    def get_busy_tuners(self, _namespace, _snapshot=None):
+        """
+        Returns the tuner indexes in use by other workers
+        """
+        if _snapshot is None:
+            _snapshot = self.table.copy()
+        busy = []
+        prefix = _namespace + ':'
+        for key, value in _snapshot.items():
+            if key.startswith(prefix) and value[0] != self.worker_id:
+                busy.append(int(key[len(prefix):]))
+        return busy
+
+    def get_channel_owner(self, _namespace, _instance, _ch_num):
+        """
+        Returns the loopback port of the worker streaming the channel
+        or None when no other worker has it
+        """
+        prefix = _namespace + ':'
+        for key, value in self.table.items():
+            if key.startswith(prefix) and value[0] != self.worker_id \
+                    and value[1] == _instance and value[2] == _ch_num:
+                return self.get_worker_port(value[0])
+        return None
+
+    def get_worker_port(self, _worker_id):
+        return self.table.get('worker:{}'.format(_worker_id))
+
+    def get_other_tuners(self):
+        """
+        Returns {namespace: {index: status_dict}} for tuners used by other workers
+        """
+        tuners = {}
+        for key, value in self.table.items():
+            if key.startswith('worker:') or value[0] == self.worker_id:
+                continue
+            namespace, index = key.rsplit(':', 1)
+            tuners.setdefault(namespace, {})[int(index)] = {
+                'instance': value[1],
+                'ch': value[2],
+                'mux': 'worker {}'.format(value[0]),
+                'status': value[3]}
+        return tuners
@@ -22,7 +22,7 @@ import pathlib
 import re
 import time
 from threading import Thread
-from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
 
 import lib.common.utils as utils
 from lib.common.decorators import getrequest
@@ -31,10 +31,12 @@ from lib.common.decorators import filerequest
 from lib.web.pages.templates import web_templates
 from .web_handler import WebHTTPHandler
 
+VALID_PATH_RE = re.compile(r'^(/([A-Za-z0-9._\-]+)/[A-Za-z0-9._\-/]+)[?%&A-Za-z0-9._\-/=]*$')
+
 
 @filerequest.route('/html/', '/images/', '/modules/')
 def lib_web_htdocs(_webserver):
-    valid_check = re.match(r'^(/([A-Za-z0-9._\-]+)/[A-Za-z0-9._\-/]+)[?%&A-Za-z0-9._\-/=]*$', _webserver.path)
+    valid_check = VALID_PATH_RE.match(_webserver.path)
     if not valid_check:
         return False
     file_path = valid_check.group(1)
@@ -47,7 +49,7 @@ def lib_web_htdocs(_webserver):
 
 @filerequest.route('/temp/')
 def data_web(_webserver):
-    valid_check = re.match(r'^(/([A-Za-z0-9._\-]+)/[A-Za-z0-9._\-/]+)[?%&A-Za-z0-9._\-/=]*$', _webserver.path)
+    valid_check = VALID_PATH_RE.match(_webserver.path)
     if not valid_check:
         return False
     url_path = valid_check.group(1)
@@ -95,11 +97,11 @@ class WebAdminHttpHandler(WebHTTPHandler):
 
     def do_GET(self):
         try:
-            valid_check = re.match(r'^(/([A-Za-z0-9._\-]+)/[A-Za-z0-9._\-/]+)[?%&A-Za-z0-9._\-/=]*$', self.path)
             self.content_path, self.query_data = self.get_query_data()
             self.plugins.config_obj.refresh_config_data()
-            utils.start_mem_trace(self.config)
             self.config = self.plugins.config_obj.data
+            if self.config['main']['memory_usage']:
+                utils.start_mem_trace(self.config)
             if filerequest.call_url(self, self.content_path):
                 pass
             elif getrequest.call_url(self, self.content_path):
@@ -108,29 +110,29 @@ class WebAdminHttpHandler(WebHTTPHandler):
                 self.logger.notice('UNKNOWN HTTP Request {}'.format(self.content_path))
                 self.do_mime_response(501, 'text/html',
                                       web_templates['htmlError'].format('501 - Not Implemented'))
-            snapshot = utils.end_mem_trace(self.config)
-            utils.display_top(self.config, snapshot)
-
+            self.display_mem_trace()
             return
         except MemoryError as ex:
             self.logger.error('UNKNOWN MEMORY EXCEPTION: {}'.format(ex))
             self.do_mime_response(501, 'text/html',
                                   web_templates['htmlError'].format('501 - {}'.format(ex)))
-            snapshot = utils.end_mem_trace(self.config)
-            utils.display_top(self.config, snapshot)
+            self.display_mem_trace()
         except IOError as ex:
             if ex.errno in [errno.EPIPE, errno.ECONNABORTED, errno.ECONNRESET, errno.ECONNREFUSED]:
                 self.logger.info('Connection dropped by end device {}'.format(ex))
             else:
                 self.logger.exception('{}{}'.format(
                     'UNEXPECTED IOERROR EXCEPTION=', ex))
-            snapshot = utils.end_mem_trace(self.config)
-            utils.display_top(self.config, snapshot)
+            self.display_mem_trace()
         except Exception as ex:
             self.logger.exception('{}{}'.format(
                 'UNEXPECTED EXCEPTION on GET=', ex))
             self.do_mime_response(501, 'text/html',
                                   web_templates['htmlError'].format('501 - Server Error'))
+            self.display_mem_trace()
+
+    def display_mem_trace(self):
+        if self.config['main']['memory_usage']:
             snapshot = utils.end_mem_trace(self.config)
             utils.display_top(self.config, snapshot)
 
@@ -216,7 +218,9 @@ class WebAdminHttpServer(Thread):
 
     def run(self):
         HttpHandlerClass = FactoryWebAdminHttpHandler()
-        httpd = HTTPServer((self.bind_ip, self.bind_port), HttpHandlerClass, bind_and_activate=False)
+        httpd = ThreadingHTTPServer((self.bind_ip, self.bind_port), HttpHandlerClass, bind_and_activate=False)
+        # long lived requests, such as dashboard events, get their own thread
+        httpd.daemon_threads = True
         httpd.socket = self.socket
         httpd.server_bind = self.server_close = lambda self: None
         httpd.server_activate()
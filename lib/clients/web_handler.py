@@ -16,11 +16,8 @@ The above copyright notice and this permission notice shall be included in all c
 substantial portions of the Software.
 """
 
-import importlib
-import importlib.resources
+import errno
 import logging
-import mimetypes
-import pathlib
 import platform
 import re
 import socket
@@ -32,10 +29,16 @@ from http.server import BaseHTTPRequestHandler
 import lib.common.utils as utils
 from lib.web.pages.templates import web_templates
 from lib.config.config_defn import ConfigDefn
+from lib.db.db import DB
 from lib.db.db_plugins import DBPlugins
 from lib.db.db_channels import DBChannels
 from lib.common.pickling import Pickling
 from lib.plugins.plugin_handler import PluginHandler
+from .asset_cache import AssetCache
+from .asset_cache import FILE_BLOCK_SIZE
+from .asset_cache import accepts_gzip
+from .asset_cache import etag_matches
+from .response_writer import ResponseWriter
 
 
 class WebHTTPHandler(BaseHTTPRequestHandler):
@@ -50,6 +53,7 @@ class WebHTTPHandler(BaseHTTPRequestHandler):
     rmg_station_scans = {}
     namespace_list = None
     total_instances = 0
+    asset_cache = AssetCache()
 
     def log_message(self, _format, *args):
         try:
@@ -60,6 +64,13 @@ class WebHTTPHandler(BaseHTTPRequestHandler):
         except (IndexError, ValueError):
             self.logger.error('[%s] %s' % (self.address_string(), _format % args))
 
+    def handle(self):
+        try:
+            super().handle()
+        finally:
+            # connection threads end with the connection, so release their database handles
+            DB.close_thread()
+
     def get_query_data(self):
         content_path = self.path
         query_data = {}
@@ -107,9 +118,7 @@ class WebHTTPHandler(BaseHTTPRequestHandler):
     def do_file_response(self, _code, _package, _reply_file):
         if _reply_file:
             try:
-                if _package:
-                    x = importlib.resources.read_binary(_package, _reply_file)
-                else:
+                if not _package:
                     # add security to prevent hacker paths
                     search_file = re.compile(r'^[A-Z]?[:]?([\\\/]([A-Za-z0-9_\-]+[\\\/])+[A-Za-z0-9\._\-]+$)')
                     valid_check = re.match(search_file, str(_reply_file))
@@ -117,14 +126,35 @@ class WebHTTPHandler(BaseHTTPRequestHandler):
                         self.logger.info('Invalid filepath {}'.format(_reply_file))
                         self.do_mime_response(404, 'text/html', web_templates['htmlError'].format('404 - Invalid File Path'))
                         return
-                    x_path = pathlib.Path(str(_reply_file))
-                    with open(x_path, 'br') as reader:
-                        x = reader.read()
-                mime_lookup = mimetypes.guess_type(_reply_file)
+                asset = WebHTTPHandler.asset_cache.get_asset(_package, _reply_file)
+                # browsers revalidate using the ETag, normally getting a 304
+                cache_control = 'no-cache'
+                if etag_matches(self.headers.get('If-None-Match'), asset['etag']):
+                    self.send_response(304)
+                    self.send_header('ETag', asset['etag'])
+                    self.send_header('Cache-Control', cache_control)
+                    self.end_headers()
+                    return
+                data = asset['data']
                 self.send_response(_code)
-                self.send_header('Content-type', mime_lookup[0])
+                self.send_header('Content-type', asset['mime'])
+                if asset['gzip'] is not None:
+                    self.send_header('Vary', 'Accept-Encoding')
+                    if accepts_gzip(self.headers.get('Accept-Encoding')):
+                        data = asset['gzip']
+                        self.send_header('Content-Encoding', 'gzip')
+                if data is None:
+                    self.send_header('Content-Length', str(asset['size']))
+                else:
+                    self.send_header('Content-Length', str(len(data)))
+                self.send_header('ETag', asset['etag'])
+                self.send_header('Last-Modified', asset['last_modified'])
+                self.send_header('Cache-Control', cache_control)
                 self.end_headers()
-                self.do_write(x)
+                if data is None:
+                    self.do_file_write(asset['path'], asset['size'])
+                else:
+                    self.do_write(data)
             except IsADirectoryError as e:
                 self.logger.info('IsADirectoryError:{}'.format(e))
                 self.do_mime_response(401, 'text/html', web_templates['htmlError'].format('401 - Unauthorized'))
@@ -171,12 +201,68 @@ class WebHTTPHandler(BaseHTTPRequestHandler):
         if rsp_dict['text']:
             self.do_write(rsp_dict['text'].encode('utf-8'))
 
+    def start_stream_response(self, _code, _mime):
+        """
+        Sends the headers for a response whose body is generated as it
+        is sent and returns the ResponseWriter for the body.  The writer
+        must be closed to end the response.
+        """
+        chunked = self.request_version == 'HTTP/1.1'
+        compress = accepts_gzip(self.headers.get('Accept-Encoding'))
+        if chunked:
+            # chunked encoding requires an HTTP/1.1 status line.  The connection
+            # is still closed afterwards since other responses have no length.
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(_code)
+        self.send_header('Content-type', _mime)
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        return ResponseWriter(self.wfile, chunked, compress)
+
+    def do_stream_response(self, _code, _mime, _body):
+        """
+        _body is an iterable or generator of str or bytes
+        """
+        try:
+            writer = self.start_stream_response(_code, _mime)
+            for data in _body:
+                writer.write(data)
+            writer.close()
+        except IOError as ex:
+            if ex.errno in [errno.EPIPE, errno.ECONNABORTED, errno.ECONNRESET, errno.ECONNREFUSED]:
+                self.logger.info('Connection dropped by client {}'.format(ex))
+            else:
+                raise
+
     def do_write(self, _data):
         try:
             self.wfile.write(_data)
         except BrokenPipeError as ex:
             self.logger.debug('Client dropped connection while writing, ignoring. {}'.format(ex))
 
+    def do_file_write(self, _file_path, _size):
+        """
+        Sends a file too large for the asset cache in blocks.  Only the
+        size sent in Content-Length is written, even if the file changed.
+        """
+        remaining = _size
+        with open(_file_path, 'rb') as reader:
+            while remaining > 0:
+                data = reader.read(min(FILE_BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                try:
+                    self.wfile.write(data)
+                except BrokenPipeError as ex:
+                    self.logger.debug('Client dropped connection while writing, ignoring. {}'.format(ex))
+                    return
+
     @classmethod
     def init_class_var_sub(cls, _plugins, _hdhr_queue, _terminate_queue, _sched_queue):
         """
@@ -217,9 +303,13 @@ class WebHTTPHandler(BaseHTTPRequestHandler):
 
         
     @classmethod
-    def start_httpserver(cls, _plugins, _hdhr_queue, _terminate_queue, _port, _http_server_class, _sched_queue=None):
+    def start_httpserver(cls, _plugins, _hdhr_queue, _terminate_queue, _port, _http_server_class, _sched_queue=None,
+                         _reuse_port=False):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if _reuse_port:
+            # multiple processes listen on the same port and the kernel spreads the connections
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         i = 3
         while True:
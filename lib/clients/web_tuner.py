@@ -16,35 +16,58 @@ The above copyright notice and this permission notice shall be included in all c
 substantial portions of the Software.
 """
 
+import errno
+import http.client
+import ipaddress
+import itertools
 import os
 import json
 import logging
 import os
 import pathlib
 import signal
+import socket
 import threading
 import time
 import urllib
 from threading import Thread
 from logging import config
-from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
 from urllib.parse import urlparse
 
 from lib.common import utils
 from lib.common.decorators import gettunerrequest
 from lib.web.pages.templates import web_templates
-from lib.db.db_config_defn import DBConfigDefn
+from lib.db.db_recordings import DBRecordings
+from lib.streams.stream import Stream
 from lib.streams.m3u8_redirect import M3U8Redirect
 from lib.streams.internal_proxy import InternalProxy
+from lib.streams.hls_proxy import HLSProxy
+from lib.streams.recorder import RecordingProxy
 from lib.streams.ffmpeg_proxy import FFMpegProxy
 from lib.streams.streamlink_proxy import StreamlinkProxy
 from lib.streams.thread_queue import ThreadQueue
+from lib.streams.stream_fanout import StreamFanOut
+from lib.streams.udp_writer import UDPWriter
+from lib.streams.udp_writer import parse_target
+from .tuner_status import TunerStatusBoard
 from .web_handler import WebHTTPHandler
 
+RELAY_TIMEOUT = 120
+RELAY_BUFFER_SIZE = 65536
+
 
 @gettunerrequest.route('/tunerstatus')
 def tunerstatus(_webserver):
-    _webserver.do_mime_response(200, 'application/json', json.dumps(WebHTTPHandler.rmg_station_scans, cls=ObjectJsonEncoder))
+    station_scans = WebHTTPHandler.rmg_station_scans
+    if Stream.tuner_table is not None:
+        # include the tuners used by the other tuner processes
+        station_scans = {ns: list(scan_list) for ns, scan_list in station_scans.items()}
+        for namespace, tuners in Stream.tuner_table.get_other_tuners().items():
+            for index, status in tuners.items():
+                if namespace in station_scans and index < len(station_scans[namespace]):
+                    station_scans[namespace][index] = status
+    _webserver.do_mime_response(200, 'application/json', json.dumps(station_scans, cls=ObjectJsonEncoder))
 
 
 @gettunerrequest.route('RE:/watch/.+')
@@ -53,6 +76,13 @@ def watch(_webserver):
     _webserver.do_tuning(sid, _webserver.query_data['name'], _webserver.query_data['instance'])
 
 
+@gettunerrequest.route('RE:/record/.+')
+def record(_webserver):
+    sid = urllib.parse.unquote(_webserver.content_path.replace('/record/', ''))
+    _webserver.do_recording(sid, _webserver.query_data['name'], _webserver.query_data['instance'],
+                            _webserver.query_data.get('id'))
+
+
 @gettunerrequest.route('/logreset')
 def logreset(_webserver):
     logging.config.fileConfig(fname=_webserver.config['paths']['config_file'],
@@ -63,17 +93,24 @@ def logreset(_webserver):
 @gettunerrequest.route('RE:/auto/v.+')
 def autov(_webserver):
     channel = _webserver.content_path.replace('/auto/v', '')
-    station_list = TunerHttpHandler.channels_db.get_channels(
-        _webserver.query_data['name'], _webserver.query_data['instance'])
+    channels_db = TunerHttpHandler.channels_db
+    namespace = _webserver.query_data['name']
+    instance = _webserver.query_data['instance']
+
+    # most lineups have no channel number prefix or suffix, so check the number as given first
+    first_stations = (channels_db.filter_indexed_rows(rows, namespace, instance)[:1]
+                      for rows in channels_db.get_index().by_uid.values())
+    station_list = itertools.chain(
+        channels_db.get_indexed_channels_by_number(channel, namespace, instance),
+        itertools.chain.from_iterable(first_stations))
 
     # check channel number with adjustments
-    for station in station_list.keys():
+    for station in station_list:
         updated_chnum = utils.wrap_chnum(
-            str(station_list[station][0]['display_number']), station_list[station][0]['namespace'],
-            station_list[station][0]['instance'], _webserver.config)
+            str(station['display_number']), station['namespace'],
+            station['instance'], _webserver.config)
         if updated_chnum == channel:
-            _webserver.do_tuning(station, _webserver.query_data['name'],
-                                 _webserver.query_data['instance'])
+            _webserver.do_tuning(station['uid'], namespace, instance)
             return
 
     _webserver.do_mime_response(503, 'text/html', web_templates['htmlError'].format('503 - Unknown channel'))
@@ -81,7 +118,7 @@ def autov(_webserver):
 
 class ObjectJsonEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, ThreadQueue):
+        if isinstance(obj, (ThreadQueue, StreamFanOut)):
             return str(obj)
         else:
             return json.JSONEncoder.default(self.obj)
@@ -104,11 +141,8 @@ class TunerHttpHandler(WebHTTPHandler):
         self.real_instance = None
         self.content_path = None
         self.query_data = None
-        self.m3u8_redirect = M3U8Redirect(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
-        self.internal_proxy = InternalProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
-        self.ffmpeg_proxy = FFMpegProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
-        self.streamlink_proxy = StreamlinkProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
-        self.db_configdefn = DBConfigDefn(self.config)
+        self.stream_writer = None
+        # stream proxies are created by do_tuning for the stream type used
         try:
             super().__init__(*args)
         except ConnectionResetError as ex:
@@ -160,77 +194,78 @@ class TunerHttpHandler(WebHTTPHandler):
                 'UNEXPECTED EXCEPTION on POST=', ex))
 
     def do_tuning(self, sid, _namespace, _instance):
-        # refresh the config data in case it changed in the web_admin process
-        self.plugins.config_obj.refresh_config_data()
-        self.config = self.db_configdefn.get_config()
-        self.plugins.config_obj.data = self.config
-        # try:
-        station_list = TunerHttpHandler.channels_db.get_channels(_namespace, _instance)
-        try:
-            self.real_namespace, self.real_instance, station_data = self.get_ns_inst_station(station_list[sid])
-            if not self.config[self.real_namespace.lower()]['enabled']:
-                self.logger.warning(
-                    'Plugin is not enabled, ignoring request: {} sid:{}'
-                    .format(self.real_namespace, sid))
-                self.do_mime_response(503, 'text/html', web_templates['htmlError'].format('503 - Plugin Disabled'))
-                return
-            if not self.plugins.plugins[self.real_namespace].plugin_obj:
-                self.logger.warning(
-                    'Plugin not initialized, ignoring request: {}:{} sid:{}'
-                    .format(self.real_namespace, self.real_instance, sid))
-                self.do_mime_response(503, 'text/html',
-                                      web_templates['htmlError'].format('503 - Plugin Not Initialized'))
-                return
-            section = self.plugins.plugins[self.real_namespace].plugin_obj.instances[self.real_instance].config_section
-            if not self.config[section]['enabled']:
-                self.logger.warning(
-                    'Plugin Instance is not enabled, ignoring request: {}:{} sid:{}'
-                    .format(self.real_namespace, self.real_instance, sid))
-                self.do_mime_response(503, 'text/html',
-                                      web_templates['htmlError'].format('503 - Plugin Instance Disabled'))
-                return
-        except (KeyError, TypeError):
-            self.logger.warning(
-                'Unknown Channel ID, not found in database {} {} {}'
-                .format(_namespace, _instance, sid))
-            self.do_mime_response(503, 'text/html', web_templates['htmlError'].format('503 - Unknown channel'))
+        section, station_data = self.get_tuning_station(sid, _namespace, _instance)
+        if station_data is None:
+            return
+        target = self.query_data.get('target')
+        if target and not self.is_local_client():
+            self.logger.warning('Refused stream target {} from client {}'
+                                .format(target, self.client_address[0]))
+            self.do_mime_response(403, 'text/html', web_templates['htmlError'].format('403 - Forbidden'))
+            return
+        relay_port = self.get_relay_port(station_data, target)
+        if relay_port:
+            self.relay_request(relay_port)
             return
         self.logger.notice('{}:{} Tuning to channel {}'.format(self.real_namespace, self.real_instance, sid))
+        if target and parse_target(target) is None:
+            self.do_mime_response(400, 'text/html', web_templates['htmlError'].format('400 - Invalid target'))
+            return
         if self.config[section]['player-stream_type'] == 'm3u8redirect':
-            self.do_dict_response(self.m3u8_redirect.gen_m3u8_response(station_data))
+            if target:
+                self.do_mime_response(501, 'text/html',
+                                      web_templates['htmlError'].format('501 - Target not supported by m3u8redirect'))
+                return
+            m3u8_redirect = M3U8Redirect(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
+            self.do_dict_response(m3u8_redirect.gen_m3u8_response(station_data))
             return
         elif self.config[section]['player-stream_type'] == 'internalproxy':
-            resp = self.internal_proxy.gen_response(
+            internal_proxy = InternalProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
+            resp = internal_proxy.gen_response(
                 self.real_namespace, self.real_instance, 
                 station_data['display_number'], station_data['json'].get('VOD'))
             self.do_dict_response(resp)
             if resp['tuner'] < 0:
                 return
             else:
-                self.internal_proxy.stream(station_data, self.wfile, self.terminate_queue, resp['tuner'])
+                internal_proxy.stream(station_data, self.get_stream_writer(target), self.terminate_queue, resp['tuner'])
+        elif self.config[section]['player-stream_type'] == 'hlsproxy':
+            if target:
+                self.do_mime_response(501, 'text/html',
+                                      web_templates['htmlError'].format('501 - Target not supported by hlsproxy'))
+                return
+            self.do_dict_response(HLSProxy.gen_playlist_response(
+                TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue,
+                station_data, self.terminate_queue))
+            return
         elif self.config[section]['player-stream_type'] == 'ffmpegproxy':
-            resp = self.ffmpeg_proxy.gen_response(
+            ffmpeg_proxy = FFMpegProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
+            resp = ffmpeg_proxy.gen_response(
                 self.real_namespace, self.real_instance, 
                 station_data['display_number'], station_data['json'].get('VOD'))
             self.do_dict_response(resp)
             if resp['tuner'] < 0:
                 return
             else:
-                self.ffmpeg_proxy.stream(station_data, self.wfile, resp['tuner'])
+                ffmpeg_proxy.stream(station_data, self.get_stream_writer(target), resp['tuner'])
         elif self.config[section]['player-stream_type'] == 'streamlinkproxy':
-            resp = self.streamlink_proxy.gen_response(
+            streamlink_proxy = StreamlinkProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue)
+            resp = streamlink_proxy.gen_response(
                 self.real_namespace, self.real_instance, 
                 station_data['display_number'], station_data['json'].get('VOD'))
             self.do_dict_response(resp)
             if resp['tuner'] < 0:
                 return
             else:
-                self.streamlink_proxy.stream(station_data, self.wfile, resp['tuner'])
+                streamlink_proxy.stream(station_data, self.get_stream_writer(target), resp['tuner'])
         else:
             self.do_mime_response(501, 'text/html', web_templates['htmlError'].format('501 - Unknown streamtype'))
             self.logger.error('Unknown [player-stream_type] {}'
                               .format(self.config[section]['player-stream_type']))
             return
+        if self.stream_writer is not None:
+            self.stream_writer.close()
+            self.stream_writer = None
         station_scans = WebHTTPHandler.rmg_station_scans[self.real_namespace][resp['tuner']]
         if station_scans != 'Idle':
             if station_scans['mux'] is None or not station_scans['mux'].is_alive():
@@ -242,6 +277,158 @@ class TunerHttpHandler(WebHTTPHandler):
             self.logger.info('2 Client Connection Closed, provider continuing ch_id={} {}'.format(sid, threading.get_ident()))
         time.sleep(0.01)
 
+    def do_recording(self, sid, _namespace, _instance, _rec_id):
+        """
+        Starts a scheduled recording in a background thread and returns
+        once the tuner is allocated.  The recording shares the stream
+        when the channel is already being watched.
+        """
+        if not self.is_local_client():
+            self.logger.warning('Refused recording {} from client {}'
+                                .format(_rec_id, self.client_address[0]))
+            self.do_mime_response(403, 'text/html', web_templates['htmlError'].format('403 - Forbidden'))
+            return
+        recordings_db = DBRecordings(self.config)
+        recording = recordings_db.get_recording(_rec_id)
+        if recording is None:
+            self.do_mime_response(404, 'text/html', web_templates['htmlError'].format('404 - Unknown recording'))
+            return
+        section, station_data = self.get_tuning_station(sid, _namespace, _instance)
+        if station_data is None:
+            return
+        relay_port = self.get_relay_port(station_data)
+        if relay_port:
+            self.relay_request(relay_port)
+            return
+        if self.config[section]['player-stream_type'] not in ['internalproxy', 'hlsproxy']:
+            self.do_mime_response(501, 'text/html',
+                                  web_templates['htmlError'].format('501 - Recording requires internalproxy'))
+            return
+        recorder = RecordingProxy(TunerHttpHandler.plugins, TunerHttpHandler.hdhr_queue, recording['end'])
+        resp = recorder.gen_response(
+            self.real_namespace, self.real_instance,
+            station_data['display_number'], station_data['json'].get('VOD'))
+        if resp['tuner'] < 0:
+            self.do_dict_response(resp)
+            return
+        filename = RecordingProxy.gen_filename(self.config, station_data, recording['title'])
+        recordings_db.update_status(_rec_id, 'recording', str(filename))
+        self.do_mime_response(200, 'application/json',
+                              json.dumps({'id': _rec_id, 'filename': str(filename)}))
+        t_record = Thread(target=recorder.record, args=(
+            _rec_id, station_data, filename, self.terminate_queue, resp['tuner'],))
+        t_record.daemon = True
+        t_record.start()
+
+    def get_tuning_station(self, sid, _namespace, _instance):
+        """
+        Returns the config section and station data for the channel.
+        When the channel cannot be tuned, the error response is sent
+        and (None, None) is returned.
+        """
+        # refresh the config data in case it changed in the web_admin process
+        self.plugins.config_obj.refresh_config_data()
+        self.config = self.plugins.config_obj.data
+        station_list = TunerHttpHandler.channels_db.get_indexed_channel(sid, _namespace, _instance)
+        try:
+            self.real_namespace, self.real_instance, station_data = self.get_ns_inst_station(station_list)
+            if not self.config[self.real_namespace.lower()]['enabled']:
+                self.logger.warning(
+                    'Plugin is not enabled, ignoring request: {} sid:{}'
+                    .format(self.real_namespace, sid))
+                self.do_mime_response(503, 'text/html', web_templates['htmlError'].format('503 - Plugin Disabled'))
+                return None, None
+            if not self.plugins.plugins[self.real_namespace].plugin_obj:
+                self.logger.warning(
+                    'Plugin not initialized, ignoring request: {}:{} sid:{}'
+                    .format(self.real_namespace, self.real_instance, sid))
+                self.do_mime_response(503, 'text/html',
+                                      web_templates['htmlError'].format('503 - Plugin Not Initialized'))
+                return None, None
+            section = self.plugins.plugins[self.real_namespace].plugin_obj.instances[self.real_instance].config_section
+            if not self.config[section]['enabled']:
+                self.logger.warning(
+                    'Plugin Instance is not enabled, ignoring request: {}:{} sid:{}'
+                    .format(self.real_namespace, self.real_instance, sid))
+                self.do_mime_response(503, 'text/html',
+                                      web_templates['htmlError'].format('503 - Plugin Instance Disabled'))
+                return None, None
+        except (KeyError, TypeError, IndexError):
+            self.logger.warning(
+                'Unknown Channel ID, not found in database {} {} {}'
+                .format(_namespace, _instance, sid))
+            self.do_mime_response(503, 'text/html', web_templates['htmlError'].format('503 - Unknown channel'))
+            return None, None
+        return section, station_data
+
+    def get_relay_port(self, _station_data, _target=None):
+        """
+        Returns the loopback port of the tuner process already streaming
+        the channel when more than one tuner process is running.
+        UDP targets use the HTTP connection as their control channel,
+        so they are always streamed by this process.
+        """
+        if Stream.tuner_table is None or _target \
+                or _station_data['json'].get('VOD'):
+            return None
+        return Stream.tuner_table.get_channel_owner(
+            self.real_namespace, self.real_instance, _station_data['display_number'])
+
+    def relay_request(self, _port):
+        """
+        Passes the request to another tuner process and returns its
+        response to the client, so the channel shares the existing stream
+        """
+        self.logger.debug('Relaying request to tuner process on port {} {}'.format(_port, self.path))
+        conn = http.client.HTTPConnection('127.0.0.1', _port, timeout=RELAY_TIMEOUT)
+        try:
+            conn.request('GET', self.path)
+            resp = conn.getresponse()
+            self.send_response(resp.status)
+            for header, value in resp.getheaders():
+                if header.lower() not in ['server', 'date', 'connection', 'transfer-encoding']:
+                    self.send_header(header, value)
+            self.end_headers()
+            while True:
+                data = resp.read1(RELAY_BUFFER_SIZE)
+                if not data:
+                    break
+                self.wfile.write(data)
+        except IOError as ex:
+            if ex.errno in [errno.EPIPE, errno.ECONNABORTED, errno.ECONNRESET]:
+                self.logger.info('Connection dropped by end device while relaying {}'.format(self.path))
+            else:
+                self.logger.warning('Relay to tuner process on port {} failed {}'.format(_port, ex))
+        finally:
+            conn.close()
+
+    def is_local_client(self):
+        """
+        UDP/RTP targets and recordings are only accepted from this host,
+        where the HDHR server and the scheduler make those requests.
+        Otherwise any client could have the stream sent to another
+        address or start writing files.
+        """
+        client_ip = self.client_address[0]
+        try:
+            if ipaddress.ip_address(client_ip).is_loopback:
+                return True
+        except ValueError:
+            return False
+        return client_ip == self.connection.getsockname()[0]
+
+    def get_stream_writer(self, _target):
+        """
+        Returns the wfile used to send the video stream.  When the request
+        includes a HDHR target, the stream is sent to the UDP/RTP target
+        and this HTTP connection is only used to detect the end of the stream
+        """
+        if not _target:
+            return self.wfile
+        self.stream_writer = UDPWriter(_target, self.connection,
+                                       self.config['hdhomerun']['udp_multicast_ttl'])
+        return self.stream_writer
+
     def get_ns_inst_station(self, _station_data):
         lowest_namespace = _station_data[0]['namespace']
         lowest_instance = _station_data[0]['instance']
@@ -315,8 +502,35 @@ class TunerHttpHandler(WebHTTPHandler):
                                                                 'player-tuner_count'],
                                                             plugin_name))
                         tuner_count += _plugins.config_obj.data[plugin_name.lower()]['player-tuner_count']
-        WebHTTPHandler.total_instances = tuner_count
+        WebHTTPHandler.logger.debug('{} Implementing {} tuners in total'.format(cls.__name__, tuner_count))
+        # each connection gets its own thread, so streaming clients do not block
+        # other requests.  Tuner limits are enforced by Stream.find_tuner
+        WebHTTPHandler.total_instances = 1
         super(TunerHttpHandler, cls).init_class_var(_plugins, _hdhr_queue, _terminate_queue)
+        if Stream.tuner_table is not None:
+            cls.start_relay_server(_plugins)
+            worker_id = Stream.tuner_table.worker_id
+        else:
+            worker_id = 0
+        # the other processes read the tuner status from the status board
+        Stream.status_board = TunerStatusBoard(_plugins.config_obj.data)
+        Stream.status_board.start_publisher(worker_id, WebHTTPHandler.rmg_station_scans)
+
+    @classmethod
+    def start_relay_server(cls, _plugins):
+        """
+        Each tuner process also listens on a loopback port, so the other
+        tuner processes can relay requests for channels it is streaming
+        """
+        relay_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        relay_socket.bind(('127.0.0.1', 0))
+        relay_socket.listen(int(_plugins.config_obj.data['web']['concurrent_listeners']))
+        TunerHttpServer(relay_socket, _plugins)
+        port = relay_socket.getsockname()[1]
+        Stream.tuner_table.register_worker(
+            Stream.tuner_table.worker_id, port, WebHTTPHandler.rmg_station_scans)
+        WebHTTPHandler.logger.info('Tuner process {} relay listening on port {}'
+                                   .format(Stream.tuner_table.worker_id, port))
 
 
 class TunerHttpServer(Thread):
@@ -331,7 +545,8 @@ class TunerHttpServer(Thread):
 
     def run(self):
         HttpHandlerClass = FactoryTunerHttpHandler()
-        httpd = HTTPServer((self.bind_ip, int(self.bind_port)), HttpHandlerClass, bind_and_activate=False)
+        httpd = ThreadingHTTPServer((self.bind_ip, int(self.bind_port)), HttpHandlerClass, bind_and_activate=False)
+        httpd.daemon_threads = True
         httpd.socket = self.socket
         httpd.server_bind = self.server_close = lambda self: None
         httpd.serve_forever()
@@ -352,10 +567,13 @@ def child_exited(sig, frame):
     except ChildProcessError as ex:
         logger.warning('Child exit error {}'.format(str(ex)))
 
-def start(_plugins, _hdhr_queue, _terminate_queue):
+def start(_plugins, _hdhr_queue, _terminate_queue, _tuner_table=None, _worker_id=0):
     # uncomment this to find out about m3u8 subprocess exits
     #signal.signal(signal.SIGCHLD, child_exited)
+    if _tuner_table is not None:
+        _tuner_table.worker_id = _worker_id
+        Stream.tuner_table = _tuner_table
     TunerHttpHandler.start_httpserver(
         _plugins, _hdhr_queue, _terminate_queue,
         _plugins.config_obj.data['web']['plex_accessible_port'],
-        TunerHttpServer)
+        TunerHttpServer, _reuse_port=_tuner_table is not None)
@@ -258,12 +258,15 @@ class Restore:
 
 class Request:
     """
-    Adds urls to functions for GET and POST methods
+    Adds urls to functions for GET and POST methods.
+    Exact urls are found with a dict lookup and all RE: urls are
+    combined into one compiled regex that is built on first use.
     """
 
     def __init__(self):
         self.url2func = {}
         self.method = None
+        self.route_table = None
 
     def route(self, *pattern):
         def wrap(func):
@@ -271,6 +274,7 @@ class Request:
                 if p.startswith('RE:'):
                     p = re.compile(p.replace('RE:', ''))
                 self.url2func[p] = func
+            self.route_table = None
             return func
 
         return wrap
@@ -280,17 +284,47 @@ class Request:
         for name in self.url2func.keys():
             logger.debug('Registering {} URL: {}'.format(self.method, name))
 
+    def build_route_table(self):
+        """
+        Returns (combined regex, {group index: func}).  Each pattern is
+        preceded by a lazy .*? so the first registered pattern found
+        anywhere in the url wins, the same as searching each in turn.
+        """
+        regex_list = []
+        group2func = {}
+        group = 1
+        for uri, func in self.url2func.items():
+            if type(uri) is re.Pattern:
+                regex_list.append('.*?({})'.format(uri.pattern))
+                group2func[group] = func
+                group += uri.groups + 1
+        if regex_list:
+            return re.compile('|'.join(regex_list)), group2func
+        return None, group2func
+
+    def find_func(self, _name):
+        func = self.url2func.get(_name)
+        if func is not None:
+            return func
+        if self.route_table is None:
+            self.route_table = self.build_route_table()
+        route_re, group2func = self.route_table
+        if route_re is None:
+            return None
+        m = route_re.match(_name)
+        if m is None:
+            return None
+        for group, func in group2func.items():
+            if m.start(group) != -1:
+                return func
+        return None
+
     def call_url(self, _webserver, _name, *args, **kwargs):
-        if _name in self.url2func:
-            self.url2func[_name](_webserver, *args, **kwargs)
-            return True
-        else:
-            for uri in self.url2func.keys():
-                if type(uri) is re.Pattern:
-                    if len(uri.findall(_name)) > 0:
-                        self.url2func[uri](_webserver, *args, **kwargs)
-                        return True
+        func = self.find_func(_name)
+        if func is None:
             return False
+        func(_webserver, *args, **kwargs)
+        return True
 
 
 class GetRequest(Request):
@@ -309,19 +343,34 @@ class PostRequest(Request):
 
 class FileRequest(Request):
     """
-    Adds HTDOCS areas to be processed by function
+    Adds HTDOCS areas to be processed by function.
+    The url prefixes are combined into one compiled regex.
     """
 
     def __init__(self):
         super().__init__()
         self.method = 'GET'
 
-    def call_url(self, _webserver, _name, *args, **kwargs):
-        for key in self.url2func.keys():
-            if _name.startswith(key):
-                self.url2func[key](_webserver, *args, **kwargs)
-                return True
-        return False
+    def build_route_table(self):
+        regex_list = []
+        group2func = {}
+        for group, (key, func) in enumerate(self.url2func.items(), 1):
+            regex_list.append('({})'.format(re.escape(key)))
+            group2func[group] = func
+        if regex_list:
+            return re.compile('|'.join(regex_list)), group2func
+        return None, group2func
+
+    def find_func(self, _name):
+        if self.route_table is None:
+            self.route_table = self.build_route_table()
+        route_re, group2func = self.route_table
+        if route_re is None:
+            return None
+        m = route_re.match(_name)
+        if m is None:
+            return None
+        return group2func[m.lastindex]
 
 
 getrequest = GetRequest()
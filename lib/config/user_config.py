@@ -59,6 +59,7 @@ class TVHUserConfig:
         self.logger = None
         self.defn_json = None
         self.db = None
+        self.config_version = None
         self.script_dir = str(_script_dir)
         self.defn_json = config_defn.load_default_config_defns()
         self.data = self.defn_json.get_default_config()
@@ -81,7 +82,13 @@ class TVHUserConfig:
         self.db.add_config(self.data)
 
     def refresh_config_data(self):
-        self.data = self.db.get_config()
+        """
+        Reloads the config only when it was saved since the last load
+        """
+        version = self.db.get_config_version()
+        if version is None or version != self.config_version:
+            self.data = self.db.get_config()
+            self.config_version = version
 
     def set_config(self, _config):
         self.data = copy.deepcopy(_config)
@@ -0,0 +1,56 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import logging
+import pathlib
+import sqlite3
+
+from lib.db.db import DB
+from lib.db.db import DB_EXT
+from lib.db.db_scheduler import DBScheduler
+
+
+def scheduler_tasks(config):
+    scheduler_db = DBScheduler(config)
+    if scheduler_db.save_task(
+            'Applications',
+            'Optimize Databases',
+            'internal',
+            None,
+            'lib.db.datamgmt.optimize.optimize_databases',
+            20,
+            'thread',
+            'Updates the database statistics used to choose indexes'
+    ):
+        scheduler_db.save_trigger(
+            'Applications',
+            'Optimize Databases',
+            'daily',
+            timeofday='03:30'
+        )
+
+
+def optimize_databases(_plugins):
+    logger = logging.getLogger(__name__)
+    db_dir = pathlib.Path(_plugins.config_obj.data['paths']['db_dir'])
+    for db_path in sorted(db_dir.glob('*' + DB_EXT)):
+        try:
+            DB.optimize_file(db_path)
+        except sqlite3.Error as ex:
+            logger.warning('Unable to optimize database {} {}'.format(db_path.name, ex))
+    return True
@@ -16,21 +16,44 @@ The above copyright notice and this permission notice shall be included in all c
 substantial portions of the Software.
 """
 
+import atexit
+import gzip
+import itertools
 import logging
 import os
 import pathlib
-import random
+import queue
 import shutil
 import sqlite3
 import threading
 import time
-
-LOCK = threading.Lock()
+import weakref
+
+THREAD_DB = threading.local()
+WRITE_LOCKS = {}
+WRITE_LOCKS_LOCK = threading.Lock()
+CONN_OWNERS_LOCK = threading.Lock()
+BUSY_TIMEOUT = 30.0         # seconds sqlite waits for a lock held by another connection
+SYNCHRONOUS = 'NORMAL'      # with WAL, only the last commits can be lost on a power failure
+POOL_SIZE = 4               # idle connections kept open for each database
+POOL_IDLE_TIMEOUT = 300     # seconds before an idle connection is closed
+STATEMENT_CACHE_SIZE = 256
+WRITE_BATCH_INTERVAL = 0.05  # seconds queued writes are collected before a commit
+WRITE_BATCH_SIZE = 500      # statements committed together at most
+FLUSH_TIMEOUT = 10.0        # seconds to wait for queued writes at exit
+FETCH_SIZE = 100            # rows read at a time by get_dict_iter
+ANALYSIS_LIMIT = 1000       # rows sampled per index by ANALYZE
 DB_EXT = '.db'
-BACKUP_EXT = '.sql'
+BACKUP_EXT = '.db.gz'
+SQL_BACKUP_EXT = '.sql'     # backups made by older versions
+TEMP_EXT = '.db.tmp'
+BACKUP_PAGES = 1024         # pages copied in each step of the online backup
+BACKUP_GZIP_LEVEL = 1       # higher levels are much slower for a small gain
+COPY_BUFFER_SIZE = 1048576
 
 # trailers used in sqlcmds.py
 SQL_CREATE_TABLES = 'ct'
+SQL_CREATE_INDEXES = 'ci'
 SQL_DROP_TABLES = 'dt'
 SQL_ADD_ROW = '_add'
 SQL_UPDATE = '_update'
@@ -38,27 +61,329 @@ SQL_GET = '_get'
 SQL_DELETE = '_del'
 FILE_LINK_ZIP = '_filelinks'
 
+
+class ConnectionPool:
+    """
+    Reusable connections for one database file.  A thread checks out a
+    connection on its first query and returns it with DB.close_thread()
+    or when the thread ends, so short lived threads no longer leave
+    open connections behind.  At most POOL_SIZE idle connections are
+    kept and those idle longer than POOL_IDLE_TIMEOUT are closed.
+    """
+    pools = {}
+    pools_lock = threading.Lock()
+    forked_conns = []
+
+    def __init__(self, _db_fullpath):
+        self.db_fullpath = _db_fullpath
+        self.lock = threading.Lock()
+        self.idle = []  # (connection, time returned), oldest first
+
+    @classmethod
+    def get_pool(cls, _db_name, _db_fullpath):
+        with cls.pools_lock:
+            pool = cls.pools.get(_db_name)
+            if pool is None:
+                pool = cls.pools[_db_name] = cls(_db_fullpath)
+            return pool
+
+    @classmethod
+    def reset_after_fork(cls):
+        """
+        sqlite connections must not be used or closed across a fork, so
+        the child process keeps the parent's connections untouched and
+        opens its own
+        """
+        cls.pools_lock = threading.Lock()
+        cls.forked_conns = [DB.conn]
+        for pool in cls.pools.values():
+            cls.forked_conns.append(pool.idle)
+            pool.idle = []
+            pool.lock = threading.Lock()
+        DB.conn = {}
+        WriteQueue.queues = {}
+        WriteQueue.queues_lock = threading.Lock()
+
+    def connect(self):
+        """
+        Opens the database in WAL mode so readers do not wait on writers.
+        Lock contention is handled inside sqlite with the busy timeout.
+        Only declared types are converted, the column names are not parsed.
+        """
+        conn = sqlite3.connect(
+            self.db_fullpath, timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous={}'.format(SYNCHRONOUS))
+        return conn
+
+    def checkout(self):
+        with self.lock:
+            self.close_expired(time.time())
+            if self.idle:
+                return self.idle.pop()[0]
+        return self.connect()
+
+    def checkin(self, _conn):
+        try:
+            if _conn.in_transaction:
+                _conn.rollback()
+        except sqlite3.ProgrammingError:
+            # connection is already closed
+            return
+        now = time.time()
+        with self.lock:
+            self.idle.append((_conn, now))
+            self.close_expired(now)
+            while len(self.idle) > POOL_SIZE:
+                self.idle.pop(0)[0].close()
+
+    def close_expired(self, _now):
+        while self.idle and _now - self.idle[0][1] > POOL_IDLE_TIMEOUT:
+            self.idle.pop(0)[0].close()
+
+
+class WriteQueue:
+    """
+    Writer thread for one database.  Queued statements run on the
+    writer's own connection and are committed together every
+    WRITE_BATCH_INTERVAL seconds or WRITE_BATCH_SIZE statements, so
+    frequent small writes share one commit instead of one each.
+    """
+    queues = {}
+    queues_lock = threading.Lock()
+
+    def __init__(self, _db_name, _pool, _write_lock):
+        self.logger = logging.getLogger(__name__)
+        self.db_name = _db_name
+        self.pool = _pool
+        self.write_lock = _write_lock
+        self.queue = queue.Queue()
+        t_writer = threading.Thread(target=self.run, args=())
+        t_writer.daemon = True
+        t_writer.start()
+
+    @classmethod
+    def get_queue(cls, _db):
+        with cls.queues_lock:
+            write_queue = cls.queues.get(_db.db_name)
+            if write_queue is None:
+                write_queue = cls.queues[_db.db_name] = cls(_db.db_name, _db.pool, _db.write_lock)
+            return write_queue
+
+    @classmethod
+    def flush_all(cls, _timeout=FLUSH_TIMEOUT):
+        """
+        Waits for the writes queued by every thread in this process
+        to be committed, used before the process exits
+        """
+        with cls.queues_lock:
+            write_queues = list(cls.queues.values())
+        for write_queue in write_queues:
+            write_queue.put(None, None, PendingWrites()).wait(_timeout)
+
+    def put(self, _sqlcmd, _values, _pending):
+        """
+        Returns an Event that is set once the statement is committed or
+        has failed.  A failure is recorded in _pending.error.
+        A _sqlcmd of None only marks a point in the queue.
+        """
+        done = threading.Event()
+        self.queue.put((_sqlcmd, _values, done, _pending))
+        return done
+
+    def run(self):
+        conn = self.pool.connect()
+        while True:
+            batch = [self.queue.get()]
+            end_time = time.monotonic() + WRITE_BATCH_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                timeout = end_time - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.write_batch(conn, batch)
+            except Exception as e:
+                # the writer must keep running or every queued write is lost
+                self.logger.warning('{} Queued write batch failed, {}'
+                                    .format(self.db_name, e))
+
+    def write_batch(self, _conn, _batch):
+        """
+        Runs and commits the batch.  Each waiting thread is released
+        even when a statement, the commit or the rollback fails.
+        """
+        try:
+            with self.write_lock:
+                for sqlcmd, values, done, pending in _batch:
+                    if sqlcmd is None:
+                        continue
+                    try:
+                        _conn.execute(sqlcmd, values or ())
+                    except Exception as e:
+                        self.logger.warning('{} Queued write failed, {}'
+                                            .format(self.db_name, e))
+                        pending.error = e
+                try:
+                    _conn.commit()
+                except Exception as e:
+                    self.logger.warning('{} Queued writes not committed, {}'
+                                        .format(self.db_name, e))
+                    for sqlcmd, values, done, pending in _batch:
+                        pending.error = e
+                    _conn.rollback()
+        finally:
+            for sqlcmd, values, done, pending in _batch:
+                done.set()
+
+
+class PendingWrites:
+    """
+    The writes a thread has queued for one database since it last
+    waited.  error is set by the writer thread when any of them fails.
+    """
+
+    def __init__(self):
+        self.last_done = None
+        self.error = None
+
+
+class ThreadGuard:
+    """
+    Stored in the thread local data, so it is released when the
+    thread ends and the thread's connections go back to the pool.
+    A thread ident can be reused before the finalizer runs, so each
+    guard has its own token and only the owner's finalizer releases.
+    """
+    tokens = itertools.count()
+
+    def __init__(self):
+        self.token = next(ThreadGuard.tokens)
+
+
 class DB:
     conn = {}
+    # token of the ThreadGuard of the thread currently using each ident
+    conn_owners = {}
+    indexed_dbs = set()
 
     def __init__(self, _config, _db_name, _sqlcmds):
         self.logger = logging.getLogger(__name__ + str(threading.get_ident()))
         self.config = _config
         self.db_name = _db_name
         self.sqlcmds = _sqlcmds
-        self.cur = None
-        self.offset = -1
-        self.where = None
-        self.sqlcmd = None
+        self.write_lock = DB.get_write_lock(_db_name)
         self.db_fullpath = pathlib.Path(self.config['paths']['db_dir']) \
             .joinpath(_db_name + DB_EXT)
+        self.pool = ConnectionPool.get_pool(_db_name, self.db_fullpath)
         if not os.path.exists(self.db_fullpath):
             self.logger.debug('Creating new database: {} {}'.format(_db_name, self.db_fullpath))
             self.create_tables()
         self.check_connection()
         DB.conn[self.db_name][threading.get_ident()].commit()
+        if self.db_name not in DB.indexed_dbs:
+            self.create_indexes()
+
+    @classmethod
+    def thread_instance(cls, _config):
+        """
+        Returns the instance of the database class shared within the
+        current thread.  Connections are already per thread, so this
+        skips the setup of a new instance for each caller.
+        """
+        instances = getattr(THREAD_DB, 'instances', None)
+        if instances is None:
+            instances = THREAD_DB.instances = {}
+        db = instances.get(cls)
+        if db is None:
+            db = instances[cls] = cls(_config)
+        return db
+
+    @staticmethod
+    def get_write_lock(_db_name):
+        """
+        Writers to the same database wait here instead of in sqlite.
+        Readers do not lock since WAL lets them run during a write.
+        """
+        with WRITE_LOCKS_LOCK:
+            lock = WRITE_LOCKS.get(_db_name)
+            if lock is None:
+                lock = WRITE_LOCKS[_db_name] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def optimize_file(_db_path):
+        """
+        Updates the statistics the query planner uses to choose indexes
+        """
+        conn = sqlite3.connect(_db_path, timeout=BUSY_TIMEOUT)
+        try:
+            conn.execute('PRAGMA analysis_limit={}'.format(ANALYSIS_LIMIT))
+            conn.execute('ANALYZE')
+            conn.execute('PRAGMA optimize')
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def close_thread():
+        """
+        Returns all database connections used by the current thread to the pool
+        """
+        THREAD_DB.__dict__.pop('instances', None)
+        DB.wait_thread_writes()
+        DB.release_thread(threading.get_ident())
+
+    @staticmethod
+    def wait_thread_writes():
+        """
+        Waits for the writes the current thread queued for any database.
+        Returns False if any of them failed.
+        """
+        pending_writes = getattr(THREAD_DB, 'pending_writes', None)
+        is_committed = True
+        while pending_writes:
+            db_name, pending = pending_writes.popitem()
+            pending.last_done.wait()
+            if pending.error is not None:
+                is_committed = False
+        return is_committed
+
+    @staticmethod
+    def release_thread(_thread_id, _token=None):
+        """
+        With a _token, only releases when that guard still owns the
+        thread ident, otherwise a new thread with the same ident is using it
+        """
+        released = []
+        with CONN_OWNERS_LOCK:
+            if _token is not None:
+                if DB.conn_owners.get(_thread_id) != _token:
+                    return
+                del DB.conn_owners[_thread_id]
+            for db_name, db_conn_dbname in list(DB.conn.items()):
+                conn = db_conn_dbname.pop(_thread_id, None)
+                if conn is not None:
+                    released.append((db_name, conn))
+        for db_name, conn in released:
+            ConnectionPool.pools[db_name].checkin(conn)
+
+    @staticmethod
+    def watch_thread():
+        if getattr(THREAD_DB, 'guard', None) is None:
+            guard = THREAD_DB.guard = ThreadGuard()
+            with CONN_OWNERS_LOCK:
+                DB.conn_owners[threading.get_ident()] = guard.token
+            weakref.finalize(guard, DB.release_thread, threading.get_ident(), guard.token)
 
     def sql_exec(self, _sqlcmd, _bindings=None, _cursor=None):
+        self.wait_writes()
         try:
             self.check_connection()
             if _bindings:
@@ -76,18 +401,12 @@ class DB:
             del DB.conn[self.db_name][threading.get_ident()]
             raise e
 
-    def rnd_sleep(self, _sec):
-        r = random.randrange(0, 50)
-        sec = _sec + r / 100
-        time.sleep(sec)
-
     def add(self, _table, _values):
         self.logger.trace('DB add() called {}'.format(threading.get_ident()))
+        self.wait_writes()
         cur = None
         sqlcmd = self.sqlcmds[''.join([_table, SQL_ADD_ROW])]
-        i = 10
-        while i > 0:
-            i -= 1
+        with self.write_lock:
             try:
                 self.check_connection()
                 cur = DB.conn[self.db_name][threading.get_ident()].cursor()
@@ -98,22 +417,23 @@ class DB:
                 self.logger.trace('DB add() exit {}'.format(threading.get_ident()))
                 return lastrow
             except sqlite3.OperationalError as e:
-                self.logger.warning('{} Add request ignored, retrying {}, {}'
-                                    .format(self.db_name, i, e))
+                self.logger.warning('{} Add request failed, {}'
+                                    .format(self.db_name, e))
                 DB.conn[self.db_name][threading.get_ident()].rollback()
                 if cur is not None:
                     cur.close()
-                self.rnd_sleep(0.3)
         self.logger.trace('DB add() exit {}'.format(threading.get_ident()))
         return None
 
-    def delete(self, _table, _values):
+    def delete(self, _table, _values, sql=None):
         self.logger.trace('DB delete() called {}'.format(threading.get_ident()))
+        self.wait_writes()
         cur = None
-        sqlcmd = self.sqlcmds[''.join([_table, SQL_DELETE])]
-        i = 10
-        while i > 0:
-            i -= 1
+        if sql is None:
+            sqlcmd = self.sqlcmds[''.join([_table, SQL_DELETE])]
+        else:
+            sqlcmd = sql
+        with self.write_lock:
             try:
                 self.check_connection()
                 cur = DB.conn[self.db_name][threading.get_ident()].cursor()
@@ -124,118 +444,200 @@ class DB:
                 self.logger.trace('DB delete() exit {}'.format(threading.get_ident()))
                 return num_deleted
             except sqlite3.OperationalError as e:
-                self.logger.warning('{} Delete request ignored, retrying {}, {}'
-                                    .format(self.db_name, i, e))
+                self.logger.warning('{} Delete request failed, {}'
+                                    .format(self.db_name, e))
                 DB.conn[self.db_name][threading.get_ident()].rollback()
                 if cur is not None:
                     cur.close()
-                self.rnd_sleep(0.3)
         self.logger.trace('DB delete() exit {}'.format(threading.get_ident()))
         return 0
 
-    def update(self, _table, _values=None):
+    def update(self, _table, _values=None, sql=None):
         self.logger.trace('DB update() called {}'.format(threading.get_ident()))
+        self.wait_writes()
         cur = None
-        sqlcmd = self.sqlcmds[''.join([_table, SQL_UPDATE])]
-        i = 10
-        while i > 0:
-            i -= 1
+        if sql is None:
+            sqlcmd = self.sqlcmds[''.join([_table, SQL_UPDATE])]
+        else:
+            sqlcmd = sql
+        with self.write_lock:
             try:
-                LOCK.acquire(True)
                 self.check_connection()
                 cur = DB.conn[self.db_name][threading.get_ident()].cursor()
                 self.sql_exec(sqlcmd, _values, cur)
                 DB.conn[self.db_name][threading.get_ident()].commit()
                 lastrow = cur.lastrowid
                 cur.close()
-                LOCK.release()
                 self.logger.trace('DB update() exit {}'.format(threading.get_ident()))
                 return lastrow
             except sqlite3.OperationalError as e:
-                self.logger.notice('{} Update request ignored, retrying {}, {}'
-                                    .format(self.db_name, i, e))
+                self.logger.notice('{} Update request failed, {}'
+                                   .format(self.db_name, e))
                 DB.conn[self.db_name][threading.get_ident()].rollback()
                 if cur is not None:
                     cur.close()
-                LOCK.release()
-                self.rnd_sleep(0.3)
         self.logger.trace('DB update() exit {}'.format(threading.get_ident()))
         return None
 
-    def commit(self):
-        DB.conn[self.db_name][threading.get_ident()].commit()
-
-    def get(self, _table, _where=None):
+    def write_many(self, _writes):
+        """
+        Runs a list of (sqlcmd name, list of values) with executemany
+        in one transaction and one commit.  Returns True when committed.
+        """
+        self.logger.trace('DB write_many() called {}'.format(threading.get_ident()))
+        self.wait_writes()
         cur = None
-        sqlcmd = self.sqlcmds[''.join([_table, SQL_GET])]
-        i = 10
-        while i > 0:
-            i -= 1
+        with self.write_lock:
             try:
                 self.check_connection()
-                cur = DB.conn[self.db_name][threading.get_ident()].cursor()
-                self.sql_exec(sqlcmd, _where, cur)
-                result = cur.fetchall()
+                conn = DB.conn[self.db_name][threading.get_ident()]
+                cur = conn.cursor()
+                for sqlcmd_name, values_list in _writes:
+                    if values_list:
+                        cur.executemany(self.sqlcmds[sqlcmd_name], values_list)
+                conn.commit()
                 cur.close()
-                return result
-            except sqlite3.OperationalError as e:
-                self.logger.warning('{} GET request ignored retrying {}, {}'
-                                    .format(self.db_name, i, e))
+                self.logger.trace('DB write_many() exit {}'.format(threading.get_ident()))
+                return True
+            except sqlite3.Error as e:
+                self.logger.warning('{} Write request failed, {}'
+                                    .format(self.db_name, e))
                 DB.conn[self.db_name][threading.get_ident()].rollback()
                 if cur is not None:
                     cur.close()
-                self.rnd_sleep(0.3)
+        self.logger.trace('DB write_many() exit {}'.format(threading.get_ident()))
+        return False
+
+    def queue_add(self, _table, _values, _wait=False):
+        return self.queue_write(self.sqlcmds[''.join([_table, SQL_ADD_ROW])], _values, _wait)
+
+    def queue_update(self, _table, _values=None, _wait=False):
+        return self.queue_write(self.sqlcmds[''.join([_table, SQL_UPDATE])], _values, _wait)
+
+    def queue_write(self, _sqlcmd, _values, _wait):
+        """
+        Sends the write to the database writer thread to be committed
+        with other writes.  Set _wait when the write must be committed
+        before returning, then False is returned if this or any earlier
+        queued write by the thread failed.  Later reads and writes by this
+        thread wait for the queued writes, so the thread always sees its own writes.
+        """
+        pending_writes = getattr(THREAD_DB, 'pending_writes', None)
+        if pending_writes is None:
+            pending_writes = THREAD_DB.pending_writes = {}
+        pending = pending_writes.get(self.db_name)
+        if pending is None:
+            pending = pending_writes[self.db_name] = PendingWrites()
+        pending.last_done = WriteQueue.get_queue(self).put(_sqlcmd, _values, pending)
+        if _wait:
+            return self.wait_writes()
+        return True
+
+    def wait_writes(self):
+        """
+        Waits for the writes queued by this thread to be committed.
+        Returns False if any of them failed.
+        """
+        pending_writes = getattr(THREAD_DB, 'pending_writes', None)
+        if pending_writes:
+            pending = pending_writes.pop(self.db_name, None)
+            if pending is not None:
+                pending.last_done.wait()
+                if pending.error is not None:
+                    return False
+        return True
+
+    def commit(self):
+        DB.conn[self.db_name][threading.get_ident()].commit()
+
+    def get(self, _table, _where=None, sql=None):
+        cur = None
+        if sql is None:
+            sqlcmd = self.sqlcmds[''.join([_table, SQL_GET])]
+        else:
+            sqlcmd = sql
+        try:
+            self.check_connection()
+            cur = DB.conn[self.db_name][threading.get_ident()].cursor()
+            self.sql_exec(sqlcmd, _where, cur)
+            result = cur.fetchall()
+            cur.close()
+            return result
+        except sqlite3.OperationalError as e:
+            self.logger.warning('{} GET request failed, {}'
+                                .format(self.db_name, e))
+            DB.conn[self.db_name][threading.get_ident()].rollback()
+            if cur is not None:
+                cur.close()
         return None
 
+    def where_clause(self, _sqlcmd_name, _terms, _required_terms=()):
+        """
+        Returns the sqlcmd with its {} replaced by a WHERE clause built
+        from (condition, value) pairs, and the bindings.  Conditions in
+        _terms with a value of None, '' or '%' match every row and are left
+        out, so the query uses an index instead of scanning with LIKE '%'.
+        False and 0 are real values and are kept.
+        """
+        conditions = [condition for condition, value in _required_terms]
+        bindings = [value for condition, value in _required_terms]
+        for condition, value in _terms:
+            if value is None or value == '' or value == '%':
+                continue
+            conditions.append(condition)
+            bindings.append(value)
+        where = ''
+        if conditions:
+            where = 'WHERE ' + ' AND '.join(conditions)
+        return self.sqlcmds[_sqlcmd_name].format(where), tuple(bindings)
+
     def get_dict(self, _table, _where=None, sql=None):
         cur = None
         if sql is None:
             sqlcmd = self.sqlcmds[''.join([_table, SQL_GET])]
         else:
             sqlcmd = sql
-        i = 10
-        while i > 0:
-            i -= 1
-            try:
-                LOCK.acquire(True)
-                self.check_connection()
-                cur = DB.conn[self.db_name][threading.get_ident()].cursor()
-                self.sql_exec(sqlcmd, _where, cur)
-                records = cur.fetchall()
-                rows = []
-                for row in records:
-                    rows.append(dict(zip([c[0] for c in cur.description], row)))
+        try:
+            self.check_connection()
+            cur = DB.conn[self.db_name][threading.get_ident()].cursor()
+            self.sql_exec(sqlcmd, _where, cur)
+            records = cur.fetchall()
+            rows = []
+            for row in records:
+                rows.append(dict(zip([c[0] for c in cur.description], row)))
+            cur.close()
+            return rows
+        except sqlite3.OperationalError as e:
+            self.logger.warning('{} GET request failed, {}'
+                                .format(self.db_name, e))
+            DB.conn[self.db_name][threading.get_ident()].rollback()
+            if cur is not None:
                 cur.close()
-                LOCK.release()
-                return rows
-            except sqlite3.OperationalError as e:
-                self.logger.warning('{} GET request ignored retrying {}, {}'
-                                    .format(self.db_name, i, e))
-                DB.conn[self.db_name][threading.get_ident()].rollback()
-                if cur is not None:
-                    cur.close()
-                LOCK.release()
-                self.rnd_sleep(0.3)
         return None
 
-    def get_init(self, _table, _where=None):
+    def get_dict_iter(self, _table, _where=None, sql=None):
         """
-            Requires "LIMIT ? OFFSET ?" at the end of the sql statement
+        Generator returning the rows as dicts.  One cursor stays open and
+        rows are fetched FETCH_SIZE at a time, so large tables are not
+        loaded into memory at once.  Close the generator when stopping early.
         """
-        self.sqlcmd = self.sqlcmds[''.join([_table, SQL_GET])]
-        self.where = list(_where)
-        self.offset = 0
-
-    def get_dict_next(self):
-        w_list = self.where.copy()
-        w_list.extend((1, self.offset))
-        self.cur = self.sql_exec(self.sqlcmd, tuple(w_list))
-        records = self.cur.fetchall()
-        self.offset += 1
-        if len(records) == 0:
-            return None
-        row = records[0]
-        return dict(zip([c[0] for c in self.cur.description], row))
+        if sql is None:
+            sqlcmd = self.sqlcmds[''.join([_table, SQL_GET])]
+        else:
+            sqlcmd = sql
+        self.check_connection()
+        cur = DB.conn[self.db_name][threading.get_ident()].cursor()
+        try:
+            self.sql_exec(sqlcmd, _where, cur)
+            columns = [c[0] for c in cur.description]
+            while True:
+                records = cur.fetchmany(FETCH_SIZE)
+                if not records:
+                    break
+                for row in records:
+                    yield dict(zip(columns, row))
+        finally:
+            cur.close()
 
     def save_file(self, _keys, _blob):
         """
@@ -317,13 +719,32 @@ class DB:
             cur = self.sql_exec(table)
         DB.conn[self.db_name][threading.get_ident()].commit()
 
+    def create_indexes(self):
+        """
+        Indexes are created on each start, so they are also
+        added to databases made by older versions
+        """
+        self.wait_writes()
+        with self.write_lock:
+            for index in self.sqlcmds.get(SQL_CREATE_INDEXES, []):
+                self.sql_exec(index)
+            DB.conn[self.db_name][threading.get_ident()].commit()
+        DB.indexed_dbs.add(self.db_name)
+
     def drop_tables(self):
         for table in self.sqlcmds[SQL_DROP_TABLES]:
             cur = self.sql_exec(table)
         DB.conn[self.db_name][threading.get_ident()].commit()
 
-    def export_sql(self, backup_folder):
+    def backup_db(self, backup_folder):
+        """
+        Copies the database with the sqlite online backup API into a
+        gzip file.  The copy is made BACKUP_PAGES pages at a time from one
+        read transaction, so with WAL other connections keep reading and
+        writing while the backup runs and the backup is not restarted.
+        """
         self.logger.debug('Running backup for {} database'.format(self.db_name))
+        temp_file = pathlib.Path(backup_folder, self.db_name + TEMP_EXT)
         try:
             if not os.path.isdir(backup_folder):
                 os.mkdir(backup_folder)
@@ -338,14 +759,35 @@ class DB:
                 shutil.make_archive(backup_filelink, 'zip', db_linkfilepath)
 
             backup_file = pathlib.Path(backup_folder, self.db_name + BACKUP_EXT)
-            with open(backup_file, 'w', encoding='utf-8') as export_f:
-                for line in DB.conn[self.db_name][threading.get_ident()].iterdump():
-                    export_f.write('%s\n' % line)
-        except PermissionError as e:
+            conn = DB.conn[self.db_name][threading.get_ident()]
+            backup_conn = sqlite3.connect(temp_file)
+            try:
+                conn.commit()
+                conn.execute('BEGIN')
+                conn.execute('SELECT count(*) FROM sqlite_master').fetchone()
+                conn.backup(backup_conn, pages=BACKUP_PAGES)
+            finally:
+                conn.rollback()
+                backup_conn.close()
+            with open(temp_file, 'rb') as db_f, \
+                    gzip.open(backup_file, 'wb', compresslevel=BACKUP_GZIP_LEVEL) as export_f:
+                shutil.copyfileobj(db_f, export_f, COPY_BUFFER_SIZE)
+        except (OSError, sqlite3.Error) as e:
             self.logger.warning(e)
             self.logger.warning('Unable to make backups')
+        finally:
+            try:
+                temp_file.unlink(missing_ok=True)
+            except OSError as e:
+                self.logger.warning('Unable to remove {}, {}'.format(temp_file, e))
 
-    def import_sql(self, backup_folder):
+    def restore_db(self, backup_folder):
+        """
+        Restores a gzip database backup by copying it with the backup API
+        into the live database in one step, which sqlite applies as a
+        single transaction.  Backups made by older versions as SQL text
+        are run with executescript, also as a single transaction.
+        """
         self.logger.debug('Running restore for {} database'.format(self.db_name))
         if not os.path.isdir(backup_folder):
             msg = 'Backup folder does not exist: {}'.format(backup_folder)
@@ -361,39 +803,74 @@ class DB:
             shutil.unpack_archive(backup_filelink, db_linkfilepath)
 
         backup_file = pathlib.Path(backup_folder, self.db_name + BACKUP_EXT)
-        if not os.path.isfile(backup_file):
+        sql_backup_file = pathlib.Path(backup_folder, self.db_name + SQL_BACKUP_EXT)
+        if os.path.isfile(backup_file):
+            msg = self.restore_db_file(backup_file)
+            if msg is not None:
+                return msg
+        elif os.path.isfile(sql_backup_file):
+            self.check_connection()
+            with open(sql_backup_file, 'r', encoding='utf-8') as import_f:
+                sql_script = import_f.read()
+            self.wait_writes()
+            with self.write_lock:
+                self.drop_tables()
+                DB.conn[self.db_name][threading.get_ident()].executescript(sql_script)
+        else:
             msg = 'Backup file does not exist, skipping: {}'.format(backup_file)
             self.logger.info(msg)
             return msg
-        self.check_connection()
-        self.drop_tables()
-        with open(backup_file, 'r') as import_f:
-            cmd = ''
-            for line in import_f:
-                cmd += line
-                if ';' in line[-3:]:
-                    DB.conn[self.db_name][threading.get_ident()].execute(cmd)
-                    cmd = ''
+        self.create_indexes()
+        return None
+
+    def restore_db_file(self, _backup_file):
+        temp_file = pathlib.Path(str(_backup_file)[:-len(BACKUP_EXT)] + TEMP_EXT)
+        try:
+            with gzip.open(_backup_file, 'rb') as import_f, open(temp_file, 'wb') as db_f:
+                shutil.copyfileobj(import_f, db_f, COPY_BUFFER_SIZE)
+            self.check_connection()
+            conn = DB.conn[self.db_name][threading.get_ident()]
+            restore_conn = sqlite3.connect(temp_file)
+            self.wait_writes()
+            try:
+                with self.write_lock:
+                    conn.commit()
+                    restore_conn.backup(conn)
+            finally:
+                restore_conn.close()
+        except (OSError, EOFError, sqlite3.DatabaseError) as ex:
+            msg = 'Unable to restore {} database from {}: {}'.format(self.db_name, _backup_file, ex)
+            self.logger.warning(msg)
+            return msg
+        finally:
+            if temp_file.exists():
+                os.remove(temp_file)
         return None
 
     def close(self):
         thread_id = threading.get_ident()
-        DB.conn[self.db_name][thread_id].close()
-        del DB.conn[self.db_name][thread_id]
+        self.pool.checkin(DB.conn[self.db_name].pop(thread_id))
         self.logger.debug('{} database closed for thread:{}'.format(self.db_name, thread_id))
 
     def check_connection(self):
+        # before the lookup, so a connection left under a reused ident
+        # is not released while this thread uses it
+        DB.watch_thread()
         if self.db_name not in DB.conn:
             DB.conn[self.db_name] = {}
         db_conn_dbname = DB.conn[self.db_name]
 
         if threading.get_ident() not in db_conn_dbname:
-            db_conn_dbname[threading.get_ident()] = sqlite3.connect(
-                self.db_fullpath, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+            db_conn_dbname[threading.get_ident()] = self.pool.checkout()
         else:
             try:
                 db_conn_dbname[threading.get_ident()].total_changes
             except sqlite3.ProgrammingError:
                 self.logger.debug('Reopening {} database for thread:{}'.format(self.db_name, threading.get_ident()))
-                db_conn_dbname[threading.get_ident()] = sqlite3.connect(
-                    self.db_fullpath, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+                db_conn_dbname[threading.get_ident()] = self.pool.connect()
+
+
+atexit.register(WriteQueue.flush_all)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=ConnectionPool.reset_after_fork)
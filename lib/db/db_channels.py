@@ -23,6 +23,10 @@ import sqlite3
 import threading
 
 from lib.db.db import DB
+from lib.db.db import SQL_ADD_ROW
+from lib.db.db import SQL_DELETE
+from lib.db.db import SQL_GET
+from lib.db.db import SQL_UPDATE
 from lib.common.decorators import Backup
 from lib.common.decorators import Restore
 
@@ -32,6 +36,10 @@ DB_STATUS_TABLE = 'status'
 DB_ZONE_TABLE = 'zones'
 DB_CATEGORIES_TABLE = 'categories'
 DB_CONFIG_NAME = 'db_files-channels_db'
+# stored in the sqlite user_version.  Version 1 stores thumbnail_size
+# and atsc as JSON instead of python literals
+CHANNEL_FORMAT_VERSION = 1
+UID_CHUNK_SIZE = 500    # uids bound in each IN list, below the sqlite variable limit
 
 sqlcmds = {
     'ct': [
@@ -80,6 +88,25 @@ sqlcmds = {
         """
 
     ],
+    # namespace and instance are matched ignoring case, the same as LIKE
+    'ci': [
+        """
+        CREATE INDEX IF NOT EXISTS channels_ns_inst ON channels (
+            namespace COLLATE NOCASE, instance COLLATE NOCASE)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS channels_uid ON channels (uid)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS channels_number ON channels (
+            CAST(number as FLOAT), namespace, instance)
+        """,
+        # default channel order within one namespace
+        """
+        CREATE INDEX IF NOT EXISTS channels_ns_number ON channels (
+            namespace COLLATE NOCASE, CAST(number as FLOAT), namespace, instance)
+        """
+    ],
     'dt': [
         """
         DROP TABLE IF EXISTS channels
@@ -92,9 +119,71 @@ sqlcmds = {
         """,
         """
         DROP TABLE IF EXISTS zones
+        """,
+        """
+        DROP TABLE IF EXISTS channels_version
         """
     ],
 
+    # the version increases with every change to the channels table,
+    # so processes can tell when their channel index is out of date
+    'channels_version_ct': [
+        """
+        CREATE TABLE IF NOT EXISTS channels_version (
+            key     VARCHAR(255) NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY(key)
+            )
+        """,
+        """
+        INSERT OR IGNORE INTO channels_version (key, version) VALUES ('channels', 0)
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS channels_insert_version AFTER INSERT ON channels
+        BEGIN
+            UPDATE channels_version SET version=version+1 WHERE key='channels';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS channels_update_version AFTER UPDATE ON channels
+        BEGIN
+            UPDATE channels_version SET version=version+1 WHERE key='channels';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS channels_delete_version AFTER DELETE ON channels
+        BEGIN
+            UPDATE channels_version SET version=version+1 WHERE key='channels';
+        END
+        """
+    ],
+    'channels_version_get':
+        """
+        SELECT version FROM channels_version WHERE key='channels'
+        """,
+    'channels_version_update':
+        """
+        UPDATE channels_version SET version=? WHERE key='channels'
+        """,
+    'channels_format_get':
+        """
+        PRAGMA user_version
+        """,
+    'channels_format_update':
+        """
+        PRAGMA user_version={}
+        """.format(CHANNEL_FORMAT_VERSION),
+    'channels_encoded_get':
+        """
+        SELECT namespace, instance, uid, thumbnail_size, atsc FROM channels
+        """,
+    'channels_encoded_update':
+        """
+        UPDATE channels SET
+            thumbnail_size=?, atsc=?
+            WHERE namespace=? AND instance=? AND uid=?
+        """,
+
     'channels_add':
         """
         INSERT INTO channels (
@@ -102,6 +191,25 @@ sqlcmds = {
             group_tag, thumbnail, thumbnail_size, updated, json
             ) VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )
         """,
+    # new channels are added with all fields.  Existing channels keep the
+    # user editable fields and only pick up a thumbnail if they have none.
+    # Rows that have not changed are not rewritten.
+    'channels_upsert':
+        """
+        INSERT INTO channels (
+            namespace, instance, enabled, uid, number, display_number, display_name,
+            group_tag, thumbnail, thumbnail_size, updated, json
+            ) VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )
+            ON CONFLICT(namespace, instance, uid) DO UPDATE SET
+                number=excluded.number, updated=excluded.updated, json=excluded.json,
+                thumbnail=COALESCE(thumbnail, excluded.thumbnail),
+                thumbnail_size=CASE WHEN thumbnail IS NULL AND excluded.thumbnail IS NOT NULL
+                    THEN excluded.thumbnail_size ELSE thumbnail_size END
+            WHERE number IS NOT excluded.number
+                OR updated IS NOT excluded.updated
+                OR json IS NOT excluded.json
+                OR (thumbnail IS NULL AND excluded.thumbnail IS NOT NULL)
+        """,
     'channels_update':
         """
         UPDATE channels SET 
@@ -114,6 +222,12 @@ sqlcmds = {
             enabled=?, display_number=?, display_name=?, group_tag=?, thumbnail=?, thumbnail_size=?
             WHERE namespace=? AND instance=? AND uid=?
         """,
+    # only updates the size when the thumbnail has not changed again
+    'channels_thumbnail_size_update':
+        """
+        UPDATE channels SET thumbnail_size=?
+            WHERE namespace=? AND instance=? AND uid=? AND thumbnail IS ?
+        """,
     'channels_updated_update':
         """
         UPDATE channels SET updated = False WHERE namespace=? AND instance=?
@@ -142,21 +256,34 @@ sqlcmds = {
             number=?
             WHERE namespace=? AND instance=? AND uid=?
         """,
+    'channels_uid_del':
+        """
+        DELETE FROM channels WHERE namespace=? AND instance=? AND uid=?
+        """,
     'channels_del':
         """
-        DELETE FROM channels WHERE updated LIKE ?
-        AND namespace LIKE ? AND instance LIKE ?
+        DELETE FROM channels {}
         """,
     'channels_get':
         """
-        SELECT * FROM channels WHERE namespace LIKE ?
-        AND instance LIKE ? AND enabled LIKE ?
+        SELECT * FROM channels {}
         ORDER BY CAST(number as FLOAT), namespace, instance
         """,
     'channels_one_get':
         """
-        SELECT * FROM channels WHERE uid=? AND namespace LIKE ?
-        AND instance LIKE ?
+        SELECT * FROM channels {}
+        """,
+    'channels_sorted_get':
+        """
+        SELECT * FROM channels {} ORDER BY
+        """,
+    'channels_by_uid_get':
+        """
+        SELECT * FROM channels WHERE namespace=? COLLATE NOCASE AND uid IN ({})
+        """,
+    'channels_uid_get':
+        """
+        SELECT uid FROM channels WHERE namespace=? AND instance=?
         """,
     'channels_name_get':
         """
@@ -198,81 +325,249 @@ sqlcmds = {
 }
 
 
+def encode_atsc(_atsc):
+    """
+    atsc is a list of transport stream packets, stored as hex strings
+    """
+    if _atsc is None:
+        return None
+    return json.dumps([packet.hex() for packet in _atsc])
+
+
+def decode_atsc(_atsc_str):
+    if _atsc_str is None:
+        return None
+    return [bytes.fromhex(packet) for packet in json.loads(_atsc_str)]
+
+
+def convert_literal(_value_str):
+    """
+    Returns the value of a column stored as either JSON or a python literal
+    """
+    try:
+        return json.loads(_value_str), True
+    except ValueError:
+        return ast.literal_eval(_value_str), False
+
+
+class ChannelIndex:
+    """
+    Per process index of the channels table used to resolve a channel
+    without loading and decoding every channel row.  Rows are indexed by
+    uid, display number and display name and the index is rebuilt when
+    the channels version changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.by_uid = {}
+        self.by_number = {}
+        self.by_name = {}
+
+    def rebuild(self, _version, _channels):
+        by_uid = {}
+        by_number = {}
+        by_name = {}
+        for uid, rows in _channels.items():
+            by_uid[uid] = rows
+            for row in rows:
+                by_number.setdefault(row['display_number'], []).append(row)
+                by_name.setdefault(row['display_name'], []).append(row)
+        self.by_uid = by_uid
+        self.by_number = by_number
+        self.by_name = by_name
+        self.version = _version
+
+
 class DBChannels(DB):
 
+    channel_index = ChannelIndex()
+    is_version_setup = False
+
     def __init__(self, _config):
         super().__init__(_config, _config['datamgmt'][DB_CONFIG_NAME], sqlcmds)
+        if not DBChannels.is_version_setup:
+            self.setup_channels_version()
+            self.setup_channel_format()
+
+    def setup_channels_version(self):
+        """
+        Adds the channels version table and triggers to existing databases
+        """
+        for sqlcmd in self.sqlcmds[DB_CHANNELS_TABLE + '_version_ct']:
+            self.sql_exec(sqlcmd)
+        self.commit()
+        DBChannels.is_version_setup = True
+
+    def setup_channel_format(self, _is_restored=False):
+        """
+        Converts thumbnail_size and atsc in older databases from python
+        literals to JSON.  Restored backups are always checked since
+        they may come from an older version.
+        """
+        if not _is_restored:
+            result = self.get(DB_CHANNELS_TABLE + '_format')
+            if result and result[0][0] >= CHANNEL_FORMAT_VERSION:
+                return
+        encoded_list = []
+        for namespace, instance, uid, size_str, atsc_str in \
+                self.get(DB_CHANNELS_TABLE + '_encoded') or []:
+            is_json = True
+            if size_str is not None:
+                size, is_json = convert_literal(size_str)
+                size_str = json.dumps(size)
+            if atsc_str is not None:
+                atsc, is_atsc_json = convert_literal(atsc_str)
+                if not is_atsc_json:
+                    is_json = False
+                    atsc_str = encode_atsc(atsc)
+            if not is_json:
+                encoded_list.append((size_str, atsc_str, namespace, instance, uid))
+        if encoded_list:
+            self.logger.info('Converting {} channels to the JSON format'.format(len(encoded_list)))
+        if self.write_many([(DB_CHANNELS_TABLE + '_encoded' + SQL_UPDATE, encoded_list)]):
+            self.update(DB_CHANNELS_TABLE + '_format')
+
+    def get_channels_version(self):
+        version = self.get(DB_CHANNELS_TABLE + '_version')
+        if version:
+            return version[0][0]
+        else:
+            return None
+
+    def get_index(self):
+        """
+        Returns the channel index, rebuilding it when the channels
+        table has changed since it was built
+        """
+        index = DBChannels.channel_index
+        version = self.get_channels_version()
+        if version is None or version != index.version:
+            with index.lock:
+                if version is None or version != index.version:
+                    index.rebuild(version, self.get_channels(None, None))
+        return index
+
+    def get_indexed_channel(self, _uid, _namespace, _instance):
+        """
+        Returns the list of rows for the uid across the matching
+        namespaces and instances, in the same order as get_channels
+        """
+        return self.filter_indexed_rows(
+            self.get_index().by_uid.get(_uid), _namespace, _instance)
+
+    def get_indexed_channels_by_number(self, _display_number, _namespace, _instance):
+        return self.filter_indexed_rows(
+            self.get_index().by_number.get(_display_number), _namespace, _instance)
+
+    def get_indexed_channels_by_name(self, _display_name, _namespace, _instance):
+        return self.filter_indexed_rows(
+            self.get_index().by_name.get(_display_name), _namespace, _instance)
+
+    def filter_indexed_rows(self, _rows, _namespace, _instance):
+        """
+        Rows are copied since callers may update them
+        """
+        if not _rows:
+            return []
+        # matches the case insensitive LIKE used by get_channels
+        if _namespace:
+            _namespace = _namespace.lower()
+        if _instance:
+            _instance = _instance.lower()
+        return [dict(row) for row in _rows
+                if (not _namespace or row['namespace'].lower() == _namespace)
+                and (not _instance or row['instance'].lower() == _instance)]
 
     def save_channel_list(self, _namespace, _instance, _ch_dict, save_edit_groups=True):
         """
-        Assume the list is complete and will remove any old channels not updated
+        Assume the list is complete and will remove any old channels not updated.
+        Returns True when committed.
         """
         if _instance is None or _namespace is None:
             self.logger.warning(
                 'Saving Channel List: Namespace or Instance is None {}:{}'
                 .format(_namespace, _instance))
-        self.update(DB_CHANNELS_TABLE + '_updated', (_namespace, _instance,))
+        stored_rows = self.get(DB_CHANNELS_TABLE + '_uid', (_namespace, _instance,))
+        stored_uids = set(row[0] for row in stored_rows or [])
+        ch_uids = set()
+        upsert_list = []
         for ch in _ch_dict:
             if save_edit_groups:
                 edit_groups = ch['groups_other']
             else:
                 edit_groups = None
-            try:
-                self.add(DB_CHANNELS_TABLE, (
-                    _namespace,
-                    _instance,
-                    True,
-                    ch['id'],
-                    ch['number'],
-                    ch['number'],
-                    ch['name'],
-                    edit_groups,
-                    ch['thumbnail'],
-                    str(ch['thumbnail_size']),
-                    True,
-                    json.dumps(ch)))
-            except sqlite3.IntegrityError as ex:
-                # record already present.  Check the thumbnail and update as needed
-                ch_stored = self.get_channel(ch['id'], _namespace, _instance)
-                if ch_stored['thumbnail'] is None and ch['thumbnail'] is not None:
-                    ch_stored['thumbnail'] = ch['thumbnail']
-                    ch_stored['thumbnail_size'] = ch['thumbnail_size']
-                    self.update_channel(ch_stored)
-                self.update(DB_CHANNELS_TABLE, (
-                    ch['number'],
-                    True,
-                    json.dumps(ch),
-                    _namespace,
-                    _instance,
-                    ch['id']
-                ))
-
-            self.add(DB_STATUS_TABLE, (
-                _namespace, _instance, datetime.datetime.now()))
-        self.delete(DB_CHANNELS_TABLE, (False, _namespace, _instance,))
+            ch_uids.add(ch['id'])
+            upsert_list.append((
+                _namespace,
+                _instance,
+                True,
+                ch['id'],
+                ch['number'],
+                ch['number'],
+                ch['name'],
+                edit_groups,
+                ch['thumbnail'],
+                json.dumps(ch['thumbnail_size']),
+                True,
+                json.dumps(ch)))
+        delete_list = [(_namespace, _instance, uid) for uid in stored_uids - ch_uids]
+        is_saved = self.write_many([
+            (DB_CHANNELS_TABLE + '_upsert', upsert_list),
+            (DB_CHANNELS_TABLE + '_uid' + SQL_DELETE, delete_list),
+            (DB_STATUS_TABLE + SQL_ADD_ROW, [(_namespace, _instance, datetime.datetime.now())])])
+        if not is_saved:
+            self.logger.warning(
+                'Saving Channel List: {}:{} not saved'
+                .format(_namespace, _instance))
+        return is_saved
 
     def update_channel(self, _ch):
         """
         Updates the editable fields for one channel
         """
-        self.update(DB_CHANNELS_TABLE + '_editable', (
+        self.update(DB_CHANNELS_TABLE + '_editable', self.get_editable_values(_ch))
+
+    def update_channels_editable(self, _ch_list):
+        """
+        Updates the editable fields for a list of channels in one
+        transaction.  Returns True when committed.
+        """
+        return self.write_many([(
+            DB_CHANNELS_TABLE + '_editable' + SQL_UPDATE,
+            [self.get_editable_values(ch) for ch in _ch_list])])
+
+    def get_editable_values(self, _ch):
+        return (
             _ch['enabled'],
             _ch['display_number'],
             _ch['display_name'],
             _ch['group_tag'],
             _ch['thumbnail'],
-            str(_ch['thumbnail_size']),
+            json.dumps(_ch['thumbnail_size']),
             _ch['namespace'],
             _ch['instance'],
-            _ch['uid']
+            _ch['uid'])
+
+    def update_thumbnail_size(self, _ch):
+        """
+        Sets the thumbnail_size unless the thumbnail was changed since
+        the size was requested
+        """
+        self.update(DB_CHANNELS_TABLE + '_thumbnail_size', (
+            json.dumps(_ch['thumbnail_size']),
+            _ch['namespace'],
+            _ch['instance'],
+            _ch['uid'],
+            _ch['thumbnail']
         ))
 
     def del_channels(self, _namespace, _instance):
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-        return self.delete(DB_CHANNELS_TABLE, ('%', _namespace, _instance,))
+        sqlcmd, bindings = self.where_clause(DB_CHANNELS_TABLE + SQL_DELETE, (
+            ('namespace=? COLLATE NOCASE', _namespace),
+            ('instance=? COLLATE NOCASE', _instance)))
+        return self.delete(None, bindings, sql=sqlcmd)
 
     def del_status(self, _namespace=None, _instance=None):
         if not _namespace:
@@ -293,23 +588,19 @@ class DBChannels(DB):
             return None
 
     def get_channels(self, _namespace, _instance, _enabled=None):
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-        if _enabled is None:
-            _enabled = '%'
-
+        sqlcmd, bindings = self.where_clause(DB_CHANNELS_TABLE + SQL_GET, (
+            ('namespace=? COLLATE NOCASE', _namespace),
+            ('instance=? COLLATE NOCASE', _instance),
+            ('enabled=?', _enabled)))
         rows_dict = {}
-        rows = self.get_dict(DB_CHANNELS_TABLE, (_namespace, _instance, _enabled))
+        rows = self.get_dict(None, bindings, sql=sqlcmd)
         if rows is None:
             return None
         for row in rows:
             ch = json.loads(row['json'])
             row['json'] = ch
-            row['thumbnail_size'] = ast.literal_eval(row['thumbnail_size'])
-            if row['atsc'] is not None:
-                row['atsc'] = ast.literal_eval(row['atsc'])
+            row['thumbnail_size'] = json.loads(row['thumbnail_size'])
+            row['atsc'] = decode_atsc(row['atsc'])
             # handles the uid multiple times across instances
             if row['uid'] in rows_dict.keys():
                 rows_dict[row['uid']].append(row)
@@ -319,6 +610,26 @@ class DBChannels(DB):
 
         return rows_dict
 
+    def get_channels_by_uid(self, _namespace, _uids):
+        """
+        Returns only the channels with the uids, in the same format as get_channels
+        """
+        rows_dict = {}
+        uids = list(_uids)
+        for i in range(0, len(uids), UID_CHUNK_SIZE):
+            uid_chunk = uids[i:i + UID_CHUNK_SIZE]
+            sqlcmd = self.sqlcmds[DB_CHANNELS_TABLE + '_by_uid' + SQL_GET] \
+                .format(','.join(['?'] * len(uid_chunk)))
+            rows = self.get_dict(None, (_namespace, *uid_chunk), sql=sqlcmd)
+            if rows is None:
+                return None
+            for row in rows:
+                row['json'] = json.loads(row['json'])
+                row['thumbnail_size'] = json.loads(row['thumbnail_size'])
+                row['atsc'] = decode_atsc(row['atsc'])
+                rows_dict.setdefault(row['uid'], []).append(row)
+        return rows_dict
+
     def get_channel_names(self):
         return self.get_dict(DB_CHANNELS_TABLE + '_name')
 
@@ -326,18 +637,17 @@ class DBChannels(DB):
         return self.get_dict(DB_CHANNELS_TABLE + '_instance')
 
     def get_channel(self, _uid, _namespace, _instance):
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-
-        rows = self.get_dict(DB_CHANNELS_TABLE + '_one', (_uid, _namespace, _instance,))
+        sqlcmd, bindings = self.where_clause(
+            DB_CHANNELS_TABLE + '_one' + SQL_GET,
+            (('namespace=? COLLATE NOCASE', _namespace), ('instance=? COLLATE NOCASE', _instance)),
+            (('uid=?', _uid),))
+        rows = self.get_dict(None, bindings, sql=sqlcmd)
         if rows:
             for row in rows:
                 ch = json.loads(row['json'])
                 row['json'] = ch
-                if row['atsc'] is not None:
-                    row['atsc'] = ast.literal_eval(row['atsc'])
+                row['thumbnail_size'] = json.loads(row['thumbnail_size'])
+                row['atsc'] = decode_atsc(row['atsc'])
                 return row
         return None
 
@@ -345,8 +655,8 @@ class DBChannels(DB):
         """
         Updates the atsc field for one channel
         """
-        atsc_str = str(_ch['atsc'])
-        self.update(DB_CHANNELS_TABLE + '_atsc', (
+        atsc_str = encode_atsc(_ch['atsc'])
+        self.queue_update(DB_CHANNELS_TABLE + '_atsc', (
             atsc_str,
             _ch['namespace'],
             _ch['instance'],
@@ -395,22 +705,18 @@ class DBChannels(DB):
         Using dynamic SQl to create a SELECT statement and send to the DB
         keys are [name_of_column, direction_asc=True]
         """
-        where = ' WHERE namespace LIKE ? AND instance LIKE ? '
-        orderby_front = ' ORDER BY '
-        orderby_end = ' CAST(number as FLOAT), namespace, instance '
         orderby1 = self.get_channels_orderby(_first_sort_key[0], _first_sort_key[1])
         orderby2 = self.get_channels_orderby(_second_sort_key[0], _second_sort_key[1])
-        sqlcmd = ''.join(['SELECT * FROM channels ', where, orderby_front, orderby1, orderby2, orderby_end])
-
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-        rows = self.get_dict(None, (_namespace, _instance,), sql=sqlcmd)
+        sqlcmd, bindings = self.where_clause(DB_CHANNELS_TABLE + '_sorted' + SQL_GET, (
+            ('namespace=? COLLATE NOCASE', _namespace),
+            ('instance=? COLLATE NOCASE', _instance)))
+        orderby_end = ' CAST(number as FLOAT), namespace, instance '
+        sqlcmd = ''.join([sqlcmd, orderby1, orderby2, orderby_end])
+        rows = self.get_dict(None, bindings, sql=sqlcmd)
         for row in rows:
             ch = json.loads(row['json'])
             row['json'] = ch
-            row['thumbnail_size'] = ast.literal_eval(row['thumbnail_size'])
+            row['thumbnail_size'] = json.loads(row['thumbnail_size'])
         return rows
 
     def get_channels_orderby(self, _column, _ascending):
@@ -438,11 +744,18 @@ class DBChannels(DB):
 
     @Backup(DB_CONFIG_NAME)
     def backup(self, backup_folder):
-        self.export_sql(backup_folder)
+        self.backup_db(backup_folder)
 
     @Restore(DB_CONFIG_NAME)
     def restore(self, backup_folder):
-        msg = self.import_sql(backup_folder)
+        old_version = self.get_channels_version()
+        msg = self.restore_db(backup_folder)
+        # backups made before the channels version was added do not include it
+        self.setup_channels_version()
+        # the restored version may match the version of a process's channel index
+        version = self.get_channels_version() or 0
+        self.update(DB_CHANNELS_TABLE + '_version', (max(version, old_version or 0) + 1,))
+        self.setup_channel_format(True)
         if msg is None:
             return 'Channels Database Restored'
         else:
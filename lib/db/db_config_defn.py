@@ -57,6 +57,7 @@ sqlcmds = {
         CREATE TABLE IF NOT EXISTS config (
             key VARCHAR(255) NOT NULL,
             settings TEXT NOT NULL,
+            version INTEGER DEFAULT 0,
             PRIMARY KEY(key)
             )
         """,
@@ -137,12 +138,30 @@ sqlcmds = {
     'config_add':
         """
         INSERT OR REPLACE INTO config (
-            key, settings
-            ) VALUES ( 'main', ? )
+            key, settings, version
+            ) VALUES ( 'main', ?,
+            COALESCE((SELECT version FROM config WHERE key='main'), 0) + 1 )
         """,
     'config_get':
         """
         SELECT settings from config
+        """,
+    'config_version_get':
+        """
+        SELECT version from config WHERE key='main'
+        """,
+    'config_version_update':
+        """
+        UPDATE config SET version=? WHERE key='main'
+        """,
+    'config_columns_get':
+        """
+        PRAGMA table_info(config)
+        """,
+    # backups made before the config version was added do not include it
+    'config_version_ct':
+        """
+        ALTER TABLE config ADD COLUMN version INTEGER DEFAULT 0
         """
 
 }
@@ -241,13 +260,40 @@ class DBConfigDefn(DB):
     def get_config(self):
         return json.loads(self.get_dict(DB_CONFIG_TABLE)[0]['settings'])
 
+    def get_config_version(self):
+        """
+        Returns the version of the saved config.  The version increases
+        each time the config is saved, so processes can check it before
+        loading the full config.
+        """
+        version = self.get(DB_CONFIG_TABLE + '_version')
+        if version:
+            return version[0][0]
+        else:
+            return None
+
     @Backup(DB_CONFIG_NAME)
     def backup(self, backup_folder):
-        self.export_sql(backup_folder)
+        self.backup_db(backup_folder)
+
+    def setup_config_version(self, _old_version):
+        """
+        Adds the version column to restored configs that do not have it
+        and sets a version newer than the one before the restore, since
+        the restored version may match a version processes have loaded
+        """
+        columns = [column[1] for column in self.get(DB_CONFIG_TABLE + '_columns') or []]
+        if 'version' not in columns:
+            self.sql_exec(self.sqlcmds[DB_CONFIG_TABLE + '_version_ct'])
+            self.commit()
+        version = self.get_config_version() or 0
+        self.update(DB_CONFIG_TABLE + '_version', (max(version, _old_version or 0) + 1,))
 
     @Restore(DB_CONFIG_NAME)
     def restore(self, backup_folder):
-        msg = self.import_sql(backup_folder)
+        old_version = self.get_config_version()
+        msg = self.restore_db(backup_folder)
+        self.setup_config_version(old_version)
         if msg is None:
             return 'Config Database Restored'
         else:
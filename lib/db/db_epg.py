@@ -20,6 +20,9 @@ import json
 import datetime
 
 from lib.db.db import DB
+from lib.db.db import SQL_DELETE
+from lib.db.db import SQL_GET
+from lib.db.db import SQL_UPDATE
 from lib.common.decorators import Backup
 from lib.common.decorators import Restore
 
@@ -39,6 +42,12 @@ sqlcmds = {
             )
         """
     ],
+    'ci': [
+        """
+        CREATE INDEX IF NOT EXISTS epg_ns_inst_day ON epg (
+            namespace COLLATE NOCASE, instance COLLATE NOCASE, day)
+        """
+    ],
     'dt': [
         """
         DROP TABLE IF EXISTS epg
@@ -59,39 +68,37 @@ sqlcmds = {
 
     'epg_by_day_del':
         """
-        DELETE FROM epg WHERE namespace LIKE ? AND instance LIKE ? AND day < DATE('now',?)
+        DELETE FROM epg {}
         """,
     'epg_by_day_get':
         """
-        SELECT file FROM epg WHERE namespace LIKE ? AND instance LIKE ? AND day < DATE('now',?)
+        SELECT file FROM epg {}
         """,
 
     'epg_instance_del':
         """
-        DELETE FROM epg WHERE namespace=? AND instance LIKE ?
+        DELETE FROM epg {}
         """,
 
     'epg_instance_get':
         """
-        SELECT file FROM epg WHERE namespace=? AND instance LIKE ?
+        SELECT file FROM epg {}
         """,
 
     'epg_last_update_get':
         """
-        SELECT datetime(last_update, 'localtime') FROM epg WHERE
-            namespace=? AND instance LIKE ? and day=?
+        SELECT datetime(last_update, 'localtime') FROM epg {}
         """,
 
     'epg_last_update_update':
         """
         UPDATE epg SET 
-            last_update=? WHERE namespace LIKE ? AND instance LIKE ?
+            last_update=? {}
         """,
 
     'epg_get':
         """
-        SELECT * FROM epg WHERE
-            namespace LIKE ? AND instance LIKE ? ORDER BY day LIMIT ? OFFSET ?
+        SELECT * FROM epg {} ORDER BY day
         """,
     'epg_one_get':
         """
@@ -113,6 +120,7 @@ class DBepg(DB):
 
     def __init__(self, _config):
         super().__init__(_config, _config['datamgmt'][DB_CONFIG_NAME], sqlcmds)
+        self.epg_rows = None
 
     def get_col_names(self):
         return self.get(DB_EPG_TABLE + '_column_names')
@@ -131,43 +139,48 @@ class DBepg(DB):
         """
         Removes all records for this namespace/instance that are over 2 day old
         """
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-        files = self.get(DB_EPG_TABLE + '_by_day', (_namespace, _instance, _days,))
+        terms = (
+            ('namespace=? COLLATE NOCASE', _namespace),
+            ('instance=? COLLATE NOCASE', _instance))
+        required_terms = (("day < DATE('now',?)", _days),)
+        sqlcmd, bindings = self.where_clause(
+            DB_EPG_TABLE + '_by_day' + SQL_GET, terms, required_terms)
+        files = self.get(None, bindings, sql=sqlcmd)
         files = [x[0] for x in files]
         for f in files:
             self.delete_file(f)
-        self.delete(DB_EPG_TABLE + '_by_day', (_namespace, _instance, _days,))
+        sqlcmd, bindings = self.where_clause(
+            DB_EPG_TABLE + '_by_day' + SQL_DELETE, terms, required_terms)
+        self.delete(None, bindings, sql=sqlcmd)
 
     def del_instance(self, _namespace, _instance):
         """
         Removes all records for this namespace/instance
         """
-        if not _instance:
-            _instance = '%'
-        files = self.get(DB_EPG_TABLE + '_instance', (_namespace, _instance,))
+        terms = (('instance=? COLLATE NOCASE', _instance),)
+        required_terms = (('namespace=?', _namespace),)
+        sqlcmd, bindings = self.where_clause(
+            DB_EPG_TABLE + '_instance' + SQL_GET, terms, required_terms)
+        files = self.get(None, bindings, sql=sqlcmd)
         files = [x[0] for x in files]
         for f in files:
             self.delete_file(f)
-        return self.delete(DB_EPG_TABLE + '_instance', (_namespace, _instance,))
+        sqlcmd, bindings = self.where_clause(
+            DB_EPG_TABLE + '_instance' + SQL_DELETE, terms, required_terms)
+        return self.delete(None, bindings, sql=sqlcmd)
 
     def set_last_update(self, _namespace=None, _instance=None, _day=None):
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-        self.update(DB_EPG_TABLE + '_last_update', (
-            _day,
-            _namespace,
-            _instance,
-        ))
+        sqlcmd, bindings = self.where_clause(DB_EPG_TABLE + '_last_update' + SQL_UPDATE, (
+            ('namespace=? COLLATE NOCASE', _namespace),
+            ('instance=? COLLATE NOCASE', _instance)))
+        self.update(None, (_day,) + bindings, sql=sqlcmd)
 
     def get_last_update(self, _namespace, _instance, _day):
-        if not _instance:
-            _instance = '%'
-        result = self.get(DB_EPG_TABLE + '_last_update', (_namespace, _instance, _day,))
+        sqlcmd, bindings = self.where_clause(
+            DB_EPG_TABLE + '_last_update' + SQL_GET,
+            (('instance=? COLLATE NOCASE', _instance),),
+            (('namespace=?', _namespace), ('day=?', _day)))
+        result = self.get(None, bindings, sql=sqlcmd)
         if result is None or len(result) == 0:
             return None
         else:
@@ -193,14 +206,13 @@ class DBepg(DB):
         return []
 
     def init_get_query(self, _namespace, _instance):
-        if not _namespace:
-            _namespace = '%'
-        if not _instance:
-            _instance = '%'
-        self.get_init(DB_EPG_TABLE, (_namespace, _instance,))
+        sqlcmd, bindings = self.where_clause(DB_EPG_TABLE + SQL_GET, (
+            ('namespace=? COLLATE NOCASE', _namespace),
+            ('instance=? COLLATE NOCASE', _instance)))
+        self.epg_rows = self.get_dict_iter(None, bindings, sql=sqlcmd)
 
     def get_next_row(self):
-        row = self.get_dict_next()
+        row = next(self.epg_rows, None)
         namespace = None
         instance = None
         day = None
@@ -218,12 +230,12 @@ class DBepg(DB):
         return row, namespace, instance, day
 
     def close_query(self):
-        self.cur.close()
+        self.epg_rows.close()
 
     @Backup(DB_CONFIG_NAME)
     def backup(self, backup_folder):
-        self.export_sql(backup_folder)
+        self.backup_db(backup_folder)
 
     @Restore(DB_CONFIG_NAME)
     def restore(self, backup_folder):
-        return self.import_sql(backup_folder)
+        return self.restore_db(backup_folder)
@@ -38,6 +38,11 @@ sqlcmds = {
             )
         """
     ],
+    'ci': [
+        """
+        CREATE INDEX IF NOT EXISTS programs_ns_update ON programs (namespace, last_update)
+        """
+    ],
     'dt': [
         """
         DROP TABLE IF EXISTS programs
@@ -77,7 +82,7 @@ class DBEpgPrograms(DB):
         super().__init__(_config, _config['datamgmt'][DB_CONFIG_NAME], sqlcmds)
 
     def save_program(self, _namespace, _id, _prog_dict):
-        self.add(DB_PROGRAMS_TABLE, (
+        self.queue_add(DB_PROGRAMS_TABLE, (
             _namespace,
             _id,
             datetime.datetime.utcnow(),
@@ -103,8 +108,8 @@ class DBEpgPrograms(DB):
 
     @Backup(DB_CONFIG_NAME)
     def backup(self, backup_folder):
-        self.export_sql(backup_folder)
+        self.backup_db(backup_folder)
 
     @Restore(DB_CONFIG_NAME)
     def restore(self, backup_folder):
-        return self.import_sql(backup_folder)
+        return self.restore_db(backup_folder)
@@ -0,0 +1,185 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import sqlite3
+import uuid
+
+from lib.db.db import DB
+from lib.common.decorators import Backup
+from lib.common.decorators import Restore
+
+DB_RECORDINGS_TABLE = 'recordings'
+DB_CONFIG_NAME = 'db_files-recordings_db'
+STALE_RECORDING_GRACE = 300    # seconds after the end time a recording has to save its status
+
+sqlcmds = {
+    'ct': [
+        """
+        CREATE TABLE IF NOT EXISTS recordings (
+            id        VARCHAR(255) NOT NULL,
+            namespace VARCHAR(255) NOT NULL,
+            instance  VARCHAR(255) NOT NULL,
+            uid       VARCHAR(255) NOT NULL,
+            title     VARCHAR(255),
+            start     INTEGER NOT NULL,
+            end       INTEGER NOT NULL,
+            filename  VARCHAR(255),
+            bytes     INTEGER DEFAULT 0,
+            status    VARCHAR(255)
+                CHECK( status IN ('scheduled', 'recording', 'completed', 'failed') ) NOT NULL,
+            UNIQUE(id),
+            UNIQUE(namespace, instance, uid, start)
+            )
+        """
+    ],
+    'dt': [
+        """
+        DROP TABLE IF EXISTS recordings
+        """
+    ],
+
+    'recordings_add':
+        """
+        INSERT INTO recordings (
+            id, namespace, instance, uid, title, start, end, status
+            ) VALUES ( ?, ?, ?, ?, ?, ?, ?, 'scheduled' )
+        """,
+    'recordings_status_update':
+        """
+        UPDATE recordings SET status=?, filename=?, bytes=?
+        WHERE id=?
+        """,
+    'recordings_expired_update':
+        """
+        UPDATE recordings SET status='failed'
+        WHERE status='scheduled' AND end <= ?
+        """,
+    # left in recording status when the tuner process stopped during the recording
+    'recordings_stale_update':
+        """
+        UPDATE recordings SET status='failed'
+        WHERE status='recording' AND end <= ?
+        """,
+    'recordings_reset_update':
+        """
+        UPDATE recordings SET status='scheduled'
+        WHERE status='recording' AND end > ?
+        """,
+    'recordings_get':
+        """
+        SELECT * FROM recordings
+        WHERE status LIKE ?
+        ORDER BY start ASC
+        """,
+    'recordings_by_id_get':
+        """
+        SELECT * FROM recordings WHERE id=?
+        """,
+    'recordings_due_get':
+        """
+        SELECT * FROM recordings
+        WHERE status='scheduled' AND start <= ? AND end > ?
+        ORDER BY start ASC
+        """,
+    'recordings_del':
+        """
+        DELETE FROM recordings WHERE id=?
+        """
+}
+
+
+class DBRecordings(DB):
+
+    def __init__(self, _config):
+        super().__init__(_config, _config['datamgmt'][DB_CONFIG_NAME], sqlcmds)
+
+    def save_recording(self, _namespace, _instance, _uid, _title, _start, _end):
+        """
+        start and end are in seconds since the epoch.
+        Returns the id of the new recording or None if the same channel
+        is already scheduled to record at the same start time.
+        """
+        try:
+            id_ = str(uuid.uuid1()).upper()
+            self.add(DB_RECORDINGS_TABLE, (
+                id_,
+                _namespace,
+                _instance,
+                _uid,
+                _title,
+                int(_start),
+                int(_end),
+            ))
+            return id_
+        except sqlite3.IntegrityError:
+            return None
+
+    def update_status(self, _id, _status, _filename=None, _bytes=0):
+        self.update(DB_RECORDINGS_TABLE + '_status', (
+            _status,
+            _filename,
+            _bytes,
+            _id,
+        ))
+
+    def expire_recordings(self, _now):
+        """
+        Scheduled recordings whose end time has passed never started.
+        Recordings still in recording status well after the end time
+        were stopped by a crash or restart and did not save a status.
+        """
+        self.update(DB_RECORDINGS_TABLE + '_expired', (int(_now),))
+        self.update(DB_RECORDINGS_TABLE + '_stale', (int(_now) - STALE_RECORDING_GRACE,))
+
+    def reset_recordings(self, _now):
+        """
+        Called at startup when no recording is running, so recordings
+        interrupted by a restart are started again or marked as failed
+        """
+        self.update(DB_RECORDINGS_TABLE + '_stale', (int(_now),))
+        self.update(DB_RECORDINGS_TABLE + '_reset', (int(_now),))
+
+    def get_recordings(self, _status=None):
+        if not _status:
+            _status = '%'
+        return self.get_dict(DB_RECORDINGS_TABLE, (_status,))
+
+    def get_recording(self, _id):
+        recording = self.get_dict(DB_RECORDINGS_TABLE + '_by_id', (_id,))
+        if recording:
+            return recording[0]
+        else:
+            return None
+
+    def get_due_recordings(self, _now):
+        return self.get_dict(DB_RECORDINGS_TABLE + '_due', (int(_now), int(_now),))
+
+    def del_recording(self, _id):
+        return self.delete(DB_RECORDINGS_TABLE, (_id,))
+
+    @Backup(DB_CONFIG_NAME)
+    def backup(self, backup_folder):
+        self.backup_db(backup_folder)
+
+    @Restore(DB_CONFIG_NAME)
+    def restore(self, backup_folder):
+        msg = self.restore_db(backup_folder)
+        if msg is None:
+            return 'Recordings Database Restored'
+        else:
+            return msg
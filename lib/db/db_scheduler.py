@@ -67,6 +67,14 @@ sqlcmds = {
             )
         """
     ],
+    'ci': [
+        """
+        CREATE INDEX IF NOT EXISTS task_taskid ON task (taskid)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS trigger_area_title ON trigger (area, title)
+        """
+    ],
     'dt': [
         """
         DROP TABLE IF EXISTS trigger
@@ -143,6 +151,11 @@ sqlcmds = {
         FROM task
         WHERE taskid = ?
         """,
+    # changes when another connection commits to the database
+    'task_data_version_get':
+        """
+        PRAGMA data_version
+        """,
     'task_num_active_get':
         """
         SELECT count(*)
@@ -261,6 +274,17 @@ class DBScheduler(DB):
                 _name, _instance,
             ))
 
+    def get_data_version(self):
+        """
+        Returns a number that changes when another connection has
+        changed the database since the last call on this thread
+        """
+        result = self.get(DB_TASK_TABLE + '_data_version')
+        if result:
+            return result[0][0]
+        else:
+            return None
+
     def get_tasks_by_active(self, _active='1', _name=None):
         if not _name:
             _name = '%'
@@ -374,11 +398,11 @@ class DBScheduler(DB):
 
     @Backup(DB_CONFIG_NAME)
     def backup(self, backup_folder):
-        self.export_sql(backup_folder)
+        self.backup_db(backup_folder)
 
     @Restore(DB_CONFIG_NAME)
     def restore(self, backup_folder):
-        msg = self.import_sql(backup_folder)
+        msg = self.restore_db(backup_folder)
         if msg is None:
             msg = 'Scheduler Database Restored'
         self.reset_activity()
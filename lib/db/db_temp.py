@@ -16,8 +16,12 @@ The above copyright notice and this permission notice shall be included in all c
 substantial portions of the Software.
 """
 
+import collections
 import json
 import datetime
+import sqlite3
+import threading
+import time
 
 from lib.db.db import DB
 from lib.common.decorators import Backup
@@ -25,6 +29,9 @@ from lib.common.decorators import Restore
 
 DB_TEMP_TABLE = 'temp'
 DB_CONFIG_NAME = 'db_files-temp_db'
+CACHE_TTL = 300             # seconds a record is kept in the process cache
+CACHE_SIZE = 1000           # records kept in the process cache at most
+CACHE_VERSION_INTERVAL = 1  # seconds between checks for changes by other processes
 
 sqlcmds = {
     'ct': [
@@ -39,11 +46,60 @@ sqlcmds = {
             )
         """
     ],
+    'ci': [
+        """
+        CREATE INDEX IF NOT EXISTS temp_last_update ON temp (last_update)
+        """
+    ],
     'dt': [
         """
         DROP TABLE IF EXISTS temp
         """,
+        """
+        DROP TABLE IF EXISTS temp_version
+        """,
+    ],
+
+    # the version increases with every change to the temp table,
+    # so processes can tell when their cached records are out of date
+    'temp_version_ct': [
+        """
+        CREATE TABLE IF NOT EXISTS temp_version (
+            key     VARCHAR(255) NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY(key)
+            )
+        """,
+        """
+        INSERT OR IGNORE INTO temp_version (key, version) VALUES ('temp', 0)
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS temp_insert_version AFTER INSERT ON temp
+        BEGIN
+            UPDATE temp_version SET version=version+1 WHERE key='temp';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS temp_update_version AFTER UPDATE ON temp
+        BEGIN
+            UPDATE temp_version SET version=version+1 WHERE key='temp';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS temp_delete_version AFTER DELETE ON temp
+        BEGIN
+            UPDATE temp_version SET version=version+1 WHERE key='temp';
+        END
+        """
     ],
+    'temp_version_get':
+        """
+        SELECT version FROM temp_version WHERE key='temp'
+        """,
+    'temp_version_update':
+        """
+        UPDATE temp_version SET version=? WHERE key='temp'
+        """,
 
     'temp_add':
         """
@@ -68,21 +124,134 @@ sqlcmds = {
 }
 
 
+class TempCache:
+    """
+    Per process cache of temp records, so repeated lookups by plugins
+    do not read the database.  Records expire after CACHE_TTL and the
+    least recently used are removed above CACHE_SIZE.  Writes in this
+    process update the cache, while changes by other processes are found
+    from the temp version, checked every CACHE_VERSION_INTERVAL.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = collections.OrderedDict()  # key: (expire time, rows)
+        self.version = None
+        self.check_time = 0
+
+    def lookup(self, _key, _now):
+        with self.lock:
+            entry = self.records.get(_key)
+            if entry is None or entry[0] < _now:
+                return None
+            self.records.move_to_end(_key)
+            return entry[1]
+
+    def store(self, _key, _rows, _now):
+        with self.lock:
+            self.records[_key] = (_now + CACHE_TTL, _rows)
+            self.records.move_to_end(_key)
+            while len(self.records) > CACHE_SIZE:
+                self.records.popitem(last=False)
+
+    def set_version(self, _version, _now):
+        """
+        Clears the cache when the database has changed since the last check
+        """
+        with self.lock:
+            if _version is None or _version != self.version:
+                self.records.clear()
+            self.version = _version
+            self.check_time = _now
+
+    def write_through(self, _key, _rows, _version, _now):
+        """
+        Stores a record written by this process.  The version should be
+        one more than the cached version, otherwise another process has
+        also changed the table and the cache is cleared.
+        """
+        with self.lock:
+            if _version is None or self.version is None or _version != self.version + 1:
+                self.records.clear()
+            self.version = _version
+            self.check_time = _now
+        if _version is not None:
+            self.store(_key, _rows, _now)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.version = None
+
+
 class DBTemp(DB):
 
+    temp_cache = TempCache()
+    is_version_setup = False
+
     def __init__(self, _config):
         super().__init__(_config, _config['datamgmt'][DB_CONFIG_NAME], sqlcmds)
+        if not DBTemp.is_version_setup:
+            self.setup_temp_version()
+
+    def setup_temp_version(self):
+        """
+        Adds the temp version table and triggers to existing databases
+        """
+        for sqlcmd in self.sqlcmds[DB_TEMP_TABLE + '_version_ct']:
+            self.sql_exec(sqlcmd)
+        self.commit()
+        DBTemp.is_version_setup = True
+
+    def get_temp_version(self):
+        version = self.get(DB_TEMP_TABLE + '_version')
+        if version:
+            return version[0][0]
+        else:
+            return None
+
+    def add_record(self, _values):
+        """
+        Adds the record and returns the temp version after the change,
+        read within the same transaction, or None when the write failed
+        """
+        self.wait_writes()
+        cur = None
+        with self.write_lock:
+            try:
+                self.check_connection()
+                conn = DB.conn[self.db_name][threading.get_ident()]
+                cur = conn.cursor()
+                self.sql_exec(self.sqlcmds[DB_TEMP_TABLE + '_add'], _values, cur)
+                self.sql_exec(self.sqlcmds[DB_TEMP_TABLE + '_version_get'], None, cur)
+                version = cur.fetchone()
+                conn.commit()
+                cur.close()
+                if version:
+                    return version[0]
+                return None
+            except sqlite3.OperationalError as e:
+                self.logger.warning('{} Add request failed, {}'
+                                    .format(self.db_name, e))
+                DB.conn[self.db_name][threading.get_ident()].rollback()
+                if cur is not None:
+                    cur.close()
+        return None
 
     def save_json(self, _namespace, _instance, _value, _json):
         """
         saves the json blob under a value item for the namespace/instance
         """
-        self.add(DB_TEMP_TABLE, (
+        values = (
             _namespace,
             _instance,
             _value,
             datetime.datetime.utcnow(),
-            json.dumps(_json),))
+            json.dumps(_json),)
+        version = self.add_record(values)
+        row = dict(zip(('namespace', 'instance', 'value', 'last_update', 'json'), values))
+        DBTemp.temp_cache.write_through(
+            (_namespace, _instance, _value), [row], version, time.monotonic())
 
     def cleanup_temp(self, _namespace, _instance, _hours='-6 hours'):
         """
@@ -93,6 +262,7 @@ class DBTemp(DB):
         if not _instance:
             _instance = '%'
         deleted = self.delete(DB_TEMP_TABLE + '_by_day', (_namespace, _instance, _hours,))
+        DBTemp.temp_cache.clear()
         self.sql_exec('VACUUM')
 
     def del_instance(self, _namespace, _instance):
@@ -101,15 +271,39 @@ class DBTemp(DB):
         """
         if not _instance:
             _instance = '%'
-        return self.delete(DB_TEMP_TABLE, (_namespace, _instance,))
+        deleted = self.delete(DB_TEMP_TABLE, (_namespace, _instance,))
+        DBTemp.temp_cache.clear()
+        return deleted
 
     def get_record(self, _namespace, _instance, _value):
-        return self.get_dict(DB_TEMP_TABLE, (_namespace, _instance, _value))
+        """
+        Returns the record from the process cache when present
+        """
+        cache = DBTemp.temp_cache
+        now = time.monotonic()
+        if cache.version is None or now - cache.check_time > CACHE_VERSION_INTERVAL:
+            cache.set_version(self.get_temp_version(), now)
+        key = (_namespace, _instance, _value)
+        rows = cache.lookup(key, now)
+        if rows is None:
+            rows = self.get_dict(DB_TEMP_TABLE, key)
+            if rows is None:
+                return None
+            cache.store(key, rows, now)
+        return [dict(row) for row in rows]
 
     @Backup(DB_CONFIG_NAME)
     def backup(self, backup_folder):
-        self.export_sql(backup_folder)
+        self.backup_db(backup_folder)
 
     @Restore(DB_CONFIG_NAME)
     def restore(self, backup_folder):
-        return self.import_sql(backup_folder)
+        old_version = self.get_temp_version()
+        msg = self.restore_db(backup_folder)
+        # backups made before the temp version was added do not include it
+        self.setup_temp_version()
+        # the restored version may match the version cached by other processes
+        version = self.get_temp_version() or 0
+        self.update(DB_TEMP_TABLE + '_version', (max(version, old_version or 0) + 1,))
+        DBTemp.temp_cache.clear()
+        return msg
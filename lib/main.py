@@ -47,11 +47,15 @@ except (ImportError, ModuleNotFoundError):
 
 import lib.clients.hdhr.hdhr_server as hdhr_server
 import lib.clients.web_tuner as web_tuner
+import lib.clients.tuner_table as tuner_table
+from lib.clients.tuner_status import TunerStatusBoard, MAX_WORKERS
 import lib.clients.web_admin as web_admin
 import lib.common.utils as utils
 import lib.plugins.plugin_handler as plugin_handler
 import lib.clients.ssdp.ssdp_server as ssdp_server
 import lib.db.datamgmt.backups as backups
+import lib.db.datamgmt.optimize as optimize
+import lib.streams.recorder as recorder
 import lib.updater.updater as updater
 import lib.config.user_config as user_config
 from lib.db.db_scheduler import DBScheduler
@@ -155,8 +159,11 @@ def main(script_dir):
             pickle_it.to_pickle(plugins)
 
         backups.scheduler_tasks(config)
+        optimize.scheduler_tasks(config)
+        recorder.scheduler_tasks(config)
         terminate_queue = Queue()
         hdhr_queue = Queue()
+        TunerStatusBoard.create(config)
         sched_queue = Queue()
         webadmin = init_webadmin(config, plugins, hdhr_queue, terminate_queue, sched_queue)
         tuner = init_tuner(config, plugins, hdhr_queue, terminate_queue)
@@ -225,10 +232,27 @@ def init_tuner(_config, _plugins, _hdhr_queue, _terminate_queue):
     LOGGER.notice('Starting streaming tuner website on {}:{}'.format(
         _config['web']['plex_accessible_ip'],
         _config['web']['plex_accessible_port']))
-    tuner = Process(target=web_tuner.start, args=(_plugins, _hdhr_queue, _terminate_queue,))
-    tuner.start()
+    if not tuner_table.is_multi_worker_supported(_config):
+        tuner = Process(target=web_tuner.start, args=(_plugins, _hdhr_queue, _terminate_queue,))
+        tuner.start()
+        time.sleep(0.1)
+        return [tuner]
+
+    num_workers = _config['web']['tuner_workers']
+    if num_workers > MAX_WORKERS:
+        LOGGER.warning('tuner_workers {} is above the maximum, using {} tuner processes'
+                       .format(num_workers, MAX_WORKERS))
+        num_workers = MAX_WORKERS
+    table = tuner_table.TunerTable.create()
+    tuners = []
+    for worker_id in range(num_workers):
+        tuner = Process(target=web_tuner.start,
+                        args=(_plugins, _hdhr_queue, _terminate_queue, table, worker_id,))
+        tuner.start()
+        tuners.append(tuner)
+    LOGGER.info('Started {} tuner processes'.format(len(tuners)))
     time.sleep(0.1)
-    return tuner
+    return tuners
 
 def init_scheduler(_config, _plugins, _sched_queue):
     scheduler_tasks(_config)
@@ -282,8 +306,9 @@ def terminate_processes(_config, _hdhr_serverx, _ssdp_serverx, _webadmin, _tuner
         _webadmin.join()
         del _webadmin
     if _tuner:
-        _tuner.terminate()
-        _tuner.join()
+        for tuner in _tuner:
+            tuner.terminate()
+            tuner.join()
         del _tuner
     if _config_obj and _config_obj.defn_json:
         _config_obj.defn_json.terminate()
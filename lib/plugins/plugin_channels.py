@@ -142,11 +142,13 @@ class PluginChannels:
                     .format(self.plugin_obj.name, self.instance_key))
                 return False
             if 'channel-import_groups' in self.config_obj.data[self.config_section]:
-                self.db.save_channel_list(
+                is_saved = self.db.save_channel_list(
                     self.plugin_obj.name, self.instance_key, ch_dict,
                     self.config_obj.data[self.config_section]['channel-import_groups'])
             else:
-                self.db.save_channel_list(self.plugin_obj.name, self.instance_key, ch_dict)
+                is_saved = self.db.save_channel_list(self.plugin_obj.name, self.instance_key, ch_dict)
+            if not is_saved:
+                return False
             if self.config_obj.data[self.config_section].get('channel-start_ch_num') > -1:
                 config_callbacks.update_channel_num(self.config_obj, self.config_section, 'channel-start_ch_num')
             self.logger.debug(
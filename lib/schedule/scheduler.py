@@ -25,6 +25,7 @@ from threading import Thread
 import lib.schedule.schedule
 import lib.common.exceptions as exceptions
 from lib.common.decorators import getrequest
+from lib.db.db import DB
 from lib.db.db_scheduler import DBScheduler
 from lib.web.pages.templates import web_templates
 
@@ -172,6 +173,9 @@ class Scheduler(Thread):
             self.logger.exception('{}{}'.format(
                 'UNEXPECTED EXCEPTION on GET=', ex))
             results = False
+        # process tasks exit when done, so commit the writes they queued
+        if not DB.wait_thread_writes():
+            results = False
         if results is None:
             results = True
         end = time.time()
@@ -16,15 +16,16 @@ The above copyright notice and this permission notice shall be included in all c
 substantial portions of the Software.
 """
 
-import errno
 import subprocess
 import time
+from threading import Thread
 
+import lib.common.exceptions as exceptions
 from lib.clients.web_handler import WebHTTPHandler
 from lib.streams.video import Video
-from lib.db.db_config_defn import DBConfigDefn
 from .stream import Stream
 from .stream_queue import StreamQueue
+from .stream_fanout import StreamFanOut
 from .pts_validation import PTSValidation
 
 MAX_IDLE_TIMER = 59
@@ -46,10 +47,10 @@ class FFMpegProxy(Stream):
         self.channel_dict = None
         self.write_buffer = None
         self.stream_queue = None
+        self.fanout = None
         self.pts_validation = None
         self.tuner_no = -1
         super().__init__(_plugins, _hdhr_queue)
-        self.db_configdefn = DBConfigDefn(self.config)
         self.video = Video(self.config)
 
     def update_tuner_status(self, _status):
@@ -66,55 +67,81 @@ class FFMpegProxy(Stream):
         self.tuner_no = _tuner_no
         self.channel_dict = _channel_dict
         self.write_buffer = _write_buffer
-        self.config = self.db_configdefn.get_config()
+        self.plugins.config_obj.refresh_config_data()
+        self.config = self.plugins.config_obj.data
         MAX_IDLE_TIMER = self.config[self.namespace.lower()]['stream-g_stream_timeout']
 
+        fanout = self.get_fanout()
+        if fanout is None:
+            return
+        fanout.serve(_write_buffer)
+
+    def get_fanout(self):
+        """
+        Returns the shared stream running on the tuner or starts
+        a new ffmpeg process when this is the first client.  The fanout
+        is stored under the tuner lock before the process starts, so
+        clients arriving while it starts attach to the same fanout.
+        """
+        with Stream.tuner_lock:
+            tuner = WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no]
+            if not isinstance(tuner, dict):
+                return None
+            if tuner['mux'] and not tuner['mux'].terminate_requested:
+                self.logger.debug('Attaching to running ffmpeg stream for channel {} clients:{}'
+                                  .format(self.channel_dict['uid'], tuner['mux']))
+                return tuner['mux']
+            self.fanout = StreamFanOut(self.config['stream']['shared_stream_grace_period'])
+            tuner['mux'] = self.fanout
+
         self.pts_validation = PTSValidation(self.config, self.channel_dict)
         channel_uri = self.get_stream_uri(self.channel_dict)
         if not channel_uri:
-            self.logger.warning('Unknown Channel {}'.format(_channel_dict['uid']))
-            return
+            self.logger.warning('Unknown Channel {}'.format(self.channel_dict['uid']))
+            self.fanout.terminate()
+            return None
         self.ffmpeg_proc = self.open_ffmpeg_proc(channel_uri)
+        t_producer = Thread(target=self.run_producer, args=())
+        t_producer.daemon = True
+        t_producer.start()
+        return self.fanout
+
+    def run_producer(self):
+        """
+        Reads the ffmpeg output and sends it to all clients on the tuner
+        """
         time.sleep(0.01)
         self.last_refresh = time.time()
         self.block_prev_time = self.last_refresh
         self.buffer_prev_time = self.last_refresh
-        self.read_buffer()
-        while True:
-            if not self.video.data:
-                self.logger.info(
-                    'No Video Data, refreshing stream {} {}'
-                    .format(_channel_dict['uid'], self.ffmpeg_proc.pid))
-                self.ffmpeg_proc = self.refresh_stream()
-            else:
-                try:
+        try:
+            self.read_buffer()
+            while not self.fanout.is_idle():
+                if not self.video.data:
+                    self.logger.info(
+                        'No Video Data, refreshing stream {} {}'
+                        .format(self.channel_dict['uid'], self.ffmpeg_proc.pid))
+                    self.ffmpeg_proc = self.refresh_stream()
+                else:
                     self.validate_stream()
                     self.update_tuner_status('Streaming')
-                    start_ttw = time.time()
-                    self.write_buffer.write(self.video.data)
-                    delta_ttw = time.time() - start_ttw
+                    self.fanout.put(self.video.data)
                     self.logger.info(
-                        'Serving {} {} ({}B) ttw:{:.2f}s'
-                        .format(self.ffmpeg_proc.pid, _channel_dict['uid'],
-                                len(self.video.data), delta_ttw))
-                except IOError as e:
-                    if e.errno in [errno.EPIPE, errno.ECONNABORTED, errno.ECONNRESET, errno.ECONNREFUSED]:
-                        self.logger.info('1. Connection dropped by end device {}'.format(self.ffmpeg_proc.pid))
-                        break
-                    else:
-                        self.logger.error('{}{}'.format(
-                            '1 UNEXPECTED EXCEPTION=', e))
-                        raise
-            try:
+                        'Serving {} {} ({}B) clients:{}'
+                        .format(self.ffmpeg_proc.pid, self.channel_dict['uid'],
+                                len(self.video.data), self.fanout))
                 self.read_buffer()
-            except exceptions.CabernetException as ex:
-                self.logger.info('{} {}'.format(ex, self.ffmpeg_proc.pid))
-                break
-            except Exception as e:
-                self.logger.error('{}{}'.format(
-                    '2 UNEXPECTED EXCEPTION=', e))
-                break
+        except exceptions.CabernetException as ex:
+            self.logger.info('{} {}'.format(ex, self.ffmpeg_proc.pid))
+        except Exception as e:
+            self.logger.error('{}{}'.format(
+                '2 UNEXPECTED EXCEPTION=', e))
+        self.fanout.terminate()
         self.terminate_stream()
+        station_scans = WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no]
+        if isinstance(station_scans, dict) and station_scans['mux'] is self.fanout:
+            self.logger.notice('Provider Connection Closed, ch_id={}'.format(self.channel_dict['uid']))
+            WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no] = 'Idle'
 
     def validate_stream(self):
         if not self.config[self.config_section]['player-enable_pts_filter']:
@@ -126,9 +153,9 @@ class FFMpegProxy(Stream):
             results = self.pts_validation.check_pts(self.video.data)
             if results['byteoffset'] != 0:
                 if results['byteoffset'] < 0:
-                    self.write_buffer.write(self.video.data[-results['byteoffset']:len(self.video.data) - 1])
+                    self.fanout.put(self.video.data[-results['byteoffset']:len(self.video.data) - 1])
                 else:
-                    self.write_buffer.write(self.video.data[0:results['byteoffset']])
+                    self.fanout.put(self.video.data[0:results['byteoffset']])
                 has_changed = True
             if results['refresh_stream']:
                 self.ffmpeg_proc = self.refresh_stream()
@@ -145,6 +172,8 @@ class FFMpegProxy(Stream):
         self.video.data = None
         idle_timer = MAX_IDLE_TIMER  # time slice segments are less than 10 seconds
         while not data_found:
+            if self.fanout.is_idle():
+                raise exceptions.CabernetException('No clients remain, stopping shared stream')
             self.video.data = self.stream_queue.read()
             if self.video.data:
                 data_found = True
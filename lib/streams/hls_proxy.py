@@ -0,0 +1,235 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import collections
+import errno
+import math
+import re
+import threading
+import time
+import uuid
+from threading import Thread
+
+from lib.common.decorators import gettunerrequest
+from lib.web.pages.templates import web_templates
+from lib.clients.web_handler import WebHTTPHandler
+from .internal_proxy import InternalProxy
+from .internal_proxy import STARTUP_IDLE_COUNTER
+
+HLS_PLAYLIST_SIZE = 6       # number of segments kept in memory and listed in the playlist
+HLS_IDLE_TIMEOUT = 30       # seconds without a playlist or segment request before the stream stops
+HLS_SEGMENT_MAX_AGE = 300   # segments never change once created, so caches can hold them
+HLS_SEGMENT_PATH = re.compile(r'^/hls/(?:(\d+)-)?([0-9a-f]+)/(\d+)\.ts$')
+
+
+@gettunerrequest.route('RE:^/hls/')
+def hls_segment(_webserver):
+    m = HLS_SEGMENT_PATH.match(_webserver.content_path)
+    session = None
+    if m:
+        session = HLSProxy.get_session_by_id(m.group(2))
+        if session is None and m.group(1) is not None \
+                and HLSProxy.tuner_table is not None \
+                and int(m.group(1)) != HLSProxy.tuner_table.worker_id:
+            # segment belongs to a session in another tuner process
+            relay_port = HLSProxy.tuner_table.get_worker_port(int(m.group(1)))
+            if relay_port:
+                _webserver.relay_request(relay_port)
+                return
+    segment = None
+    if session:
+        segment = session.get_segment(int(m.group(3)))
+    if segment is None:
+        _webserver.do_mime_response(404, 'text/html', web_templates['htmlError'].format('404 - Segment Not Found'))
+        return
+    _webserver.send_response(200)
+    _webserver.send_header('Content-type', 'video/MP2T')
+    _webserver.send_header('Content-Length', str(len(segment['data'])))
+    _webserver.send_header('Cache-Control', 'public, max-age={}'.format(HLS_SEGMENT_MAX_AGE))
+    _webserver.end_headers()
+    _webserver.do_write(segment['data'])
+
+
+class HLSProxy(InternalProxy):
+    """
+    Runs the internalproxy stream for a channel in a background thread and
+    keeps the last few processed segments (decrypted, ATSC updated and PTS fixed)
+    in memory.  Clients receive a locally generated media playlist pointing at
+    these segments, so any number of players or an HTTP cache in front of
+    Cabernet share one stream.  The stream stops once no client has asked
+    for the playlist or a segment within HLS_IDLE_TIMEOUT seconds.
+    """
+
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def __init__(self, _plugins, _hdhr_queue):
+        super().__init__(_plugins, _hdhr_queue)
+        self.session_id = uuid.uuid4().hex
+        self.segments = collections.deque(maxlen=HLS_PLAYLIST_SIZE)
+        self.next_sequence = 0
+        self.last_access = time.time()
+        self.segment_ready = threading.Condition()
+        self.is_active = False
+        self.session_key = None
+
+    @classmethod
+    def gen_playlist_response(cls, _plugins, _hdhr_queue, _channel_dict, _terminate_queue):
+        """
+        Returns dict where the dict is consistent with
+        the method do_dict_response requires as an argument
+        """
+        session, resp = cls.get_session(_plugins, _hdhr_queue, _channel_dict, _terminate_queue)
+        if session is None:
+            return resp
+        session.last_access = time.time()
+        if not session.wait_for_segment():
+            return {
+                'code': 503,
+                'headers': {'Content-type': 'text/html'},
+                'text': web_templates['htmlError'].format('503 - Stream did not start')}
+        return {
+            'code': 200,
+            'headers': {'Content-type': 'application/vnd.apple.mpegurl',
+                        'Cache-Control': 'max-age={}'.format(max(1, int(session.duration / 2)))},
+            'text': session.gen_playlist()}
+
+    @classmethod
+    def get_session(cls, _plugins, _hdhr_queue, _channel_dict, _terminate_queue):
+        """
+        Returns the running session for the channel or starts a new one.
+        A new session allocates a tuner, so the tuner response is returned
+        when no tuner is available.
+        """
+        key = (_channel_dict['namespace'], _channel_dict['instance'], _channel_dict['uid'])
+        with cls.sessions_lock:
+            session = cls.sessions.get(key)
+            if session is not None and session.is_active:
+                return session, None
+            session = HLSProxy(_plugins, _hdhr_queue)
+            resp = session.gen_response(
+                _channel_dict['namespace'], _channel_dict['instance'],
+                _channel_dict['display_number'], _channel_dict['json'].get('VOD'))
+            if resp['tuner'] < 0:
+                return None, resp
+            session.session_key = key
+            session.is_active = True
+            cls.sessions[key] = session
+        t_session = Thread(target=session.run_session,
+                           args=(_channel_dict, _terminate_queue, resp['tuner'],))
+        t_session.daemon = True
+        t_session.start()
+        return session, resp
+
+    @classmethod
+    def get_session_by_id(cls, _session_id):
+        for session in list(cls.sessions.values()):
+            if session.session_id == _session_id:
+                return session
+        return None
+
+    def run_session(self, _channel_dict, _terminate_queue, _tuner_no):
+        self.logger.info('Starting HLS session {} for channel {}'
+                         .format(self.session_id, _channel_dict['uid']))
+        try:
+            self.stream(_channel_dict, None, _terminate_queue, _tuner_no)
+        except Exception as ex:
+            self.logger.exception('{}{}'.format(
+                'UNEXPECTED EXCEPTION on HLS session=', ex))
+        self.is_active = False
+        with self.segment_ready:
+            self.segments.clear()
+            self.segment_ready.notify_all()
+        with HLSProxy.sessions_lock:
+            if HLSProxy.sessions.get(self.session_key) is self:
+                del HLSProxy.sessions[self.session_key]
+        station_scans = WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no]
+        if station_scans != 'Idle' \
+                and (station_scans['mux'] is None or not station_scans['mux'].is_alive()):
+            WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no] = 'Idle'
+        self.logger.info('HLS session {} ended for channel {}'
+                         .format(self.session_id, _channel_dict['uid']))
+
+    def wait_for_segment(self):
+        """
+        Waits for the first segment when the stream is starting
+        """
+        end_time = time.time() + STARTUP_IDLE_COUNTER
+        with self.segment_ready:
+            while not self.segments and self.is_active:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    break
+                self.segment_ready.wait(remaining)
+            return len(self.segments) > 0
+
+    def gen_playlist(self):
+        with self.segment_ready:
+            segments = list(self.segments)
+        target_duration = math.ceil(max(s['duration'] for s in segments))
+        playlist = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:{}'.format(target_duration),
+            '#EXT-X-MEDIA-SEQUENCE:{}'.format(segments[0]['seq'])]
+        for segment in segments:
+            playlist.append('#EXTINF:{:.3f},'.format(segment['duration']))
+            playlist.append('/hls/{}/{}.ts'.format(self.get_path_id(), segment['seq']))
+        return '\n'.join(playlist) + '\n'
+
+    def get_path_id(self):
+        """
+        When multiple tuner processes are running, the segment path includes
+        the process id so any process can relay the segment request
+        """
+        if self.tuner_table is None:
+            return self.session_id
+        return '{}-{}'.format(self.tuner_table.worker_id, self.session_id)
+
+    def get_segment(self, _seq):
+        self.last_access = time.time()
+        with self.segment_ready:
+            for segment in self.segments:
+                if segment['seq'] == _seq:
+                    return segment
+        return None
+
+    def check_idle(self):
+        if time.time() - self.last_access > HLS_IDLE_TIMEOUT:
+            raise BrokenPipeError(errno.EPIPE, 'No HLS clients, stopping session {}'.format(self.session_id))
+
+    def write_buffer(self, _data):
+        """
+        Each call contains one processed segment from the m3u8 queue
+        """
+        self.check_idle()
+        with self.segment_ready:
+            self.segments.append({
+                'seq': self.next_sequence,
+                'duration': float(self.duration),
+                'data': _data})
+            self.next_sequence += 1
+            self.segment_ready.notify_all()
+        return len(_data)
+
+    def write_atsc_msg(self):
+        """
+        Keep-alive ATSC packets are not needed by HLS clients,
+        but are used to check whether any client remains
+        """
+        self.check_idle()
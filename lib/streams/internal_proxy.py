@@ -34,7 +34,7 @@ import lib.streams.m3u8_queue as m3u8_queue
 from lib.streams.video import Video
 from lib.streams.atsc import ATSCMsg
 from lib.streams.thread_queue import ThreadQueue
-from lib.db.db_config_defn import DBConfigDefn
+from lib.streams.thread_queue import OutQueue
 from lib.db.db_channels import DBChannels
 from lib.clients.web_handler import WebHTTPHandler
 from .stream import Stream
@@ -42,11 +42,13 @@ from .stream import Stream
 MAX_OUT_QUEUE_SIZE = 30
 IDLE_COUNTER_MAX = 110    # four times the timeout * retries to terminate the stream in seconds set in config!
 STARTUP_IDLE_COUNTER = 40 # time to wait for an initial stream
+STARTUP_ATSC_INTERVAL = 6 # seconds between ATSC msgs sent while the stream starts
+IDLE_WAIT_MAX = 5         # longest wait for a message, so shutdown and a dead m3u8 process are seen
 # code assumes a timeout response in TVH of 15 or higher.
 
 class InternalProxy(Stream):
 
-    is_m3u8_starting = 0
+    m3u8_start_lock = threading.Lock()
 
     def __init__(self, _plugins, _hdhr_queue):
         global MAX_OUT_QUEUE_SIZE
@@ -59,14 +61,13 @@ class InternalProxy(Stream):
         self.duration = 6
         self.last_ts_filename = ''
         super().__init__(_plugins, _hdhr_queue)
-        self.db_configdefn = DBConfigDefn(self.config)
-        self.db_channels = DBChannels(self.config)
+        self.db_channels = DBChannels.thread_instance(self.config)
         self.video = Video(self.config)
         self.atsc = ATSCMsg()
         self.initialized_psi = False
         self.in_queue = Queue()
         self.t_queue = None
-        self.out_queue = queue.Queue(maxsize=MAX_OUT_QUEUE_SIZE)
+        self.out_queue = OutQueue(maxsize=MAX_OUT_QUEUE_SIZE)
         self.terminate_queue = None
         self.tc_match = re.compile(r'^.+\D+(\d*)\.ts')
         self.idle_counter = 0
@@ -88,11 +89,9 @@ class InternalProxy(Stream):
         # out queue and then wait for t_m3u8, so it can clean up ffmpeg
 
         # queue is not guaranteed to have terminate, so let t_queue know this thread is ending
-        count = 10
-        while str(self.t_queue) == '0' and self.t_queue.is_alive() and count > 0:
-            time.sleep(1.0)
-            count -= 1
-        
+        if str(self.t_queue) == '0':
+            self.t_queue.join(timeout=10)
+
         if not self.t_queue.is_alive():
             self.t_m3u8.join(timeout=15)
             if self.t_m3u8.is_alive():
@@ -111,7 +110,8 @@ class InternalProxy(Stream):
         """
         global IDLE_COUNTER_MAX
         self.tuner_no = _tuner_no
-        self.config = self.db_configdefn.get_config()
+        self.plugins.config_obj.refresh_config_data()
+        self.config = self.plugins.config_obj.data
         IDLE_COUNTER_MAX = self.config[self.namespace.lower()]['stream-g_stream_timeout']
         
         self.channel_dict = _channel_dict
@@ -155,6 +155,11 @@ class InternalProxy(Stream):
         pass
 
     def play_queue(self):
+        """
+        Waits for the next message from the m3u8 process and handles it.
+        The wait ends early only when an idle check is due, so segments
+        and state changes are handled as soon as they arrive.
+        """
         global MAX_OUT_QUEUE_SIZE
         global IDLE_COUNTER_MAX
 
@@ -183,108 +188,122 @@ class InternalProxy(Stream):
             raise exceptions.CabernetException(
                 '2 Provider has stop playing the stream. Terminating the connection {}'
                 .format(self.t_m3u8_pid))
-        elif self.idle_counter > self.last_atsc_msg+6 \
+        elif self.idle_counter > self.last_atsc_msg + STARTUP_ATSC_INTERVAL \
             and self.is_starting:
                 self.last_atsc_msg = self.idle_counter
                 self.write_atsc_msg()
-        elif self.idle_counter > self.last_atsc_msg+14:
-            self.last_atsc_msg = self.idle_counter
+        try:
+            out_queue_item = self.out_queue.get(timeout=self.get_idle_timeout())
+        except queue.Empty:
+            return
+        if out_queue_item['atsc'] is not None:
+            self.channel_dict['atsc'] = out_queue_item['atsc']
+            self.db_channels.update_channel_atsc(
+                self.channel_dict)
+        uri = out_queue_item['uri']
+        if uri == 'terminate':
+            raise exceptions.CabernetException(
+                'm3u8 queue termination requested, aborting stream {} {}'
+                .format(self.t_m3u8_pid, threading.get_ident()))
+        elif uri == 'running':
+            self.logger.debug('1 Status of Running returned from m3u8_queue {}'.format(self.t_m3u8_pid))
+            return
+        elif uri == 'first_segment':
+            self.logger.debug('First segment ready from m3u8_queue {}'.format(self.t_m3u8_pid))
+            return
+        elif uri == 'stalled':
+            self.logger.debug('Stream stalled in m3u8_queue {}'.format(self.t_m3u8_pid))
             self.update_tuner_status('No Reply')
-            self.logger.debug('1 Requesting status from m3u8_queue {}'.format(self.t_m3u8_pid))
-            self.in_queue.put({'thread_id': threading.get_ident(), 'uri': 'status'})
             if not self.is_starting \
                     and self.config[self.channel_dict['namespace'].lower()] \
                     ['player-send_atsc_keepalive']:
                 self.write_atsc_msg()
-        while True:
-            try:
-                out_queue_item = self.out_queue.get(timeout=1)
-            except queue.Empty:
-                break
-            if out_queue_item['atsc'] is not None:
-                self.channel_dict['atsc'] = out_queue_item['atsc']
-                self.db_channels.update_channel_atsc(
-                    self.channel_dict)
-            uri = out_queue_item['uri']
-            if uri == 'terminate':
-                raise exceptions.CabernetException(
-                    'm3u8 queue termination requested, aborting stream {} {}'
-                    .format(self.t_m3u8_pid, threading.get_ident()))
-            elif uri == 'running':
-                self.logger.debug('1 Status of Running returned from m3u8_queue {}'.format(self.t_m3u8_pid))
-                continue
-            elif uri == 'extend':
-                self.logger.debug('Extending the idle timeout to {} seconds'.format(self.idle_counter+IDLE_COUNTER_MAX))
-                self.filter_counter = self.idle_counter
-                continue
-            data = out_queue_item['data']
-            if data['cue'] == 'in':
-                self.cue = False
-                self.logger.debug('Turning M3U8 cue to False')
-            elif data['cue'] == 'out':
-                self.cue = True
-                self.logger.debug('Turning M3U8 cue to True')
-            if data['filtered']:
-                self.last_atsc_msg = self.idle_counter
-                self.filter_counter = self.idle_counter
-                self.logger.info('Filtered Msg {} {}'.format(self.t_m3u8_pid, urllib.parse.unquote(uri)))
-                self.update_tuner_status('Filtered')
-                # self.write_buffer(out_queue_item['stream'])
-                if self.is_starting:
-                    self.is_starting = False
-                    self.write_atsc_msg()
-                    self.logger.debug('2 Requesting Status from m3u8_queue {}'.format(self.t_m3u8_pid))
-                    self.in_queue.put({'thread_id': threading.get_ident(), 'uri': 'status'})
-                time.sleep(0.5)
+            return
+        elif uri == 'extend':
+            self.logger.debug('Extending the idle timeout to {} seconds'.format(self.idle_counter+IDLE_COUNTER_MAX))
+            self.filter_counter = self.idle_counter
+            return
+        data = out_queue_item['data']
+        if data['cue'] == 'in':
+            self.cue = False
+            self.logger.debug('Turning M3U8 cue to False')
+        elif data['cue'] == 'out':
+            self.cue = True
+            self.logger.debug('Turning M3U8 cue to True')
+        if data['filtered']:
+            self.last_atsc_msg = self.idle_counter
+            self.filter_counter = self.idle_counter
+            self.logger.info('Filtered Msg {} {}'.format(self.t_m3u8_pid, urllib.parse.unquote(uri)))
+            self.update_tuner_status('Filtered')
+            # self.write_buffer(out_queue_item['stream'])
+            if self.is_starting:
+                self.is_starting = False
+                self.write_atsc_msg()
+                self.logger.debug('2 Requesting Status from m3u8_queue {}'.format(self.t_m3u8_pid))
+                self.in_queue.put({'thread_id': threading.get_ident(), 'uri': 'status'})
+            time.sleep(0.5)
+        else:
+            self.video.data = out_queue_item['stream']
+            if self.video.data is not None:
+                self.idle_counter = 0
+                self.last_atsc_msg = 0
+                self.last_reset_time = datetime.datetime.now()
+                self.filter_counter = 0
+                if self.config['stream']['update_sdt']:
+                    self.atsc.update_sdt_names(self.video,
+                                               self.channel_dict['namespace'].encode(),
+                                               self.set_service_name(self.channel_dict).encode())
+                self.duration = data['duration']
+                uri_decoded = urllib.parse.unquote(uri)
+                if self.check_ts_counter(uri_decoded):
+                    # if the length of the video is tiny, then print the string out
+                    if len(self.video.data) < 2000 and len(self.video.data) % 188 != 0  or self.video.data.startswith(b'<'):
+                        self.logger.info('{} {} Not a Video packet, restarting HTTP Session, data: {} {}'
+                            .format(self.t_m3u8_pid, uri_decoded, len(self.video.data), self.video.data))
+                        self.update_tuner_status('Bad Data')
+                        self.in_queue.put({'thread_id': threading.get_ident(), 'uri': 'restart_http'})
+                    else:
+                        start_ttw = time.time()
+                        self.write_buffer(self.video.data)
+                        delta_ttw = time.time() - start_ttw
+                        self.update_tuner_status('Streaming')
+                        self.logger.info(
+                            'Serving {} {} ({})s ({}B) ttw:{:.2f}s {}'
+                            .format(self.t_m3u8_pid, uri_decoded, self.duration,
+                                    len(self.video.data), delta_ttw, threading.get_ident()))
+                        self.is_starting = False
             else:
-                self.video.data = out_queue_item['stream']
-                if self.video.data is not None:
-                    self.idle_counter = 0
-                    self.last_atsc_msg = 0
-                    self.last_reset_time = datetime.datetime.now()
-                    self.filter_counter = 0
-                    if self.config['stream']['update_sdt']:
-                        self.atsc.update_sdt_names(self.video,
-                                                   self.channel_dict['namespace'].encode(),
-                                                   self.set_service_name(self.channel_dict).encode())
-                    self.duration = data['duration']
-                    uri_decoded = urllib.parse.unquote(uri)
-                    if self.check_ts_counter(uri_decoded):
-                        # if the length of the video is tiny, then print the string out
-                        if len(self.video.data) < 2000 and len(self.video.data) % 188 != 0  or self.video.data.startswith(b'<'):
-                            self.logger.info('{} {} Not a Video packet, restarting HTTP Session, data: {} {}'
-                                .format(self.t_m3u8_pid, uri_decoded, len(self.video.data), self.video.data))
-                            self.update_tuner_status('Bad Data')
-                            self.in_queue.put({'thread_id': threading.get_ident(), 'uri': 'restart_http'})
-                        else:
-                            start_ttw = time.time()
-                            self.write_buffer(self.video.data)
-                            delta_ttw = time.time() - start_ttw
-                            self.update_tuner_status('Streaming')
-                            self.logger.info(
-                                'Serving {} {} ({})s ({}B) ttw:{:.2f}s {}'
-                                .format(self.t_m3u8_pid, uri_decoded, self.duration,
-                                        len(self.video.data), delta_ttw, threading.get_ident()))
-                            self.is_starting = False
-                            time.sleep(0.1)
-                else:
-                    if not self.is_starting:
-                        self.update_tuner_status('No Reply')
-                    uri_decoded = urllib.parse.unquote(uri)
-                    self.logger.debug(
-                        'No Video Stream from Provider {} {}'
-                        .format(self.t_m3u8_pid, uri_decoded))
-            self.check_termination()
-            time.sleep(0.01)
+                if not self.is_starting:
+                    self.update_tuner_status('No Reply')
+                uri_decoded = urllib.parse.unquote(uri)
+                self.logger.debug(
+                    'No Video Stream from Provider {} {}'
+                    .format(self.t_m3u8_pid, uri_decoded))
         self.video.terminate()
 
+    def get_idle_timeout(self):
+        """
+        Seconds until the next idle check in play_queue is due.
+        idle_counter is in whole seconds, so a check on idle_counter > n
+        is due once n+1 seconds have passed since the last reset.
+        """
+        if self.cue:
+            return IDLE_WAIT_MAX
+        deadlines = [self.filter_counter + IDLE_COUNTER_MAX]
+        if self.is_starting:
+            deadlines.append(STARTUP_IDLE_COUNTER)
+            deadlines.append(self.last_atsc_msg + STARTUP_ATSC_INTERVAL)
+        idle_time = (datetime.datetime.now() - self.last_reset_time).total_seconds()
+        return min(max(min(deadlines) + 1 - idle_time, 0.01), IDLE_WAIT_MAX)
+
     def write_buffer(self, _data):
         """
         Plan is to slowly push out bytes until something is
         added to the queue to process.  This should stop the
         clients from terminating the data stream due to lack of data for 
         a short.  It is currently set to at least 20 seconds of data 
-        before it stops transmitting
+        before it stops transmitting.  The rest is sent as soon as
+        the next item arrives.
         """
         try:
             bytes_written = 0
@@ -308,7 +327,7 @@ class InternalProxy(Stream):
                     bytes_written = next_buffer_write
                     # x = self.wfile.write('\r\n'.encode())
                     self.wfile.flush()
-                time.sleep(1.0)
+                self.out_queue.wait_not_empty(1.0)
             if bytes_written != len(_data):
                 x = self.wfile.write(_data[bytes_written:])
                 self.wfile.flush()
@@ -387,17 +406,15 @@ class InternalProxy(Stream):
         Python sometimes starts a process where it is not connected to the parent,
         so the queues do not interact.  The process is killed and restarted
         until python can do this correctly.
+        Process is not thread safe, so only one is started at a time.
         """
+        with InternalProxy.m3u8_start_lock:
+            return self.start_m3u8_queue_process_locked()
+
+    def start_m3u8_queue_process_locked(self):
         is_running = False
-        max_tries = 40
+        startup_timeout = 8
         restarts = 5
-        while True:
-            while InternalProxy.is_m3u8_starting != 0:
-                time.sleep(0.1)
-            InternalProxy.is_m3u8_starting = threading.get_ident()
-            time.sleep(0.01)
-            if InternalProxy.is_m3u8_starting == threading.get_ident():
-                break
         ch_num = self.channel_dict['display_number']
         namespace = self.channel_dict['namespace']
         scan_list = WebHTTPHandler.rmg_station_scans[namespace]
@@ -437,36 +454,26 @@ class InternalProxy(Stream):
                 self.t_queue.remote_proc = self.t_m3u8
                 self.t_m3u8_pid = self.t_m3u8.pid
 
-                time.sleep(0.1)
-                tries = 0
-                while self.out_queue.empty() and tries < max_tries:
-                    tries += 1
-                    time.sleep(0.2)
-                if tries >= max_tries:
+                # wakes as soon as the m3u8 process replies
+                try:
+                    status = self.out_queue.get(timeout=startup_timeout)
+                except queue.Empty:
                     self.m3u8_terminate()
+                    continue
+
+                if status['uri'] == 'terminate':
+                    self.logger.debug('Receive request to terminate from m3u8_queue {}'.format(self.t_m3u8_pid))
+                    return False
+                elif status['uri'] == 'running':
+                    self.logger.debug('2 Status of Running returned from m3u8_queue {}'.format(self.t_m3u8_pid))
+                    is_running = True
                 else:
-                    try:
-                        # queue is not empty, but it sticks here anyway...
-                        status = self.out_queue.get(False, 3)
-                    except queue.Empty:
-                        self.m3u8_terminate()
-                        continue
-
-                    if status['uri'] == 'terminate':
-                        self.logger.debug('Receive request to terminate from m3u8_queue {}'.format(self.t_m3u8_pid))
-                        InternalProxy.is_m3u8_starting = False
-                        return False
-                    elif status['uri'] == 'running':
-                        self.logger.debug('2 Status of Running returned from m3u8_queue {}'.format(self.t_m3u8_pid))
-                        is_running = True
-                    else:
-                        self.logger.warning(
-                            'Unknown response from m3u8queue: {}'
-                            .format(status['uri']))
+                    self.logger.warning(
+                        'Unknown response from m3u8queue: {}'
+                        .format(status['uri']))
             else:
                 is_running = True
 
-        InternalProxy.is_m3u8_starting = False
         return restarts > 0
 
     def m3u8_terminate(self):
@@ -490,6 +497,6 @@ class InternalProxy(Stream):
         self.clear_queues()
         time.sleep(0.1)
         self.in_queue = Queue()
-        self.out_queue = queue.Queue(maxsize=MAX_OUT_QUEUE_SIZE)
+        self.out_queue = OutQueue(maxsize=MAX_OUT_QUEUE_SIZE)
         self.t_queue.add_thread(threading.get_ident(), self.out_queue)
         self.t_queue.status_queue = self.in_queue
@@ -47,6 +47,15 @@ PROCESSED_URLS = {}
 IN_QUEUE = Queue()
 OUT_QUEUE = Queue()
 TERMINATE_REQUESTED = False
+TERMINATE_EVENT = threading.Event()
+# set when a downloaded segment is ready to be sent on in order
+SEGMENT_EVENT = threading.Event()
+# messages to the internal proxy: running, first_segment, stalled, extend,
+# terminate and the segments.  Messages from it: status, restart_http, terminate
+STALL_TIMEOUT = 14  # seconds without a segment before stalled is sent, repeated while stalled
+LAST_SEGMENT_TIME = 0
+LAST_STALL_TIME = 0
+IS_FIRST_SEGMENT_SENT = False
 MAX_STREAM_QUEUE_SIZE = 20
 STREAM_QUEUE = Queue()
 OUT_QUEUE_LIST = []
@@ -82,6 +91,7 @@ class M3U8GetUriData(Thread):
         if not TERMINATE_REQUESTED:
             PROCESSED_URLS[self.uid_counter] = m3u8_data
             STREAM_QUEUE.put({'uri_dt': 'check_processed_list'})
+            SEGMENT_EVENT.set()
         self.logger.trace('M3U8GetUriData terminated COUNTER {} {} {}'.format(self.uid_counter, os.getpid(), threading.get_ident()))
         m3u8_data = None
         self.queue_item = None
@@ -222,7 +232,7 @@ class M3U8GetUriData(Thread):
                                }
             if not self.decrypt_stream(data):
                 # terminate if stream is not decryptable
-                TERMINATE_REQUESTED = True
+                set_terminate_requested()
                 M3U8Queue.pts_resync.terminate()
                 M3U8Queue.pts_resync = None
                 clear_queues()
@@ -311,7 +321,7 @@ class M3U8Queue(Thread):
                 self.q_action = queue_item['uri_dt']
                 if queue_item['uri_dt'] == 'terminate':
                     self.logger.debug('Received terminate from internalproxy {}'.format(os.getpid()))
-                    TERMINATE_REQUESTED = True
+                    set_terminate_requested()
                     
                     break
                 elif queue_item['uri_dt'] == 'status':
@@ -332,18 +342,19 @@ class M3U8Queue(Thread):
                 while UID_COUNTER - UID_PROCESSED - len(PROCESSED_URLS) > PARALLEL_DOWNLOADS+1:
                     self.logger.debug('Slowed Processing: {}  Received: {}  Processed: {}  Processed_Queue: {}  Incoming_Queue: {}'
                         .format(os.getpid(), UID_COUNTER, UID_PROCESSED, len(PROCESSED_URLS), STREAM_QUEUE.qsize()))
-                    time.sleep(.5)
+                    if SEGMENT_EVENT.wait(.5):
+                        SEGMENT_EVENT.clear()
                     self.check_processed_list()
                     if TERMINATE_REQUESTED:
                         break
                 self.process_queue = M3U8GetUriData(queue_item, UID_COUNTER, self.config)
+                UID_COUNTER += 1
                 if IS_VOD:
-                    time.sleep(0.1)
+                    self.wait_for_segments(0.1)
                 else:
-                    time.sleep(1.0)
-                UID_COUNTER += 1
+                    self.wait_for_segments(1.0)
         except (KeyboardInterrupt, EOFError) as ex:
-            TERMINATE_REQUESTED = True
+            set_terminate_requested()
             clear_queues()
             if self.pts_resync is not None:
                 self.pts_resync.terminate()
@@ -351,7 +362,7 @@ class M3U8Queue(Thread):
             time.sleep(0.01)
             sys.exit()
         except Exception as ex:
-            TERMINATE_REQUESTED = True
+            set_terminate_requested()
             STREAM_QUEUE.put({'uri_dt': 'terminate'})
             IN_QUEUE.put({'uri': 'terminate'})
             if self.pts_resync is not None:
@@ -373,25 +384,52 @@ class M3U8Queue(Thread):
                        'atsc': None})
         PROCESSED_URLS.clear()
         time.sleep(0.01)
-        TERMINATE_REQUESTED = True
+        set_terminate_requested()
         self.logger.debug('M3U8Queue terminated {}'.format(os.getpid()))
 
 
+    def wait_for_segments(self, _time):
+        """
+        Paces the downloads by waiting for the time to pass.  Segments
+        that finish downloading meanwhile are sent on right away.
+        """
+        end_time = time.monotonic() + _time
+        while not TERMINATE_REQUESTED:
+            timeout = end_time - time.monotonic()
+            if timeout <= 0:
+                break
+            if SEGMENT_EVENT.wait(timeout):
+                SEGMENT_EVENT.clear()
+                self.check_processed_list()
+
     def check_processed_list(self):
+        """
+        Sends on the downloaded segments that are next in order
+        """
         global UID_PROCESSED
         global PROCESSED_URLS
-        if len(PROCESSED_URLS) > 0:
-            first_key = sorted(PROCESSED_URLS.keys())[0]
-            if first_key == UID_PROCESSED:
-                self.video.data = PROCESSED_URLS[first_key]['stream']
-                M3U8Queue.pts_resync.resequence_pts(self.video)
-                if self.video.data is None and self.q_action != 'check_processed_list':
-                    PLAY_LIST[self.q_action]['played'] = True
-                PROCESSED_URLS[first_key]['stream'] = self.video.data
-                
-                out_queue_put(PROCESSED_URLS[first_key])
-                del PROCESSED_URLS[first_key]
-                UID_PROCESSED += 1
+        global LAST_SEGMENT_TIME
+        global IS_FIRST_SEGMENT_SENT
+        while UID_PROCESSED in PROCESSED_URLS:
+            m3u8_data = PROCESSED_URLS.pop(UID_PROCESSED)
+            UID_PROCESSED += 1
+            if m3u8_data is None:
+                # segment was dropped from the playlist before it was processed
+                continue
+            self.video.data = m3u8_data['stream']
+            M3U8Queue.pts_resync.resequence_pts(self.video)
+            if self.video.data is None and self.q_action != 'check_processed_list':
+                PLAY_LIST[self.q_action]['played'] = True
+            m3u8_data['stream'] = self.video.data
+            if self.video.data is not None:
+                LAST_SEGMENT_TIME = time.monotonic()
+                if not IS_FIRST_SEGMENT_SENT:
+                    IS_FIRST_SEGMENT_SENT = True
+                    out_queue_put({'uri': 'first_segment',
+                                   'data': None,
+                                   'stream': None,
+                                   'atsc': None})
+            out_queue_put(m3u8_data)
 
 
 class M3U8Process(Thread):
@@ -431,7 +469,6 @@ class M3U8Process(Thread):
         self.is_running = True
         self.duration = 6
         self.m3u8_q = M3U8Queue(_config, _channel_dict)
-        time.sleep(0.1)
         self.file_filter = None
         self.start()
 
@@ -451,7 +488,7 @@ class M3U8Process(Thread):
             time.sleep(0.01)
             self.terminate()
             self.m3u8_q.join()
-            TERMINATE_REQUESTED = True
+            set_terminate_requested()
             self.logger.debug('1 M3U8Process terminated {}'.format(os.getpid()))
             return
         else:
@@ -504,18 +541,14 @@ class M3U8Process(Thread):
         self.terminate()
         # wait for m3u8_q to finish so it can cleanup ffmpeg
         self.m3u8_q.join()
-        TERMINATE_REQUESTED = True
+        set_terminate_requested()
         self.logger.debug('M3U8Process terminated {}'.format(os.getpid()))
 
     def sleep(self, _time):
-        global TERMINATE_REQUESTED
-        start_ttw = time.time()
-        for i in range(round(_time * 5)):
-            if not TERMINATE_REQUESTED:
-                time.sleep(self.duration * 0.2)
-            delta_ttw = time.time() - start_ttw
-            if delta_ttw > _time:
-                break
+        """
+        Sleeps until the time has passed or termination is requested
+        """
+        TERMINATE_EVENT.wait(_time)
 
     def terminate(self):
         global STREAM_QUEUE
@@ -737,6 +770,36 @@ def clear_queues():
     clear_q(STREAM_QUEUE)
     clear_q(IN_QUEUE)
 
+def set_terminate_requested():
+    """
+    Sets the termination flag and wakes any thread waiting on the
+    termination event, so the stop is not delayed by sleeps
+    """
+    global TERMINATE_REQUESTED
+    TERMINATE_REQUESTED = True
+    TERMINATE_EVENT.set()
+    SEGMENT_EVENT.set()
+
+
+def check_stalled():
+    """
+    Sends stalled to the internal proxy when no segment has been sent
+    for STALL_TIMEOUT seconds, and again every STALL_TIMEOUT while the
+    stream stays stalled.  Returns the seconds until the next check.
+    """
+    global LAST_STALL_TIME
+    now = time.monotonic()
+    last_activity = max(LAST_SEGMENT_TIME, LAST_STALL_TIME)
+    if now - last_activity < STALL_TIMEOUT:
+        return STALL_TIMEOUT - (now - last_activity)
+    LAST_STALL_TIME = now
+    out_queue_put({'uri': 'stalled',
+                   'data': None,
+                   'stream': None,
+                   'atsc': None})
+    return STALL_TIMEOUT
+
+
 def out_queue_put(data_dict):
     global OUT_QUEUE
     logger = logging.getLogger(__name__)
@@ -754,6 +817,7 @@ def start(_config, _plugins, _m3u8_queue, _data_queue, _channel_dict, extra=None
     global STREAM_QUEUE
     global OUT_QUEUE
     global TERMINATE_REQUESTED
+    global LAST_SEGMENT_TIME
     logger = None
     try:
         utils.logging_setup(_plugins.config_obj.data)
@@ -762,14 +826,19 @@ def start(_config, _plugins, _m3u8_queue, _data_queue, _channel_dict, extra=None
         IN_QUEUE = _m3u8_queue
         STREAM_QUEUE = Queue(maxsize=MAX_STREAM_QUEUE_SIZE)
         OUT_QUEUE = _data_queue
+        LAST_SEGMENT_TIME = time.monotonic()
         p_m3u8 = M3U8Process(_config, _plugins, _channel_dict)
         while not TERMINATE_REQUESTED:
             try:
-                q_item = IN_QUEUE.get()
+                # wakes on a request from the internal proxy or when the stream stalls
+                try:
+                    q_item = IN_QUEUE.get(timeout=check_stalled())
+                except Empty:
+                    continue
                 if q_item['uri'] == 'terminate':
                     OUT_QUEUE_LIST.remove(q_item['thread_id'])
                     if not len(OUT_QUEUE_LIST):
-                        TERMINATE_REQUESTED = True
+                        set_terminate_requested()
                         clear_queues()
                     else:
                         clear_q(OUT_QUEUE)
@@ -803,7 +872,7 @@ def start(_config, _plugins, _m3u8_queue, _data_queue, _channel_dict, extra=None
                 else:
                     logger.debug('UNKNOWN m3u8 queue request {}'.format(q_item['uri']))
             except (KeyboardInterrupt, EOFError, TypeError, ValueError) as ex:
-                TERMINATE_REQUESTED = True
+                set_terminate_requested()
                 try:
                     clear_queues()
                     out_queue_put({
@@ -824,10 +893,10 @@ def start(_config, _plugins, _m3u8_queue, _data_queue, _channel_dict, extra=None
     except Exception as ex:
         logger.exception('{}'.format(
             'UNEXPECTED EXCEPTION startup'))
-        TERMINATE_REQUESTED = True
+        set_terminate_requested()
         logger.debug('3 m3u8_queue process terminated {}'.format(os.getpid()))
         sys.exit()
     except KeyboardInterrupt as ex:
-        TERMINATE_REQUESTED = True
+        set_terminate_requested()
         logger.debug('2 m3u8_queue process terminated {}'.format(os.getpid()))
         sys.exit()
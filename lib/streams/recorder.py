@@ -0,0 +1,237 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import datetime
+import json
+import logging
+import pathlib
+import re
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import lib.common.exceptions as exceptions
+from lib.common.decorators import getrequest
+from lib.db.db_recordings import DBRecordings
+from lib.db.db_scheduler import DBScheduler
+from lib.web.pages.templates import web_templates
+from lib.clients.web_handler import WebHTTPHandler
+from .internal_proxy import InternalProxy
+
+RECORD_BUFFER_SIZE = 4194304   # segments are written to disk in large sequential writes
+RECORD_START_LEAD = 90         # seconds before the EPG start time to begin recording, more
+                               # than the one minute task interval so the start is not missed
+RECORD_FILE_EXT = '.ts'
+
+
+@getrequest.route('/api/recordings')
+def get_recordings(_webserver):
+    recordings_db = DBRecordings(_webserver.config)
+    action = _webserver.query_data.get('action')
+    try:
+        if action == 'add':
+            start = parse_time(_webserver.query_data['start'])
+            end = parse_time(_webserver.query_data['end'])
+            if start is None or end is None or end <= start:
+                _webserver.do_mime_response(
+                    400, 'text/html',
+                    web_templates['htmlError'].format('400 - Invalid start or end time'))
+                return
+            title = _webserver.query_data.get('title')
+            if title:
+                title = urllib.parse.unquote_plus(title)
+            rec_id = recordings_db.save_recording(
+                _webserver.query_data['name'], _webserver.query_data['instance'],
+                urllib.parse.unquote(_webserver.query_data['uid']), title, start, end)
+            if rec_id is None:
+                _webserver.do_mime_response(
+                    409, 'text/html',
+                    web_templates['htmlError'].format('409 - Recording already scheduled'))
+                return
+            _webserver.do_mime_response(200, 'application/json', json.dumps({'id': rec_id}))
+        elif action == 'delete':
+            recordings_db.del_recording(_webserver.query_data['id'])
+            _webserver.do_mime_response(200, 'text/html', 'action executed: ' + action)
+        else:
+            _webserver.do_mime_response(
+                200, 'application/json',
+                json.dumps(recordings_db.get_recordings(_webserver.query_data.get('status'))))
+    except KeyError:
+        _webserver.do_mime_response(
+            501, 'text/html',
+            web_templates['htmlError'].format('501 - Badly formed request'))
+
+
+def parse_time(_time_str):
+    """
+    Accepts either seconds since the epoch or the XMLTV time
+    format used by the EPG, ex: 20230101203000 +0000
+    Returns seconds since the epoch or None
+    """
+    if not _time_str:
+        return None
+    time_str = urllib.parse.unquote(_time_str).strip()
+    if time_str.isdigit() and len(time_str) != 14:
+        return int(time_str)
+    for fmt in ['%Y%m%d%H%M%S %z', '%Y%m%d%H%M%S%z', '%Y%m%d%H%M%S']:
+        try:
+            dt = datetime.datetime.strptime(time_str, fmt)
+            if dt.tzinfo is None:
+                dt = dt.astimezone()
+            return int(dt.timestamp())
+        except ValueError:
+            pass
+    return None
+
+
+def scheduler_tasks(config):
+    # runs at startup before the tuner processes, so no recording is active
+    DBRecordings(config).reset_recordings(time.time())
+    scheduler_db = DBScheduler(config)
+    if scheduler_db.save_task(
+            'Applications',
+            'Recordings',
+            'internal',
+            None,
+            'lib.streams.recorder.start_recordings',
+            20,
+            'thread',
+            'Starts scheduled recordings on the tuner'
+    ):
+        scheduler_db.save_trigger(
+            'Applications',
+            'Recordings',
+            'interval',
+            interval=1
+        )
+
+
+def start_recordings(_plugins):
+    scheduler = RecordingScheduler(_plugins.config_obj.data)
+    scheduler.start_due_recordings()
+    return True
+
+
+class RecordingScheduler:
+    """
+    Runs in the scheduler and asks the tuner process to start any
+    recording that is due.  The recording runs within the tuner process,
+    so it can share the stream of a channel already being watched.
+    """
+
+    def __init__(self, _config):
+        self.logger = logging.getLogger(__name__)
+        self.config = _config
+        self.recordings_db = DBRecordings(_config)
+
+    def start_due_recordings(self):
+        now = time.time()
+        self.recordings_db.expire_recordings(now)
+        for recording in self.recordings_db.get_due_recordings(now + RECORD_START_LEAD):
+            self.request_recording(recording)
+
+    def request_recording(self, _recording):
+        host = self.config['web']['bind_ip']
+        if host in ['', '0.0.0.0']:
+            host = '127.0.0.1'
+        url = 'http://{}:{}/record/{}?name={}&instance={}&id={}'.format(
+            host, self.config['web']['plex_accessible_port'],
+            urllib.parse.quote(_recording['uid']),
+            urllib.parse.quote(_recording['namespace']),
+            urllib.parse.quote(_recording['instance']),
+            _recording['id'])
+        try:
+            with urllib.request.urlopen(url, timeout=30) as resp:
+                resp.read()
+            return True
+        except urllib.error.HTTPError as ex:
+            # tuners may be busy, retry on the next interval until the end time
+            self.logger.warning('Tuner did not start recording {} ch:{} {}'
+                                .format(_recording['id'], _recording['uid'], ex))
+        except OSError as ex:
+            self.logger.warning('Unable to reach tuner to start recording {} {}'
+                                .format(_recording['id'], ex))
+        return False
+
+
+class RecordingProxy(InternalProxy):
+    """
+    Passive consumer of the internalproxy stream.  When the channel is
+    already streaming, the recording attaches to the existing m3u8 process
+    through the tuner ThreadQueue, so no additional provider session or tuner
+    is used.  Each segment is written to disk in a single write.
+    """
+
+    def __init__(self, _plugins, _hdhr_queue, _end_time):
+        super().__init__(_plugins, _hdhr_queue)
+        self.end_time = _end_time
+        self.bytes_written = 0
+
+    @staticmethod
+    def gen_filename(_config, _channel_dict, _title):
+        name = _title if _title else _channel_dict['display_name']
+        name = re.sub(r'[^\w\-. ]', '_', name).strip()
+        filename = '{}_{}{}'.format(
+            name, datetime.datetime.now().strftime('%Y%m%d_%H%M'), RECORD_FILE_EXT)
+        return pathlib.Path(_config['paths']['recordings_dir'], filename)
+
+    def record(self, _rec_id, _channel_dict, _filename, _terminate_queue, _tuner_no):
+        """
+        Records the channel until the end time, then releases the tuner
+        if no other client is using it.  The final recording status is
+        updated in the database.
+        """
+        recordings_db = DBRecordings(self.config)
+        self.logger.notice('{}:{} Recording channel {} to {}'
+                           .format(self.namespace, self.instance, _channel_dict['uid'], _filename))
+        try:
+            with open(_filename, 'ab', buffering=RECORD_BUFFER_SIZE) as rec_file:
+                self.stream(_channel_dict, rec_file, _terminate_queue, _tuner_no)
+        except Exception as ex:
+            self.logger.exception('{}{}'.format(
+                'UNEXPECTED EXCEPTION on recording=', ex))
+        station_scans = WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no]
+        if station_scans != 'Idle' \
+                and (station_scans['mux'] is None or not station_scans['mux'].is_alive()):
+            WebHTTPHandler.rmg_station_scans[self.namespace][self.tuner_no] = 'Idle'
+        self.logger.notice('{}:{} Recording ended for channel {}, {} bytes written'
+                           .format(self.namespace, self.instance, _channel_dict['uid'], self.bytes_written))
+        if self.bytes_written:
+            status = 'completed'
+        else:
+            status = 'failed'
+        recordings_db.update_status(_rec_id, status, str(_filename), self.bytes_written)
+
+    def check_termination(self):
+        super().check_termination()
+        if time.time() >= self.end_time:
+            raise exceptions.CabernetException('Recording complete')
+
+    def write_buffer(self, _data):
+        """
+        No need to trickle data out to a client, write the whole segment
+        """
+        self.bytes_written += len(_data)
+        return self.wfile.write(_data)
+
+    def write_atsc_msg(self):
+        """
+        Keep-alive ATSC packets are only for live clients
+        """
+        pass
@@ -17,6 +17,7 @@ substantial portions of the Software.
 """
 
 import logging
+import threading
 
 from lib.web.pages.templates import web_templates
 from lib.clients.web_handler import WebHTTPHandler
@@ -25,6 +26,10 @@ import lib.common.utils as utils
 
 class Stream:
     logger = None
+    tuner_lock = threading.Lock()
+    # shared with the other tuner processes when more than one is running
+    tuner_table = None
+    status_board = None
 
     def __init__(self, _plugins, _hdhr_queue):
         self.plugins = _plugins
@@ -42,24 +47,38 @@ class Stream:
                  'channel': _channel, 'status': _status})
 
     def find_tuner(self, _namespace, _instance, _ch_num, _isvod):
+        # requests are handled concurrently, so only one may allocate a tuner at a time
+        with Stream.tuner_lock:
+            if Stream.tuner_table is None:
+                return self.find_tuner_locked(_namespace, _instance, _ch_num, _isvod)
+            # tuners used by other tuner worker processes are not available
+            with Stream.tuner_table.lock:
+                snapshot = Stream.tuner_table.sync(WebHTTPHandler.rmg_station_scans)
+                found = self.find_tuner_locked(
+                    _namespace, _instance, _ch_num, _isvod,
+                    Stream.tuner_table.get_busy_tuners(_namespace, snapshot))
+                Stream.tuner_table.sync(WebHTTPHandler.rmg_station_scans, snapshot)
+                return found
+
+    def find_tuner_locked(self, _namespace, _instance, _ch_num, _isvod, _busy_tuners=()):
         # keep track of how many tuners we can use at a time
         found = -1
         scan_list = WebHTTPHandler.rmg_station_scans[_namespace]
         for index, scan_status in enumerate(scan_list):
             # the first idle tuner gets it
-            if scan_status == 'Idle' and found == -1:
+            if scan_status == 'Idle' and found == -1 \
+                    and index not in _busy_tuners:
                 found = index
             elif isinstance(scan_status, dict):
                 if scan_status['instance'] == _instance \
                         and scan_status['ch'] == _ch_num \
                         and not _isvod \
-                        and scan_status['mux'] \
-                        and not scan_status['mux'].terminate_requested:
+                        and Stream.is_shareable(scan_status):
                     found = index
                     break
         if found == -1:
             return found
-        if WebHTTPHandler.rmg_station_scans[_namespace][index] != 'Idle':
+        if WebHTTPHandler.rmg_station_scans[_namespace][found] != 'Idle':
             self.logger.debug('Reusing tuner {} {}:{} ch:{}'.format(found, _namespace, _instance, _ch_num))
         else:
             self.logger.debug('Adding new tuner {} for stream {}:{} ch:{}'.format(found, _namespace, _instance, _ch_num))
@@ -68,9 +87,22 @@ class Stream:
                 'ch': _ch_num,
                 'mux': None,
                 'status': 'Starting'}
-            self.put_hdhr_queue(_namespace, index, _ch_num, 'Stream')
+            self.put_hdhr_queue(_namespace, found, _ch_num, 'Stream')
+            if Stream.status_board is not None:
+                Stream.status_board.request_publish()
         return found
 
+    @staticmethod
+    def is_shareable(_scan_status):
+        """
+        A tuner still starting has no mux yet.  It is shared as well, the
+        first request to start the stream creates the mux under a lock
+        and the other requests attach to it.
+        """
+        if _scan_status['mux'] is None:
+            return _scan_status['status'] == 'Starting'
+        return not _scan_status['mux'].terminate_requested
+
     def set_service_name(self, _channel_dict):
         updated_chnum = utils.wrap_chnum(
             str(_channel_dict['display_number']), _channel_dict['namespace'],
@@ -0,0 +1,130 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import errno
+import logging
+import queue
+import threading
+import time
+
+MAX_CLIENT_QUEUE_SIZE = 60
+
+
+class StreamFanOut:
+    """
+    Shares the output of one ffmpeg or streamlink process with every
+    client watching the same channel on a tuner.  Stored as the tuner 'mux',
+    so later requests for the channel reuse the tuner and attach here.
+    The producer stops once no client has been attached for the grace period.
+    """
+
+    def __init__(self, _grace_period):
+        self.logger = logging.getLogger(__name__)
+        # allow the first client time to attach once the process starts
+        self.grace_period = max(_grace_period, 1)
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.terminate_requested = False
+        self.last_client_time = time.time()
+
+    def __str__(self):
+        """
+        Used to display the number of clients attached
+        """
+        return str(len(self.clients))
+
+    def is_alive(self):
+        return not self.terminate_requested
+
+    def add_client(self, _thread_id):
+        with self.lock:
+            if self.terminate_requested:
+                return None
+            client_queue = queue.Queue(maxsize=MAX_CLIENT_QUEUE_SIZE)
+            self.clients[_thread_id] = client_queue
+        self.logger.debug('Adding client to shared stream: {} clients:{}'.format(_thread_id, self))
+        return client_queue
+
+    def del_client(self, _thread_id):
+        with self.lock:
+            if self.clients.pop(_thread_id, None) is not None:
+                self.last_client_time = time.time()
+        self.logger.debug('Removing client from shared stream: {} clients:{}'.format(_thread_id, self))
+
+    def is_idle(self):
+        """
+        True when no client has been attached for the grace period
+        """
+        with self.lock:
+            return not self.clients \
+                and time.time() - self.last_client_time > self.grace_period
+
+    def put(self, _data):
+        """
+        Sends the data to every client.  A client that is not keeping up
+        loses its oldest data instead of stalling the other clients.
+        """
+        with self.lock:
+            client_queues = list(self.clients.values())
+        for client_queue in client_queues:
+            try:
+                client_queue.put_nowait(_data)
+            except queue.Full:
+                try:
+                    client_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                client_queue.put_nowait(_data)
+
+    def terminate(self):
+        with self.lock:
+            self.terminate_requested = True
+            client_queues = list(self.clients.values())
+        for client_queue in client_queues:
+            try:
+                client_queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def serve(self, _write_buffer):
+        """
+        Writes the shared stream to the client until the client
+        drops the connection or the stream ends
+        """
+        thread_id = threading.get_ident()
+        client_queue = self.add_client(thread_id)
+        if client_queue is None:
+            return
+        try:
+            while not self.terminate_requested:
+                try:
+                    data = client_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if data is None:
+                    break
+                _write_buffer.write(data)
+        except IOError as ex:
+            if ex.errno in [errno.EPIPE, errno.ECONNABORTED, errno.ECONNRESET, errno.ECONNREFUSED]:
+                self.logger.info('Connection dropped by end device {}'.format(thread_id))
+            else:
+                self.logger.error('{}{}'.format(
+                    'UNEXPECTED EXCEPTION=', ex))
+                raise
+        finally:
+            self.del_client(thread_id)
@@ -17,6 +17,7 @@ substantial portions of the Software.
 """
 
 import logging
+import queue
 import threading
 import time
 from queue import Empty
@@ -25,6 +26,23 @@ from multiprocessing import Queue, Process
 from threading import Thread
 
 
+class OutQueue(queue.Queue):
+    """
+    Outgoing queue for one thread.  A reader can pace its output with
+    wait_not_empty and still wake as soon as an item is added.
+    """
+
+    def wait_not_empty(self, _timeout):
+        """
+        Waits up to _timeout seconds for an item.  Returns True when
+        the queue has an item.
+        """
+        with self.not_empty:
+            if not self._qsize():
+                self.not_empty.wait(_timeout)
+            return self._qsize() > 0
+
+
 class ThreadQueue(Thread):
     """
     Takes a queue containing thread ids and pushes them 
@@ -157,10 +175,8 @@ class ThreadQueue(Thread):
             return True
 
     def wait_for_termination(self):
-        count = 50
-        while self.is_alive() and count > 0:
-            time.sleep(0.1)
-            count -= 1
+        if self is not threading.current_thread():
+            self.join(timeout=5)
         self.clear_queues()
 
     def sleep(self, _time):
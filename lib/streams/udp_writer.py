@@ -0,0 +1,224 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import errno
+import ipaddress
+import logging
+import select
+import socket
+import struct
+import time
+import urllib.parse
+
+TS_PACKET_SIZE = 188
+TS_PACKETS_PER_DATAGRAM = 7
+DATAGRAM_SIZE = TS_PACKET_SIZE * TS_PACKETS_PER_DATAGRAM
+RTP_VERSION = 0x80
+RTP_PAYLOAD_MP2T = 33
+RTP_CLOCK_RATE = 90000
+SEND_BUFFER_SIZE = 1048576
+PCR_WRAP = 1 << 33          # PCR base is a 33 bit counter of the 90kHz clock
+PACE_PRELOAD = 1.0          # seconds of stream sent ahead of the PCR clock
+PACE_MAX_DRIFT = 5.0        # seconds off the PCR clock before it is reset
+
+
+def parse_target(_target):
+    """
+    Converts a HDHR target string into a (protocol, ip, port) tuple.
+    Supported formats are rtp://ip:port and udp://ip:port
+    Returns None when the target is not valid or is set to none.
+    """
+    if not _target:
+        return None
+    target = urllib.parse.unquote(_target).strip()
+    if target.lower() == 'none':
+        return None
+    url = urllib.parse.urlparse(target)
+    if url.scheme.lower() not in ['rtp', 'udp']:
+        return None
+    try:
+        ipaddress.IPv4Address(url.hostname)
+        port = url.port
+    except (ipaddress.AddressValueError, ValueError):
+        return None
+    if not port:
+        return None
+    return url.scheme.lower(), url.hostname, port
+
+
+def get_pcr(_datagram):
+    """
+    Returns the PCR base (90kHz) of the first TS packet in the datagram
+    carrying one, or None
+    """
+    for i in range(0, len(_datagram) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if _datagram[i] != 0x47 or not _datagram[i + 3] & 0x20:
+            continue
+        if _datagram[i + 4] >= 7 and _datagram[i + 5] & 0x10:
+            pcr_bytes = _datagram[i + 6:i + 11]
+            return int.from_bytes(pcr_bytes, 'big') >> 7
+    return None
+
+
+def pcr_diff(_pcr, _prev_pcr):
+    """
+    Signed difference in ticks between two PCR values, allowing for wrap
+    """
+    diff = (_pcr - _prev_pcr) % PCR_WRAP
+    if diff >= PCR_WRAP // 2:
+        diff -= PCR_WRAP
+    return diff
+
+
+class UDPWriter:
+    """
+    File-like object used in place of the HTTP wfile for stream output.
+    Packages the transport stream into datagrams of 7 TS packets and
+    sends them to a unicast or multicast target, optionally wrapped
+    in an RTP header.  The HTTP connection that requested the target is
+    used as the control channel; once the requestor closes it, the next
+    write raises a broken pipe so the stream terminates like any other client.
+    Datagrams are paced against the PCR in the stream, since a receiver
+    cannot push back on UDP the way an HTTP client does, and the RTP
+    timestamp is taken from the same clock.
+    """
+
+    def __init__(self, _target, _control_socket=None, _ttl=1):
+        self.logger = logging.getLogger(__name__)
+        self.protocol, self.ip, self.port = parse_target(_target)
+        self.control_socket = _control_socket
+        self.sequence = 0
+        self.ssrc = int(time.time()) & 0xFFFFFFFF
+        self.remainder = b''
+        self.bytes_sent = 0
+        # pacing clock, PCR base and monotonic time it was last reset
+        self.clock_pcr = None
+        self.clock_time = 0
+        # last PCR seen and the bytes sent since, to interpolate timestamps
+        self.last_pcr = None
+        self.bytes_since_pcr = 0
+        self.ticks_per_byte = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+        except OSError:
+            pass
+        if ipaddress.IPv4Address(self.ip).is_multicast:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, _ttl)
+        self.logger.info('Sending stream to {}://{}:{}'.format(self.protocol, self.ip, self.port))
+
+    def __str__(self):
+        return '{}://{}:{}'.format(self.protocol, self.ip, self.port)
+
+    def write(self, _data):
+        self.check_control()
+        if not _data:
+            return 0
+        data = self.remainder + _data
+        end = len(data) - len(data) % DATAGRAM_SIZE
+        for i in range(0, end, DATAGRAM_SIZE):
+            self.send_datagram(data[i:i + DATAGRAM_SIZE])
+        self.remainder = data[end:]
+        return len(_data)
+
+    def flush(self):
+        """
+        Sends any partial datagram containing whole TS packets
+        """
+        whole_pkts = len(self.remainder) - len(self.remainder) % TS_PACKET_SIZE
+        if whole_pkts:
+            self.send_datagram(self.remainder[:whole_pkts])
+            self.remainder = self.remainder[whole_pkts:]
+
+    def send_datagram(self, _payload):
+        pcr = get_pcr(_payload)
+        if pcr is not None:
+            self.update_clock(pcr)
+            self.pace(pcr)
+        if self.protocol == 'rtp':
+            timestamp = self.get_timestamp() & 0xFFFFFFFF
+            header = struct.pack('>BBHII', RTP_VERSION, RTP_PAYLOAD_MP2T,
+                                 self.sequence, timestamp, self.ssrc)
+            self.sequence = (self.sequence + 1) & 0xFFFF
+            _payload = header + _payload
+        try:
+            self.sock.sendto(_payload, (self.ip, self.port))
+            self.bytes_sent += len(_payload)
+            self.bytes_since_pcr += len(_payload)
+        except OSError as ex:
+            if ex.errno in [errno.ENOBUFS, errno.EAGAIN]:
+                self.logger.debug('UDP send buffer full, datagram dropped {}'.format(self))
+            else:
+                raise
+
+    def update_clock(self, _pcr):
+        """
+        Updates the stream rate from the PCR ticks between two PCRs
+        """
+        if self.last_pcr is not None and self.bytes_since_pcr:
+            ticks = pcr_diff(_pcr, self.last_pcr)
+            if 0 < ticks < PACE_MAX_DRIFT * RTP_CLOCK_RATE:
+                self.ticks_per_byte = ticks / self.bytes_since_pcr
+        self.last_pcr = _pcr
+        self.bytes_since_pcr = 0
+
+    def get_timestamp(self):
+        """
+        RTP timestamp of the datagram being sent.  Uses the last PCR
+        advanced by the bytes sent since, at the measured stream rate.
+        """
+        if self.last_pcr is None:
+            return int(time.monotonic() * RTP_CLOCK_RATE)
+        return self.last_pcr + int(self.bytes_since_pcr * self.ticks_per_byte)
+
+    def pace(self, _pcr):
+        """
+        Waits until the wall clock catches up with the PCR, keeping
+        PACE_PRELOAD seconds ahead for the receiver's buffer.  Resets the
+        clock on a PCR discontinuity or when the stream falls behind.
+        """
+        now = time.monotonic()
+        if self.clock_pcr is not None:
+            send_time = self.clock_time + pcr_diff(_pcr, self.clock_pcr) / RTP_CLOCK_RATE
+            delay = send_time - now
+            if -PACE_MAX_DRIFT < delay < PACE_MAX_DRIFT:
+                if delay > 0:
+                    self.check_control()
+                    time.sleep(delay)
+                return
+        self.clock_pcr = _pcr
+        self.clock_time = now - PACE_PRELOAD
+
+    def check_control(self):
+        """
+        A closed control connection becomes readable with no data.
+        Raises a BrokenPipeError in that case to end the stream.
+        """
+        if self.control_socket is None:
+            return
+        try:
+            readable, _, _ = select.select([self.control_socket], [], [], 0)
+            is_closed = readable and not self.control_socket.recv(1, socket.MSG_PEEK)
+        except (ValueError, OSError):
+            is_closed = True
+        if is_closed:
+            raise BrokenPipeError(errno.EPIPE, 'UDP target control connection closed')
+
+    def close(self):
+        self.remainder = b''
+        self.sock.close()
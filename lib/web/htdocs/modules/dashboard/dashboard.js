@@ -75,5 +75,39 @@ $(document).ready(setTimeout(function(){
         });
         return active;
     }
-    populateDashboard();
+    function listenDashboard() {
+        // the server pushes the status only when it changes
+        if (window.dashboardSource) {
+            window.dashboardSource.close();
+        }
+        var source = new EventSource("/api/dashstatus.events");
+        window.dashboardSource = source;
+        // keepalives do not call onmessage, so close the events as soon
+        // as another page replaces the dashboard or the page is left
+        var observer = new MutationObserver(function() {
+            if($("#dashboard").length === 0) {
+                source.close();
+                observer.disconnect();
+            }
+        });
+        observer.observe(document.getElementById("content"), {childList: true});
+        $(window).on("pagehide", function() {
+            source.close();
+        });
+        source.onmessage = function(event) {
+            if($("#dashboard").length === 0) {
+                source.close();
+                return;
+            }
+            var json_dashboard = JSON.parse(event.data);
+            populateTuner(json_dashboard['tunerstatus']);
+            populateSchedule(json_dashboard['schedstatus']);
+        };
+    }
+
+    if (window.EventSource) {
+        listenDashboard();
+    } else {
+        populateDashboard();
+    }
 }, 1000));
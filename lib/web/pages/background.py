@@ -21,33 +21,58 @@ import importlib.resources
 import mimetypes
 import random
 import pathlib
+import threading
+import time
 
 from lib.web.pages.templates import web_templates
 from lib.common.decorators import getrequest
 
+IMAGE_LIST_TIMEOUT = 300  # seconds before the backgrounds folder is scanned again
+IMAGE_LISTS = {}
+IMAGE_LISTS_LOCK = threading.Lock()
+
 
 @getrequest.route('/background')
 def background(_webserver):
     send_random_image(_webserver)
 
 
+def is_image(_filename):
+    mime_lookup = mimetypes.guess_type(str(_filename))
+    return mime_lookup[0] is not None and mime_lookup[0].startswith('image')
+
+
+def get_image_list(_location, _is_package):
+    """
+    Returns the images found in the theme package or backgrounds folder.
+    Theme packages do not change while running, so they are only listed
+    once, while the backgrounds folder is scanned every IMAGE_LIST_TIMEOUT seconds
+    """
+    with IMAGE_LISTS_LOCK:
+        image_list = IMAGE_LISTS.get(_location)
+        if image_list is not None \
+                and (_is_package or time.time() - image_list[0] < IMAGE_LIST_TIMEOUT):
+            return image_list[1]
+    if _is_package:
+        images = [image for image in importlib.resources.contents(_location)
+                  if is_image(image)]
+    else:
+        if not pathlib.Path(_location).is_dir():
+            raise FileNotFoundError(_location)
+        images = [image for image in pathlib.Path(_location).rglob('*.*')
+                  if is_image(image)]
+    with IMAGE_LISTS_LOCK:
+        IMAGE_LISTS[_location] = (time.time(), images)
+    return images
+
+
 def send_random_image(_webserver):
-    image = None
     if not _webserver.config['display']['backgrounds']:
         background_dir = _webserver.config['paths']['themes_pkg'] + '.' + \
                          _webserver.config['display']['theme']
-        image_list = list(importlib.resources.contents(background_dir))
-        image_found = False
-        count = 10
-        while not image_found and count > 0:
-            image = random.choice(image_list)
-            mime_lookup = mimetypes.guess_type(image)
-            if mime_lookup[0] is not None and \
-                    mime_lookup[0].startswith('image'):
-                image_found = True
-            count -= 1
-        if image_found:
-            _webserver.do_file_response(200, background_dir, image)
+        image_list = get_image_list(background_dir, True)
+        if image_list:
+            _webserver.do_file_response(200, background_dir, random.choice(image_list))
         else:
             _webserver.logger.warning('No Background Image found: ' + background_dir)
             _webserver.do_mime_response(
@@ -56,17 +81,10 @@ def send_random_image(_webserver):
     else:
         lbackground = _webserver.config['display']['backgrounds']
         try:
-            image_found = False
-            count = 10
-            full_image_path = None
-            while not image_found and count > 0:
-                image = random.choice(list(pathlib.Path(lbackground).rglob('*.*')))
+            image_list = get_image_list(lbackground, False)
+            if image_list:
+                image = random.choice(image_list)
                 full_image_path = pathlib.Path(lbackground).joinpath(image)
-                mime_lookup = mimetypes.guess_type(str(full_image_path))
-                if mime_lookup[0] is not None and mime_lookup[0].startswith('image'):
-                    image_found = True
-                count -= 1
-            if image_found:
                 _webserver.do_file_response(200, None, full_image_path)
                 _webserver.logger.debug('Background Image: {}'.format(str(image).replace(lbackground, '.')))
             else:
@@ -19,11 +19,11 @@ substantial portions of the Software.
 import datetime
 import json
 import logging
-import urllib
-import urllib.request
+import threading
+import time
 
 from lib.common.decorators import getrequest
-from lib.common.decorators import handle_url_except
+from lib.clients.tuner_status import TunerStatusBoard
 from lib.db.db_scheduler import DBScheduler
 
 
@@ -41,11 +41,105 @@ def pages_dashstatus_json(_webserver):
     return True
 
 
+@getrequest.route('/api/dashstatus.events')
+def pages_dashstatus_events(_webserver):
+    _webserver.send_response(200)
+    _webserver.send_header('Content-type', 'text/event-stream')
+    _webserver.send_header('Cache-Control', 'no-cache')
+    _webserver.end_headers()
+    DashStatusEvents.serve(_webserver)
+    return True
+
+
+class DashStatusEvents:
+    """
+    Pushes the dashboard status to browsers using Server-Sent Events.
+    A single thread checks the status while any browser is connected
+    and wakes the connections only when the status changes, so the
+    cost does not grow with the number of open dashboards.  The status
+    is only rebuilt when the tuner board sequence numbers or the
+    scheduler database data_version change, and the checks back off
+    to IDLE_POLL_INTERVAL while nothing changes.
+    """
+
+    POLL_INTERVAL = 0.5     # seconds between change checks after a change
+    IDLE_POLL_INTERVAL = 5  # seconds between change checks while nothing changes
+    KEEPALIVE_INTERVAL = 15 # seconds between comments sent to detect closed connections
+
+    condition = threading.Condition()
+    status = None
+    version = 0
+    clients = 0
+    is_running = False
+
+    @classmethod
+    def serve(cls, _webserver):
+        logger = logging.getLogger(__name__)
+        with cls.condition:
+            cls.clients += 1
+            if not cls.is_running:
+                cls.is_running = True
+                t_status = threading.Thread(target=cls.check_status, args=(_webserver.config,))
+                t_status.daemon = True
+                t_status.start()
+        last_version = 0
+        try:
+            while True:
+                with cls.condition:
+                    if cls.version == last_version:
+                        cls.condition.wait(cls.KEEPALIVE_INTERVAL)
+                    status = cls.status
+                    version = cls.version
+                if version != last_version:
+                    last_version = version
+                    _webserver.wfile.write('data: {}\n\n'.format(status).encode())
+                else:
+                    _webserver.wfile.write(b': keepalive\n\n')
+                _webserver.wfile.flush()
+        except IOError as ex:
+            logger.debug('Dashboard events connection closed {}'.format(ex))
+        finally:
+            with cls.condition:
+                cls.clients -= 1
+
+    @classmethod
+    def check_status(cls, _config):
+        dashstatus_js = DashStatusJS(_config)
+        last_change = None
+        interval = cls.POLL_INTERVAL
+        while True:
+            with cls.condition:
+                if cls.clients == 0:
+                    cls.is_running = False
+                    return
+            change = dashstatus_js.get_change_version()
+            if change != last_change or cls.status is None:
+                last_change = change
+                interval = cls.POLL_INTERVAL
+                status = dashstatus_js.get()
+                if status != cls.status:
+                    with cls.condition:
+                        cls.status = status
+                        cls.version += 1
+                        cls.condition.notify_all()
+            else:
+                interval = min(interval * 2, cls.IDLE_POLL_INTERVAL)
+            time.sleep(interval)
+
+
 class DashStatusJS:
 
+    status_board = None
+
     def __init__(self, _config):
         self.logger = logging.getLogger(__name__)
         self.config = _config
+        self.scheduler_db = None
+
+    def get_scheduler_db(self):
+        if self.scheduler_db is None:
+            self.scheduler_db = DBScheduler(self.config)
+        return self.scheduler_db
 
     def get(self):
         js = ''.join([
@@ -55,22 +149,21 @@ class DashStatusJS:
         ])
         return js
 
+    def get_change_version(self):
+        """
+        Returns a value that changes when the tuner or scheduler
+        status may have changed, without building the status
+        """
+        if DashStatusJS.status_board is None:
+            DashStatusJS.status_board = TunerStatusBoard(self.config)
+        return (DashStatusJS.status_board.read_version(),
+                self.get_scheduler_db().get_data_version())
+
     def get_tuner_status(self):
-        web_tuner_url = 'http://localhost:' + \
-                        str(self.config['web']['plex_accessible_port'])
-        url = (web_tuner_url + '/tunerstatus')
-        return self.get_url(url)
-
-    @handle_url_except()
-    def get_url(self, _url):
-        req = urllib.request.Request(_url)
-        with urllib.request.urlopen(req) as resp:
-            result = resp.read()
-        if result is None:
-            return 'null'
-        return result.decode('utf-8')
+        if DashStatusJS.status_board is None:
+            DashStatusJS.status_board = TunerStatusBoard(self.config)
+        return json.dumps(DashStatusJS.status_board.read())
 
     def get_scheduler_status(self):
-        scheduler_db = DBScheduler(self.config)
-        active_tasks = scheduler_db.get_tasks_by_active()
+        active_tasks = self.get_scheduler_db().get_tasks_by_active()
         return json.dumps(active_tasks, default=str)
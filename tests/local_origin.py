@@ -0,0 +1,95 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import http.server
+import threading
+import time
+
+TS_PACKET = b'\x47\x1f\xff\x10' + b'\xff' * 184
+SEGMENT_PACKETS = 70
+
+
+class LocalOrigin:
+    """
+    Local HTTP server with a live m3u8 playlist of short segments.
+    Counts the requests for each path, so tests can check how often
+    the origin was asked for each segment.
+    """
+
+    def __init__(self, _segment_duration=1.0, _window=3):
+        self.segment_duration = _segment_duration
+        self.window = _window
+        self.start_time = time.monotonic()
+        self.frozen_at = None
+        self.requests = {}
+        self.lock = threading.Lock()
+        origin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with origin.lock:
+                    origin.requests[self.path] = origin.requests.get(self.path, 0) + 1
+                if self.path.endswith('.m3u8'):
+                    body = origin.get_playlist().encode()
+                    content_type = 'application/vnd.apple.mpegurl'
+                else:
+                    body = TS_PACKET * SEGMENT_PACKETS
+                    content_type = 'video/mp2t'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/live.m3u8'.format(self.server.server_address[1])
+
+    def freeze(self):
+        """
+        Stops adding segments to the playlist, like a stalled provider
+        """
+        self.frozen_at = time.monotonic()
+
+    def get_playlist(self):
+        now = self.frozen_at or time.monotonic()
+        last = int((now - self.start_time) / self.segment_duration) + self.window
+        first = last - self.window
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:{}'.format(int(self.segment_duration)),
+            '#EXT-X-MEDIA-SEQUENCE:{}'.format(first)]
+        for i in range(first, last):
+            lines.append('#EXTINF:{:.3f},'.format(self.segment_duration))
+            lines.append('seg{}.ts'.format(i))
+        return '\n'.join(lines) + '\n'
+
+    def get_segment_requests(self):
+        with self.lock:
+            return {path: count for path, count in self.requests.items()
+                    if path.endswith('.ts')}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,150 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import gzip
+import itertools
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import lib.common.utils as utils
+
+try:
+    import lib.db.db as db
+    from lib.db.db import DB
+    from lib.db.db_channels import DBChannels
+except ImportError:
+    # the db modules need the packages in requirements.txt
+    DB = None
+
+
+NAMESPACE = 'Provider'
+INSTANCE = 'Default'
+ATSC_PACKET = b'\x47\x40\x00\x10' + bytes(range(184))
+# connection pools are kept per database name, so each test uses its own
+DB_NAMES = ('test_backups{}'.format(i) for i in itertools.count())
+
+
+def make_channels(_uids):
+    return [{
+        'id': str(i),
+        'number': str(i + 1),
+        'name': 'Channel {}'.format(i),
+        'groups_other': None,
+        'thumbnail': None,
+        'thumbnail_size': None} for i in _uids]
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestDBBackups(unittest.TestCase):
+    """
+    Checks the gzip backups restore the database and that SQL text
+    backups made by older versions still restore
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.backup_dir = pathlib.Path(self.tmp_dir, 'backup')
+        self.config = {
+            'paths': {'db_dir': self.tmp_dir},
+            'datamgmt': {'db_files-channels_db': next(DB_NAMES)}}
+        DBChannels.is_version_setup = False
+        self.db = DBChannels(self.config)
+        self.backup_name = self.db.db_name + db.BACKUP_EXT
+        self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(5)))
+
+    def tearDown(self):
+        DB.close_thread()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def get_uids(self):
+        return set(self.db.get_channels(NAMESPACE, INSTANCE).keys())
+
+    def test_backup_and_restore(self):
+        self.db.backup(self.backup_dir)
+        backup_file = pathlib.Path(self.backup_dir, self.backup_name)
+        self.assertTrue(backup_file.is_file())
+        self.assertEqual(os.listdir(self.backup_dir), [self.backup_name])
+        with gzip.open(backup_file, 'rb') as backup_f:
+            self.assertEqual(backup_f.read(16), b'SQLite format 3\x00')
+
+        self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(2)))
+        self.assertEqual(self.db.restore(self.backup_dir), 'Channels Database Restored')
+        self.assertEqual(self.get_uids(), {str(i) for i in range(5)})
+
+    def test_restore_changes_the_channels_version(self):
+        self.db.backup(self.backup_dir)
+        version = self.db.get_channels_version()
+        self.db.restore(self.backup_dir)
+        self.assertGreater(self.db.get_channels_version(), version)
+
+    def test_corrupt_backup_is_not_restored(self):
+        os.mkdir(self.backup_dir)
+        backup_file = pathlib.Path(self.backup_dir, self.backup_name)
+        with gzip.open(backup_file, 'wb') as backup_f:
+            backup_f.write(b'not a database' * 100)
+        msg = self.db.restore_db(self.backup_dir)
+        self.assertIn('Unable to restore', msg)
+        self.assertEqual(os.listdir(self.backup_dir), [self.backup_name])
+        self.assertEqual(self.get_uids(), {str(i) for i in range(5)})
+
+    def test_legacy_sql_restore(self):
+        """
+        Older versions wrote an SQL dump with the thumbnail_size and atsc
+        columns as python literals and without the channels_version table
+        """
+        legacy_path = pathlib.Path(self.tmp_dir, 'legacy.db')
+        conn = sqlite3.connect(legacy_path)
+        try:
+            source_conn = sqlite3.connect(self.db.db_fullpath)
+            source_conn.backup(conn)
+            source_conn.close()
+            for name, in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='trigger'").fetchall():
+                conn.execute('DROP TRIGGER {}'.format(name))
+            conn.execute('DROP TABLE channels_version')
+            conn.execute('UPDATE channels SET thumbnail_size=?, atsc=?', (str((10, 20)), str([ATSC_PACKET])))
+            conn.execute('DELETE FROM channels WHERE uid=?', ('4',))
+            conn.commit()
+            os.mkdir(self.backup_dir)
+            with open(pathlib.Path(self.backup_dir, self.db.db_name + db.SQL_BACKUP_EXT), 'w', encoding='utf-8') as sql_f:
+                for line in conn.iterdump():
+                    sql_f.write('%s\n' % line)
+        finally:
+            conn.close()
+
+        self.assertEqual(self.db.restore(self.backup_dir), 'Channels Database Restored')
+        self.assertEqual(self.get_uids(), {str(i) for i in range(4)})
+        ch = self.db.get_channel('0', NAMESPACE, INSTANCE)
+        self.assertEqual(ch['thumbnail_size'], [10, 20])
+        self.assertEqual(ch['atsc'], [ATSC_PACKET])
+        self.assertIsNotNone(self.db.get_channels_version())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import json
+import shutil
+import tempfile
+import unittest
+
+import lib.common.utils as utils
+
+try:
+    from lib.db.db import DB
+    from lib.db.db_channels import DBChannels
+    import lib.db.db_channels as db_channels
+except ImportError:
+    # the db modules need the packages in requirements.txt
+    DB = None
+
+
+NAMESPACE = 'Provider'
+INSTANCE = 'Default'
+ATSC_PACKET = b'\x47\x40\x00\x10' + bytes(range(184))
+
+
+def make_channels(_uids):
+    return [{
+        'id': str(i),
+        'number': str(i + 1),
+        'name': 'Channel {}'.format(i),
+        'groups_other': None,
+        'thumbnail': None,
+        'thumbnail_size': None} for i in _uids]
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestDBChannels(unittest.TestCase):
+    """
+    Checks saving a channel list replaces the stored list in one transaction
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.config = {
+            'paths': {'db_dir': cls.db_dir},
+            'datamgmt': {'db_files-channels_db': 'test_channels'}}
+        DBChannels.is_version_setup = False
+        cls.db = DBChannels(cls.config)
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.db.del_channels(NAMESPACE, INSTANCE)
+
+    def get_uids(self):
+        return set(self.db.get_channels(NAMESPACE, INSTANCE).keys())
+
+    def test_missing_channels_are_deleted(self):
+        self.assertTrue(self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(10))))
+        self.assertTrue(self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(2))))
+        self.assertEqual(self.get_uids(), {'0', '1'})
+
+    def test_empty_list_deletes_all(self):
+        self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(3)))
+        self.assertTrue(self.db.save_channel_list(NAMESPACE, INSTANCE, []))
+        self.assertEqual(self.get_uids(), set())
+
+    def test_write_many_is_atomic(self):
+        self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(3)))
+        self.assertFalse(self.db.write_many([
+            ('channels_uid_del', [(NAMESPACE, INSTANCE, '0')]),
+            ('channels_uid_del', [(NAMESPACE, INSTANCE)])]))
+        self.assertEqual(self.get_uids(), {'0', '1', '2'})
+
+
+    def test_atsc_round_trip(self):
+        self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(1)))
+        atsc = [ATSC_PACKET, ATSC_PACKET[:4] + b'\x00' * 184]
+        self.db.update_channel_atsc({
+            'namespace': NAMESPACE, 'instance': INSTANCE, 'uid': '0', 'atsc': atsc})
+        self.assertEqual(self.db.get_channel('0', NAMESPACE, INSTANCE)['atsc'], atsc)
+
+    def test_legacy_literals_are_converted(self):
+        self.db.save_channel_list(NAMESPACE, INSTANCE, make_channels(range(2)))
+        conn = self.db.pool.connect()
+        try:
+            conn.execute('UPDATE channels SET thumbnail_size=?, atsc=? WHERE uid=?',
+                         (str((100, 50)), str([ATSC_PACKET]), '0'))
+            conn.execute('UPDATE channels SET thumbnail_size=? WHERE uid=?', ('None', '1'))
+            conn.execute('PRAGMA user_version=0')
+            conn.commit()
+        finally:
+            conn.close()
+        self.db.setup_channel_format()
+        self.assertEqual(self.db.get(db_channels.DB_CHANNELS_TABLE + '_format')[0][0],
+                         db_channels.CHANNEL_FORMAT_VERSION)
+        ch = self.db.get_channel('0', NAMESPACE, INSTANCE)
+        self.assertEqual(ch['thumbnail_size'], [100, 50])
+        self.assertEqual(ch['atsc'], [ATSC_PACKET])
+        self.assertIsNone(self.db.get_channel('1', NAMESPACE, INSTANCE)['thumbnail_size'])
+        for namespace, instance, uid, size_str, atsc_str in self.db.get('channels_encoded'):
+            json.loads(size_str)
+            if atsc_str is not None:
+                json.loads(atsc_str)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import lib.common.utils as utils
+
+try:
+    import lib.db.db as db
+    from lib.db.db import DB
+except ImportError:
+    # the db modules need the packages in requirements.txt
+    DB = None
+
+
+sqlcmds = {
+    'ct': [
+        """
+        CREATE TABLE IF NOT EXISTS items (
+            id    INTEGER PRIMARY KEY,
+            value TEXT
+            )
+        """
+    ],
+    'dt': [
+        """
+        DROP TABLE IF EXISTS items
+        """
+    ],
+    'items_add':
+        """
+        INSERT OR REPLACE INTO items (id, value) VALUES (?, ?)
+        """,
+    'items_get':
+        """
+        SELECT value FROM items WHERE id=?
+        """,
+}
+
+
+def run_in_thread(_target):
+    results = []
+    t = threading.Thread(target=lambda: results.append(_target()))
+    t.start()
+    t.join(10)
+    return results[0] if results else None
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestDBConnections(unittest.TestCase):
+    """
+    Checks the connection settings and that readers are not
+    blocked by a writer
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.config = {'paths': {'db_dir': cls.db_dir}}
+        cls.db = DB(cls.config, 'test_connections', sqlcmds)
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def get_conn(self):
+        self.db.check_connection()
+        return DB.conn[self.db.db_name][threading.get_ident()]
+
+    def test_pragmas(self):
+        conn = self.get_conn()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0],
+                         int(db.BUSY_TIMEOUT * 1000))
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+
+    def test_reader_not_blocked_by_writer(self):
+        self.db.add('items', (1, 'committed'))
+        conn = self.get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE items SET value=? WHERE id=?', ('uncommitted', 1))
+            self.assertEqual(
+                run_in_thread(lambda: self.db.get('items', (1,))[0][0]), 'committed')
+        finally:
+            conn.rollback()
+
+    def test_writers_in_other_threads(self):
+        def add_items(_start):
+            for i in range(_start, _start + 50):
+                self.db.add('items', (i, str(i)))
+            DB.close_thread()
+
+        threads = [threading.Thread(target=add_items, args=(start,)) for start in range(100, 300, 50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(30)
+        self.assertEqual(self.get_conn().execute(
+            'SELECT COUNT(*) FROM items WHERE id >= 100 AND id < 300').fetchone()[0], 200)
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestConnectionPool(unittest.TestCase):
+    """
+    Checks connections go back to the pool when a thread ends and the
+    pool keeps at most POOL_SIZE idle connections
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.db = DB({'paths': {'db_dir': cls.db_dir}}, 'test_pool', sqlcmds)
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def test_checkin_on_thread_exit(self):
+        thread_ids = []
+
+        def query():
+            self.db.get('items', (1,))
+            thread_ids.append(threading.get_ident())
+
+        run_in_thread(query)
+        self.assertNotIn(thread_ids[0], DB.conn[self.db.db_name])
+        self.assertNotIn(thread_ids[0], DB.conn_owners)
+        self.assertTrue(self.db.pool.idle)
+
+    def test_idle_connections_are_bounded(self):
+        barrier = threading.Barrier(db.POOL_SIZE * 2)
+
+        def query():
+            self.db.get('items', (1,))
+            barrier.wait(10)
+
+        threads = [threading.Thread(target=query) for i in range(db.POOL_SIZE * 2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertLessEqual(len(self.db.pool.idle), db.POOL_SIZE)
+
+    def test_expired_connections_are_closed(self):
+        run_in_thread(lambda: self.db.get('items', (1,)))
+        conn, returned = self.db.pool.idle[-1]
+        self.db.pool.close_expired(returned + db.POOL_IDLE_TIMEOUT + 1)
+        self.assertFalse(self.db.pool.idle)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+    def test_stale_guard_does_not_release(self):
+        self.db.get('items', (1,))
+        thread_id = threading.get_ident()
+        conn = DB.conn[self.db.db_name][thread_id]
+        DB.release_thread(thread_id, DB.conn_owners[thread_id] - 1)
+        self.assertIs(DB.conn[self.db.db_name][thread_id], conn)
+        self.assertEqual(self.db.get('items', (1,)), [])
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestThreadInstance(unittest.TestCase):
+    """
+    Checks DB.thread_instance shares one instance within a thread
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.config = {'paths': {'db_dir': cls.db_dir}}
+
+        class ItemsDB(DB):
+
+            def __init__(self, _config):
+                super().__init__(_config, 'test_thread_instance', sqlcmds)
+
+        cls.items_db_class = ItemsDB
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def test_same_instance_in_thread(self):
+        items_db = self.items_db_class.thread_instance(self.config)
+        self.assertIs(self.items_db_class.thread_instance(self.config), items_db)
+
+    def test_other_thread_gets_own_instance(self):
+        items_db = self.items_db_class.thread_instance(self.config)
+        other_db = run_in_thread(lambda: self.items_db_class.thread_instance(self.config))
+        self.assertIsInstance(other_db, self.items_db_class)
+        self.assertIsNot(other_db, items_db)
+
+    def test_close_thread_drops_instance(self):
+        items_db = self.items_db_class.thread_instance(self.config)
+        DB.close_thread()
+        self.assertIsNot(self.items_db_class.thread_instance(self.config), items_db)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import shutil
+import tempfile
+import threading
+import unittest
+
+import lib.common.utils as utils
+
+try:
+    import lib.db.db as db
+    from lib.db.db import DB
+except ImportError:
+    # the db modules need the packages in requirements.txt
+    DB = None
+
+
+sqlcmds = {
+    'ct': [
+        """
+        CREATE TABLE IF NOT EXISTS items (
+            id    INTEGER PRIMARY KEY,
+            grp   INTEGER,
+            value TEXT
+            )
+        """
+    ],
+    'dt': [
+        """
+        DROP TABLE IF EXISTS items
+        """
+    ],
+    'items_add':
+        """
+        INSERT OR REPLACE INTO items (id, grp, value) VALUES (?, ?, ?)
+        """,
+    'items_get':
+        """
+        SELECT * FROM items ORDER BY id
+        """,
+    'items_grp_get':
+        """
+        SELECT id, value FROM items WHERE grp=? ORDER BY id
+        """,
+}
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestGetDictIter(unittest.TestCase):
+    """
+    Checks get_dict_iter returns every row across several fetchmany
+    batches and releases its cursor when closed early
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.db = DB({'paths': {'db_dir': cls.db_dir}}, 'test_dict_iter', sqlcmds)
+        cls.rows = int(db.FETCH_SIZE * 2.5)
+        cls.db.write_many([('items_add', [
+            (i, i % 2, 'value{}'.format(i)) for i in range(cls.rows)])])
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def test_all_rows_in_order(self):
+        rows = list(self.db.get_dict_iter('items'))
+        self.assertEqual(len(rows), self.rows)
+        self.assertEqual([row['id'] for row in rows], list(range(self.rows)))
+        self.assertEqual(rows[-1], {'id': self.rows - 1, 'grp': (self.rows - 1) % 2,
+                                    'value': 'value{}'.format(self.rows - 1)})
+
+    def test_where_bindings(self):
+        rows = list(self.db.get_dict_iter('items_grp', (1,)))
+        self.assertEqual([row['id'] for row in rows], list(range(1, self.rows, 2)))
+        self.assertEqual(set(rows[0].keys()), {'id', 'value'})
+
+    def test_sql_argument(self):
+        rows = list(self.db.get_dict_iter(None, (0,), sql='SELECT id FROM items WHERE grp=?'))
+        self.assertEqual(len(rows), (self.rows + 1) // 2)
+
+    def test_empty_result(self):
+        self.assertEqual(list(self.db.get_dict_iter('items_grp', (5,))), [])
+
+    def test_close_early(self):
+        rows = self.db.get_dict_iter('items')
+        self.assertEqual(next(rows)['id'], 0)
+        rows.close()
+        self.assertTrue(self.db.write_many([('items_add', [(self.rows, 3, 'last')])]))
+        self.assertEqual(self.db.get('items_grp', (3,)), [(self.rows, 'last')])
+
+    def test_two_iterators_in_one_thread(self):
+        first = self.db.get_dict_iter('items_grp', (0,))
+        second = self.db.get_dict_iter('items_grp', (1,))
+        pairs = list(zip(first, second))
+        self.assertEqual(pairs[0][0]['id'], 0)
+        self.assertEqual(pairs[0][1]['id'], 1)
+        self.assertGreaterEqual(len(pairs), self.rows // 2)
+
+    def test_other_thread_reads_during_iteration(self):
+        rows = self.db.get_dict_iter('items')
+        next(rows)
+        results = []
+        t = threading.Thread(target=lambda: results.append(len(list(self.db.get_dict_iter('items')))))
+        t.start()
+        t.join(10)
+        rows.close()
+        self.assertGreaterEqual(results[0], self.rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import datetime
+import shutil
+import tempfile
+import threading
+import unittest
+
+import lib.common.utils as utils
+
+try:
+    from lib.db.db import DB
+    from lib.db.db_channels import DBChannels
+    from lib.db.db_epg import DBepg
+    from lib.db.db_epg_programs import DBEpgPrograms
+except ImportError:
+    # the db modules need the packages in requirements.txt
+    DB = None
+
+
+NAMESPACES = 5
+CHANNELS = 400
+DAYS = 14
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestDBQueryPlans(unittest.TestCase):
+    """
+    Checks the queries on populated databases use the indexes
+    instead of scanning the tables
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.config = {
+            'paths': {'db_dir': cls.db_dir},
+            'datamgmt': {
+                'db_files-channels_db': 'channels',
+                'db_files-epg_db': 'epg',
+                'db_files-epg_programs_db': 'epg_programs'}}
+        cls.channels_db = DBChannels(cls.config)
+        cls.epg_db = DBepg(cls.config)
+        cls.programs_db = DBEpgPrograms(cls.config)
+        today = datetime.date.today()
+        for ns in range(NAMESPACES):
+            namespace = 'Provider{}'.format(ns)
+            cls.channels_db.save_channel_list(namespace, 'Default', [{
+                'id': str(i),
+                'number': str(i + 1),
+                'name': 'Channel {}'.format(i),
+                'groups_other': None,
+                'thumbnail': None,
+                'thumbnail_size': None} for i in range(CHANNELS)])
+            cls.epg_db.write_many([('epg_add', [(
+                namespace, 'Default', today - datetime.timedelta(days=day),
+                datetime.datetime.utcnow(), 'file{}'.format(day)) for day in range(DAYS)])])
+            for i in range(CHANNELS):
+                cls.programs_db.save_program(namespace, str(i), {'title': 'Program {}'.format(i)})
+        cls.programs_db.wait_writes()
+        for db in (cls.channels_db, cls.epg_db, cls.programs_db):
+            DB.optimize_file(db.db_fullpath)
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def query_plan(self, _db, _sqlcmd, _bindings=()):
+        conn = DB.conn[_db.db_name][threading.get_ident()]
+        return ' '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + _sqlcmd, _bindings))
+
+    def assert_index(self, _plan, _index):
+        self.assertRegex(_plan, r'USING (COVERING )?INDEX {}\b'.format(_index))
+
+    def test_channels_by_namespace_instance(self):
+        sqlcmd, bindings = self.channels_db.where_clause('channels_get', (
+            ('namespace=? COLLATE NOCASE', 'provider1'),
+            ('instance=? COLLATE NOCASE', 'default'),
+            ('enabled=?', None)))
+        plan = self.query_plan(self.channels_db, sqlcmd, bindings)
+        self.assert_index(plan, 'channels_ns_(inst|number)')
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertEqual(len(self.channels_db.get_channels('provider1', 'default')), CHANNELS)
+
+    def test_channels_delete_by_namespace_instance(self):
+        sqlcmd, bindings = self.channels_db.where_clause('channels_del', (
+            ('namespace=? COLLATE NOCASE', 'provider1'),
+            ('instance=? COLLATE NOCASE', 'default')))
+        self.assert_index(self.query_plan(self.channels_db, sqlcmd, bindings), 'channels_ns_inst')
+
+    def test_channels_all_sorted(self):
+        sqlcmd, bindings = self.channels_db.where_clause('channels_get', (
+            ('namespace=? COLLATE NOCASE', None),
+            ('instance=? COLLATE NOCASE', ''),
+            ('enabled=?', '%')))
+        self.assertEqual(bindings, ())
+        plan = self.query_plan(self.channels_db, sqlcmd, bindings)
+        self.assert_index(plan, 'channels_number')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_channels_enabled_false_kept(self):
+        sqlcmd, bindings = self.channels_db.where_clause('channels_get', (
+            ('namespace=? COLLATE NOCASE', None),
+            ('instance=? COLLATE NOCASE', None),
+            ('enabled=?', False)))
+        self.assertEqual(bindings, (False,))
+        self.assertEqual(self.channels_db.get_channels(None, None, False), {})
+
+    def test_channel_by_uid(self):
+        sqlcmd, bindings = self.channels_db.where_clause(
+            'channels_one_get',
+            (('namespace=? COLLATE NOCASE', None), ('instance=? COLLATE NOCASE', None)),
+            (('uid=?', '17'),))
+        self.assert_index(self.query_plan(self.channels_db, sqlcmd, bindings), 'channels_uid')
+
+    def test_sorted_channels_default_order(self):
+        sqlcmd, bindings = self.channels_db.where_clause('channels_sorted_get', (
+            ('namespace=? COLLATE NOCASE', 'Provider2'),
+            ('instance=? COLLATE NOCASE', None)))
+        sqlcmd += ' CAST(number as FLOAT), namespace, instance '
+        plan = self.query_plan(self.channels_db, sqlcmd, bindings)
+        self.assert_index(plan, 'channels_ns_number')
+        self.assertNotIn('TEMP B-TREE', plan)
+        rows = self.channels_db.get_sorted_channels('Provider2', None)
+        self.assertEqual([row['number'] for row in rows[:3]], ['1', '2', '3'])
+
+    def test_epg_by_namespace_instance(self):
+        sqlcmd, bindings = self.epg_db.where_clause('epg_get', (
+            ('namespace=? COLLATE NOCASE', 'provider3'),
+            ('instance=? COLLATE NOCASE', 'Default')))
+        plan = self.query_plan(self.epg_db, sqlcmd, bindings)
+        self.assert_index(plan, 'epg_ns_inst_day')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_epg_old_days(self):
+        sqlcmd, bindings = self.epg_db.where_clause(
+            'epg_by_day_get',
+            (('namespace=? COLLATE NOCASE', 'Provider3'), ('instance=? COLLATE NOCASE', None)),
+            (("day < DATE('now',?)", '-2 day'),))
+        self.assert_index(self.query_plan(self.epg_db, sqlcmd, bindings), 'epg_ns_inst_day')
+
+    def test_programs_old_days(self):
+        plan = self.query_plan(
+            self.programs_db,
+            self.programs_db.sqlcmds['programs_by_day_del'], ('Provider4', '-30 day'))
+        self.assert_index(plan, 'programs_ns_update')
+
+
+if __name__ == '__main__':
+    unittest.main()
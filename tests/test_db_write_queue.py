@@ -0,0 +1,139 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import shutil
+import tempfile
+import threading
+import unittest
+
+import lib.common.utils as utils
+
+try:
+    from lib.db.db import DB
+    from lib.db.db import WriteQueue
+except ImportError:
+    # the db modules need the packages in requirements.txt
+    DB = None
+
+
+sqlcmds = {
+    'ct': [
+        """
+        CREATE TABLE IF NOT EXISTS items (
+            id    INTEGER PRIMARY KEY,
+            value TEXT NOT NULL
+            )
+        """
+    ],
+    'ci': [
+        """
+        CREATE INDEX IF NOT EXISTS items_value ON items (value)
+        """
+    ],
+    'dt': [
+        """
+        DROP TABLE IF EXISTS items
+        """
+    ],
+    'items_add':
+        """
+        INSERT OR REPLACE INTO items (id, value) VALUES (?, ?)
+        """,
+    'items_get':
+        """
+        SELECT value FROM items WHERE id=?
+        """,
+}
+
+
+@unittest.skipIf(DB is None, 'database modules not importable')
+class TestWriteQueue(unittest.TestCase):
+    """
+    Checks queued writes are committed together and their failures
+    are reported to the thread that queued them
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+        cls.db_dir = tempfile.mkdtemp()
+        cls.db = DB({'paths': {'db_dir': cls.db_dir}}, 'test_write_queue', sqlcmds)
+
+    @classmethod
+    def tearDownClass(cls):
+        DB.close_thread()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def get_value(self, _id):
+        rows = self.db.get('items', (_id,))
+        return rows[0][0] if rows else None
+
+    def test_queued_writes_are_read_back(self):
+        for i in range(100):
+            self.db.queue_add('items', (i, 'value{}'.format(i)))
+        self.assertEqual(self.get_value(99), 'value99')
+
+    def test_wait_returns_true_when_committed(self):
+        self.assertTrue(self.db.queue_add('items', (1000, 'a'), _wait=True))
+        self.assertEqual(self.get_value(1000), 'a')
+
+    def test_failed_write_is_reported(self):
+        self.db.queue_add('items', (1001, None))
+        self.assertFalse(self.db.queue_add('items', (1002, 'b'), _wait=True))
+        self.assertIsNone(self.get_value(1001))
+        self.assertEqual(self.get_value(1002), 'b')
+        self.assertTrue(self.db.queue_add('items', (1003, 'c'), _wait=True))
+
+    def test_overflow_does_not_stop_the_writer(self):
+        self.assertFalse(self.db.queue_add('items', (2 ** 70, 'd'), _wait=True))
+        self.assertTrue(self.db.queue_add('items', (1004, 'e'), _wait=True))
+        self.assertEqual(self.get_value(1004), 'e')
+
+    def test_other_threads_see_committed_writes(self):
+        self.db.queue_add('items', (1005, 'f'))
+        self.assertTrue(DB.wait_thread_writes())
+        values = []
+        t = threading.Thread(target=lambda: values.append(self.get_value(1005)))
+        t.start()
+        t.join()
+        self.assertEqual(values, ['f'])
+
+    def test_create_indexes_with_queued_writes(self):
+        self.db.queue_add('items', (1006, 'g'))
+        t = threading.Thread(target=self.db.create_indexes, daemon=True)
+        t.start()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.db.queue_add('items', (1007, 'h'))
+        self.db.create_indexes()
+        self.assertEqual(self.get_value(1007), 'h')
+
+    def test_flush_all(self):
+        self.db.queue_add('items', (1008, 'i'))
+        WriteQueue.flush_all()
+        conn = self.db.pool.connect()
+        try:
+            self.assertEqual(conn.execute('SELECT value FROM items WHERE id=1008').fetchone(), ('i',))
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import multiprocessing
+import threading
+import time
+import types
+import unittest
+
+from local_origin import LocalOrigin
+
+try:
+    import lib.streams.m3u8_queue as m3u8_queue
+    from lib.streams.thread_queue import OutQueue
+except ImportError:
+    # the stream modules need the packages in requirements.txt
+    m3u8_queue = None
+
+
+NAMESPACE = 'TestNS'
+INSTANCE = 'default'
+THREAD_ID = 1
+STARTUP_LIMIT = 0.5     # seconds, the old fixed waits alone were over 1s
+STOP_LIMIT = 1.0
+
+
+def get_config():
+    return {
+        'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+        'handler_filehandler': {'enabled': False},
+        'stream': {'vod_retries': 2},
+        NAMESPACE.lower(): {
+            'stream-g_http_timeout': 2,
+            'stream-g_http_retries': 1,
+            'stream-g_concurrent_downloads': 2},
+        NAMESPACE.lower() + '_' + INSTANCE: {
+            'player-enable_full_duplicate_checking': False,
+            'player-enable_url_filter': False,
+            'player-play_all_segments': False,
+            'player-segments_to_play': 1,
+            'player-enable_pts_filter': False,
+            'player-enable_pts_resync': False}}
+
+
+def get_plugins(_config, _url):
+    plugin_obj = types.SimpleNamespace(
+        get_channel_uri_ext=lambda _uid, _instance: _url,
+        is_time_to_refresh_ext=lambda _last_refresh, _instance: False)
+    return types.SimpleNamespace(
+        config_obj=types.SimpleNamespace(data=_config),
+        plugins={NAMESPACE: types.SimpleNamespace(plugin_obj=plugin_obj)})
+
+
+@unittest.skipIf(m3u8_queue is None, 'stream modules not importable')
+class TestM3U8QueueControl(unittest.TestCase):
+    """
+    Runs the m3u8 process against a local origin and measures how long
+    the control messages take.  The timings are bounded by the work
+    done, not by poll intervals.
+    """
+
+    def setUp(self):
+        self.origin = LocalOrigin()
+        self.in_queue = multiprocessing.Queue()
+        self.out_queue = multiprocessing.Queue()
+        self.process = None
+
+    def tearDown(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.origin.close()
+
+    def start_process(self):
+        config = get_config()
+        channel_dict = {
+            'namespace': NAMESPACE, 'instance': INSTANCE, 'uid': '1',
+            'display_number': '1', 'atsc': None, 'json': {}}
+        self.in_queue.put({'thread_id': THREAD_ID, 'uri': 'status'})
+        self.start_time = time.monotonic()
+        self.process = multiprocessing.Process(target=m3u8_queue.start, args=(
+            config, get_plugins(config, self.origin.url), self.in_queue,
+            self.out_queue, channel_dict,))
+        self.process.start()
+
+    def wait_for(self, _uri=None, _timeout=10):
+        """
+        Returns the uris received up to the first message matching _uri,
+        or up to the first segment when _uri is None, with their times
+        """
+        messages = []
+        while True:
+            item = self.out_queue.get(timeout=_timeout)
+            messages.append((item['uri'], time.monotonic() - self.start_time))
+            if item['uri'] == _uri or (_uri is None and item['stream'] is not None):
+                return messages
+
+    def test_start_latency(self):
+        self.start_process()
+        messages = self.wait_for()
+        uris = [uri for uri, elapsed in messages]
+        self.assertEqual(uris[:2], ['running', 'first_segment'])
+        self.assertTrue(uris[-1].endswith('.ts'))
+        self.assertLess(messages[-1][1], STARTUP_LIMIT)
+
+    def test_stop_latency(self):
+        self.start_process()
+        self.wait_for()
+        stop_time = time.monotonic()
+        self.in_queue.put({'thread_id': THREAD_ID, 'uri': 'terminate'})
+        self.process.join(10)
+        self.assertFalse(self.process.is_alive())
+        self.assertLess(time.monotonic() - stop_time, STOP_LIMIT)
+
+    def test_stalled(self):
+        stall_timeout = m3u8_queue.STALL_TIMEOUT
+        m3u8_queue.STALL_TIMEOUT = 1
+        try:
+            self.origin.freeze()
+            self.start_process()
+            first_segment_time = self.wait_for()[-1][1]
+            stalled_time = self.wait_for('stalled')[-1][1]
+        finally:
+            m3u8_queue.STALL_TIMEOUT = stall_timeout
+        self.assertGreaterEqual(stalled_time - first_segment_time, 0.9)
+        self.assertLess(stalled_time - first_segment_time, 1.0 + STARTUP_LIMIT)
+
+
+@unittest.skipIf(m3u8_queue is None, 'stream modules not importable')
+class TestOutQueue(unittest.TestCase):
+
+    def test_wait_not_empty_wakes_on_put(self):
+        out_queue = OutQueue()
+        timer = threading.Timer(0.1, out_queue.put, args=({'uri': 'running'},))
+        start_time = time.monotonic()
+        timer.start()
+        self.assertTrue(out_queue.wait_not_empty(5))
+        self.assertLess(time.monotonic() - start_time, 1.0)
+
+    def test_wait_not_empty_times_out(self):
+        self.assertFalse(OutQueue().wait_not_empty(0.05))
+
+
+if __name__ == '__main__':
+    unittest.main()
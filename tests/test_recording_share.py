@@ -0,0 +1,136 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import io
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+import lib.common.utils as utils
+from local_origin import LocalOrigin
+
+try:
+    from lib.clients.web_handler import WebHTTPHandler
+    from lib.db.db import DB
+    from lib.streams.internal_proxy import InternalProxy
+    from lib.streams.recorder import RecordingProxy
+except ImportError:
+    # the stream modules need the packages in requirements.txt
+    InternalProxy = None
+
+
+NAMESPACE = 'TestNS'
+INSTANCE = 'default'
+WATCH_TIME = 3          # seconds both clients are on the channel
+
+
+@unittest.skipIf(InternalProxy is None, 'stream modules not importable')
+class TestRecordingShare(unittest.TestCase):
+    """
+    Records a channel while a client watches it and checks the origin
+    was asked for each segment once, so both share one provider session
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        utils.logging_setup({
+            'paths': {'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False}})
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.origin = LocalOrigin()
+        self.scan_lists = WebHTTPHandler.rmg_station_scans
+        WebHTTPHandler.rmg_station_scans = {NAMESPACE: ['Idle', 'Idle']}
+        self.config = {
+            'paths': {
+                'db_dir': self.tmp_dir, 'recordings_dir': self.tmp_dir,
+                'logs_dir': None, 'config_file': '/nonexistent/logging.ini'},
+            'handler_filehandler': {'enabled': False},
+            'datamgmt': {
+                'db_files-channels_db': 'channels',
+                'db_files-recordings_db': 'recordings'},
+            'hdhomerun': {'disable_hdhr': True},
+            'stream': {'vod_retries': 2, 'update_sdt': False, 'switch_channel_timeout': 0},
+            NAMESPACE.lower(): {
+                'stream-g_stream_timeout': 20,
+                'stream-g_http_timeout': 2,
+                'stream-g_http_retries': 1,
+                'stream-g_concurrent_downloads': 2},
+            NAMESPACE.lower() + '_' + INSTANCE: {
+                'player-enable_full_duplicate_checking': False,
+                'player-enable_url_filter': False,
+                'player-play_all_segments': False,
+                'player-segments_to_play': 1,
+                'player-enable_pts_filter': False,
+                'player-enable_pts_resync': False}}
+        plugin_obj = types.SimpleNamespace(
+            get_channel_uri_ext=lambda _uid, _instance: self.origin.url,
+            is_time_to_refresh_ext=lambda _last_refresh, _instance: False)
+        self.plugins = types.SimpleNamespace(
+            config_obj=types.SimpleNamespace(data=self.config, refresh_config_data=lambda: None),
+            plugins={NAMESPACE: types.SimpleNamespace(plugin_obj=plugin_obj)})
+        self.channel_dict = {
+            'namespace': NAMESPACE, 'instance': INSTANCE, 'uid': '1',
+            'display_number': '1', 'display_name': 'Channel 1', 'atsc': None, 'json': {}}
+
+    def tearDown(self):
+        WebHTTPHandler.rmg_station_scans = self.scan_lists
+        self.origin.close()
+        DB.close_thread()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def start_client(self, _proxy, _target, *args):
+        resp = _proxy.gen_response(NAMESPACE, INSTANCE, self.channel_dict['display_number'], False)
+        t_client = threading.Thread(target=_target, args=(*args, resp['tuner'],), daemon=True)
+        t_client.start()
+        return resp['tuner'], t_client
+
+    def test_recording_shares_the_watched_stream(self):
+        watcher = InternalProxy(self.plugins, None)
+        watcher_wfile = io.BytesIO()
+        watcher_terminate = queue.Queue()
+        watch_tuner, t_watch = self.start_client(
+            watcher, watcher.stream, dict(self.channel_dict), watcher_wfile, watcher_terminate)
+
+        recorder = RecordingProxy(self.plugins, None, time.time() + WATCH_TIME)
+        filename = RecordingProxy.gen_filename(self.config, self.channel_dict, 'test')
+        record_tuner, t_record = self.start_client(
+            recorder, recorder.record, 1, dict(self.channel_dict), filename, queue.Queue())
+
+        self.assertEqual(watch_tuner, record_tuner)
+        t_record.join(WATCH_TIME + 10)
+        self.assertFalse(t_record.is_alive())
+        watcher_terminate.put(True)
+        t_watch.join(10)
+        self.assertFalse(t_watch.is_alive())
+
+        self.assertGreater(recorder.bytes_written, 0)
+        self.assertGreater(len(watcher_wfile.getvalue()), 0)
+        segment_requests = self.origin.get_segment_requests()
+        self.assertTrue(segment_requests)
+        self.assertEqual(set(segment_requests.values()), {1})
+
+
+if __name__ == '__main__':
+    unittest.main()
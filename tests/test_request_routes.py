@@ -0,0 +1,116 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import re
+import unittest
+
+try:
+    from lib.common.decorators import FileRequest, GetRequest
+except ImportError:
+    # the decorators need the packages in requirements.txt
+    GetRequest = None
+
+
+URLS = [
+    '/', '/index.html', '/api/channels', '/api/channelsx', '/watch/123',
+    '/watch/', '/record/5?name=x', '/auto/v12.1', '/hls/abc/0.ts', '/x/hls/',
+    '/a/b', '/b/a', '/unknown', '/pages/x/y', '']
+
+
+def search_in_order(_request, _name):
+    """
+    Dispatch used before the route table, each route tried in turn
+    """
+    if _name in _request.url2func:
+        return _request.url2func[_name]
+    for uri, func in _request.url2func.items():
+        if type(uri) is re.Pattern and uri.findall(_name):
+            return func
+    return None
+
+
+def make_route(_request, _pattern):
+    def func(_webserver, *args):
+        _webserver.append((_pattern, args))
+    _request.route(_pattern)(func)
+    return func
+
+
+@unittest.skipIf(GetRequest is None, 'decorators not importable')
+class TestRequestRoutes(unittest.TestCase):
+    """
+    Checks the compiled route table finds the same function as
+    trying each route in registration order
+    """
+
+    def setUp(self):
+        self.request = GetRequest()
+        for pattern in ['/', '/api/channels', 'RE:/watch/.+', 'RE:/record/.+',
+                        'RE:/auto/v.+', 'RE:^/hls/', 'RE:/(b)/(a)', 'RE:/a', 'RE:/b$',
+                        'RE:/pages/(x|y)/(?P<name>\\w+)']:
+            make_route(self.request, pattern)
+
+    def test_same_as_search_in_order(self):
+        for url in URLS:
+            self.assertIs(self.request.find_func(url), search_in_order(self.request, url), url)
+
+    def test_first_registered_wins(self):
+        self.assertIs(self.request.find_func('/b/a'), self.request.url2func[re.compile('/(b)/(a)')])
+        self.assertIs(self.request.find_func('/a/b'), self.request.url2func[re.compile('/a')])
+
+    def test_anchored_pattern(self):
+        self.assertIsNotNone(self.request.find_func('/hls/abc/0.ts'))
+        self.assertIsNone(search_in_order(self.request, '/x/hls/'))
+        self.assertIsNone(self.request.find_func('/x/hls/'))
+
+    def test_route_added_after_dispatch(self):
+        self.assertIsNone(self.request.find_func('/late/1'))
+        func = make_route(self.request, 'RE:/late/\\d')
+        self.assertIs(self.request.find_func('/late/1'), func)
+
+    def test_call_url(self):
+        calls = []
+        self.assertTrue(self.request.call_url(calls, '/watch/7', 'arg'))
+        self.assertEqual(calls, [('RE:/watch/.+', ('arg',))])
+        self.assertFalse(self.request.call_url(calls, '/unknown'))
+        self.assertFalse(GetRequest().call_url(calls, '/watch/7'))
+
+
+@unittest.skipIf(GetRequest is None, 'decorators not importable')
+class TestFileRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.request = FileRequest()
+        self.funcs = {prefix: make_route(self.request, prefix)
+                      for prefix in ['/modules', '/modules/x', '/images.v2', '/']}
+
+    def test_first_registered_prefix_wins(self):
+        self.assertIs(self.request.find_func('/modules/x/a.js'), self.funcs['/modules'])
+        self.assertIs(self.request.find_func('/images.v2/a.png'), self.funcs['/images.v2'])
+        self.assertIs(self.request.find_func('/imagesxv2/a.png'), self.funcs['/'])
+
+    def test_no_match(self):
+        request = FileRequest()
+        make_route(request, '/modules')
+        self.assertIsNone(request.find_func('/other'))
+        self.assertIsNone(request.find_func('x/modules'))
+
+
+if __name__ == '__main__':
+    unittest.main()
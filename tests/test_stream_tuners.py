@@ -0,0 +1,83 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import types
+import unittest
+
+try:
+    from lib.clients.web_handler import WebHTTPHandler
+    from lib.streams.stream import Stream
+    from lib.streams.stream_fanout import StreamFanOut
+except ImportError:
+    # the stream modules need the packages in requirements.txt
+    Stream = None
+
+
+NAMESPACE = 'TestNS'
+INSTANCE = 'default'
+
+
+@unittest.skipIf(Stream is None, 'stream modules not importable')
+class TestFindTuner(unittest.TestCase):
+    """
+    Checks requests for the same channel share one tuner, also while
+    the first request is still starting the stream
+    """
+
+    def setUp(self):
+        self.scan_lists = WebHTTPHandler.rmg_station_scans
+        WebHTTPHandler.rmg_station_scans = {NAMESPACE: ['Idle', 'Idle']}
+        plugins = types.SimpleNamespace(config_obj=types.SimpleNamespace(
+            data={'hdhomerun': {'disable_hdhr': True}}))
+        self.stream = Stream(plugins, None)
+
+    def tearDown(self):
+        WebHTTPHandler.rmg_station_scans = self.scan_lists
+
+    def find_tuner(self, _ch_num, _isvod=False):
+        return self.stream.find_tuner(NAMESPACE, INSTANCE, _ch_num, _isvod)
+
+    def test_starting_tuner_is_shared(self):
+        self.assertEqual(self.find_tuner('5'), 0)
+        self.assertEqual(WebHTTPHandler.rmg_station_scans[NAMESPACE][0]['status'], 'Starting')
+        self.assertEqual(self.find_tuner('5'), 0)
+        self.assertEqual(WebHTTPHandler.rmg_station_scans[NAMESPACE][1], 'Idle')
+
+    def test_running_tuner_is_shared(self):
+        self.find_tuner('5')
+        tuner = WebHTTPHandler.rmg_station_scans[NAMESPACE][0]
+        tuner['mux'] = StreamFanOut(1)
+        tuner['status'] = 'Streaming'
+        self.assertEqual(self.find_tuner('5'), 0)
+
+    def test_terminated_tuner_is_not_shared(self):
+        self.find_tuner('5')
+        tuner = WebHTTPHandler.rmg_station_scans[NAMESPACE][0]
+        tuner['mux'] = StreamFanOut(1)
+        tuner['mux'].terminate()
+        self.assertEqual(self.find_tuner('5'), 1)
+
+    def test_other_channel_and_vod_get_a_new_tuner(self):
+        self.find_tuner('5')
+        self.assertEqual(self.find_tuner('5', True), 1)
+        self.assertEqual(self.find_tuner('6'), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
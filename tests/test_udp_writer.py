@@ -0,0 +1,103 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+
+import socket
+import struct
+import time
+import unittest
+
+import lib.streams.udp_writer as udp_writer
+from lib.streams.udp_writer import UDPWriter
+
+RATE = udp_writer.RTP_CLOCK_RATE
+NULL_PACKET = b'\x47\x1f\xff\x10' + b'\xff' * 184
+
+
+def pcr_packet(_pcr):
+    """
+    TS packet with an adaptation field carrying only a PCR
+    """
+    pcr_field = ((_pcr << 15) | 0x7e00).to_bytes(6, 'big')
+    return b'\x47\x01\x00\x20' + bytes([183, 0x10]) + pcr_field + b'\xff' * 176
+
+
+def make_stream(_seconds, _packets_per_pcr=14, _pcr_interval=0.1, _start=0):
+    """
+    Returns a transport stream with a PCR every _pcr_interval seconds
+    """
+    stream = b''
+    for i in range(int(_seconds / _pcr_interval)):
+        stream += pcr_packet((_start + int(i * _pcr_interval * RATE)) % udp_writer.PCR_WRAP)
+        stream += NULL_PACKET * (_packets_per_pcr - 1)
+    return stream
+
+
+class TestUDPWriter(unittest.TestCase):
+    """
+    Checks datagrams are paced by the PCR and the RTP timestamps follow it
+    """
+
+    def setUp(self):
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.settimeout(1)
+        self.target = 'rtp://127.0.0.1:{}'.format(self.receiver.getsockname()[1])
+
+    def tearDown(self):
+        self.receiver.close()
+
+    def receive_all(self):
+        datagrams = []
+        try:
+            while True:
+                datagrams.append(self.receiver.recv(2048))
+        except socket.timeout:
+            return datagrams
+
+    def test_get_pcr(self):
+        self.assertEqual(udp_writer.get_pcr(NULL_PACKET + pcr_packet(123456789)), 123456789)
+        self.assertIsNone(udp_writer.get_pcr(NULL_PACKET * 7))
+
+    def test_pcr_diff_wraps(self):
+        self.assertEqual(udp_writer.pcr_diff(10, udp_writer.PCR_WRAP - 10), 20)
+        self.assertEqual(udp_writer.pcr_diff(0, 100), -100)
+
+    def test_writes_are_paced(self):
+        writer = UDPWriter(self.target)
+        start_time = time.monotonic()
+        writer.write(make_stream(udp_writer.PACE_PRELOAD + 0.5))
+        elapsed = time.monotonic() - start_time
+        writer.close()
+        self.assertGreater(elapsed, 0.3)
+        self.assertLess(elapsed, 1.0)
+
+    def test_rtp_timestamps_follow_pcr(self):
+        start_pcr = udp_writer.PCR_WRAP - RATE // 2
+        writer = UDPWriter(self.target)
+        writer.write(make_stream(1.0, _start=start_pcr))
+        writer.close()
+        timestamps = [struct.unpack('>I', datagram[4:8])[0] for datagram in self.receive_all()]
+        self.assertEqual(timestamps[0], start_pcr & 0xFFFFFFFF)
+        steps = [(b - a) & 0xFFFFFFFF for a, b in zip(timestamps, timestamps[1:])]
+        self.assertTrue(all(step <= RATE // 10 for step in steps))
+        self.assertAlmostEqual(sum(steps) / RATE, 0.9, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+MIT License
+
+Copyright (C) 2023 ROCKY4546
+https://github.com/rocky4546
+
+This file is part of Cabernet
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software
+and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+"""
+
+import http.client
+import logging
+import os
+import socket
+import threading
+import time
+import unittest
+import unittest.mock
+from http.server import ThreadingHTTPServer
+
+try:
+    from lib.clients import web_tuner
+    from lib.clients.web_handler import WebHTTPHandler
+except ImportError:
+    # the client modules need the packages in requirements.txt
+    web_tuner = None
+
+
+IDLE_CONNECTIONS = 8
+RESPONSE_LIMIT = 1.0
+
+
+@unittest.skipIf(web_tuner is None, 'client modules not importable')
+class TestTunerHttpServer(unittest.TestCase):
+    """
+    Runs the tuner handler on a threading server and checks control
+    requests are answered while other connections are held open
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.logger = WebHTTPHandler.logger
+        WebHTTPHandler.logger = logging.getLogger(__name__)
+        # set up the way TunerHttpServer.run does, so the test can stop it
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), web_tuner.FactoryTunerHttpHandler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.idle = []
+
+    def tearDown(self):
+        for sock in self.idle:
+            sock.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        WebHTTPHandler.logger = self.logger
+        # the handler changes to its own directory
+        os.chdir(self.cwd)
+
+    def get(self, _path):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            conn.request('GET', _path)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def test_request_not_blocked_by_open_connections(self):
+        for i in range(IDLE_CONNECTIONS):
+            sock = socket.create_connection(('127.0.0.1', self.port))
+            # a partial request keeps the connection thread waiting
+            sock.sendall(b'GET /tunerstatus HTTP/1.1\r\n')
+            self.idle.append(sock)
+        start_time = time.monotonic()
+        status, body = self.get('/tunerstatus')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'{}')
+        self.assertLess(time.monotonic() - start_time, RESPONSE_LIMIT)
+
+    def test_unknown_request(self):
+        status, body = self.get('/unknown')
+        self.assertEqual(status, 501)
+
+
+    def test_control_request_creates_no_proxies(self):
+        proxies = ('M3U8Redirect', 'InternalProxy', 'HLSProxy', 'FFMpegProxy',
+                   'StreamlinkProxy', 'RecordingProxy')
+        with unittest.mock.patch.multiple(
+                web_tuner, **{name: unittest.mock.DEFAULT for name in proxies}) as mocks:
+            status, body = self.get('/tunerstatus')
+        self.assertEqual(status, 200)
+        for name, mock in mocks.items():
+            self.assertFalse(mock.called, name)
+
+
+if __name__ == '__main__':
+    unittest.main()